@@ -1,13 +1,22 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, g
 from flask_cors import CORS
 import os
-import uuid
-from ocr import extract_text, parse_receipt, estimate_carbon_emissions, CARBON_EMISSIONS
+from ocr import extract_text, parse_receipt, estimate_carbon_emissions, register_shopping_list, iter_receipt_batch
 import logging
 import device
-from transport import calculate_transport_emissions
+from transport import calculate_transport_emissions, calculate_transport_emissions_batch, parse_trips_csv
+import history_store
+import history_writer
+import rollups
+import compaction
+import metrics
+import tariff
 import json
 import datetime
+import io
+import zlib
+import zipfile
+import tarfile
 from datetime import timezone
 
 
@@ -17,111 +26,234 @@ logger = logging.getLogger(__name__)
 
 
 app = Flask(__name__, static_folder='static')
-CORS(app)
-
-ELECTRICITY_HISTORY_PATH = os.path.join(app.static_folder, 'electricity_history.json')
-def _load_electricity_history():
-    if not os.path.exists(ELECTRICITY_HISTORY_PATH):
-        return []
-    history = []
+# asgi.py sends the same CORS headers on the routes it serves without Flask
+CORS_EXPOSE_HEADERS = ['X-Next-Cursor']
+CORS(app, expose_headers=CORS_EXPOSE_HEADERS)
+
+# === HISTORY STORES ===
+rollups.install()
+compaction.start_scheduler()
+
+@app.before_request
+def _begin_history_batch():
+    # Appends made while handling a request are written once, under a file lock
+    history_writer.begin_batch()
+
+@app.after_request
+def _mark_failed_request(response):
+    if response.status_code >= 500:
+        g.request_failed = True
+    return response
+
+@app.teardown_request
+def _end_history_batch(exc):
+    # A request that raised or answered 5xx must not leave partial rows behind
+    history_writer.end_batch(discard=exc is not None or g.get('request_failed', False))
+
+@app.before_request
+def _begin_request_metrics():
+    metrics.begin_request(request.endpoint)
+
+@app.after_request
+def _end_request_metrics(response):
+    metrics.end_request(request.method, response.status_code)
+    return response
+
+@app.teardown_request
+def _end_failed_request_metrics(exc):
+    # No-op unless the request ended without a response (after_request did not run)
+    metrics.end_request(request.method, 500)
+
+# === USER PARTITIONS ===
+# The X-User-Id header (or ?user=) selects the caller's own history partition;
+# requests without one use the shared history unless HISTORY_REQUIRE_USER=1
+REQUIRE_USER = os.environ.get('HISTORY_REQUIRE_USER', '0') == '1'
+USER_ENDPOINTS = {
+    'calculate_device_emissions', 'device_history',
+    'calculate_transport_emissions_endpoint', 'calculate_transport_batch_endpoint', 'transport_history',
+    'upload_electricity_bill', 'save_manual_bill', 'electricity_history', 'reprice_electricity_history',
+    'dashboard_summary',
+}
+
+def request_user(value):
+    """
+    Resolve the partition named by an X-User-Id header or user parameter.
+    Args:
+        value (str): Header or parameter value, or None
+    Returns:
+        str: User id, or None for the shared history
+    Raises:
+        ValueError: If the id is invalid, or missing while HISTORY_REQUIRE_USER=1
+    """
+    user = history_store.check_user(value)
+    if user is None and REQUIRE_USER:
+        raise ValueError("X-User-Id header or user parameter required")
+    return user
+
+@app.before_request
+def _resolve_user():
+    g.user = None
+    if request.endpoint not in USER_ENDPOINTS:
+        return None
     try:
-        with open(ELECTRICITY_HISTORY_PATH, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if line:
-                    history.append(json.loads(line))
-    except Exception as e:
-        logger.error(f"Failed to read electricity history: {e}")
-    return history
-
-def _append_electricity_history(entry):
-    os.makedirs(app.static_folder, exist_ok=True)
-    with open(ELECTRICITY_HISTORY_PATH, "a", encoding="utf-8") as f:
-        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
-
-def _load_device_history():
-    if not os.path.exists(DEVICE_HISTORY_PATH):
-        return []
-    history = []
+        g.user = request_user(request.headers.get('X-User-Id') or request.args.get('user'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return None
+
+@app.after_request
+def _vary_by_user(response):
+    # History and summaries differ per user, so shared caches must key on the header
+    if request.endpoint in USER_ENDPOINTS:
+        response.vary.add('X-User-Id')
+    return response
+
+def _load_electricity_history(user=None):
+    return history_store.get_store('electricity', user=user).load(descending=True)
+
+def _append_electricity_history(entry, user=None):
+    history_store.get_store('electricity', user=user).append(entry)
+
+def _load_device_history(user=None):
+    return history_store.get_store('device', user=user).load()
+
+def _append_device_history(entries, user=None):
+    history_store.get_store('device', user=user).append_many(entries)
+
+def _load_transport_history(user=None):
+    return history_store.get_store('transport', user=user).load()
+
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+def _export_chunks(records, fmt):
+    """Serialize records lazily, grouping lines into ~64 KB chunks"""
+    buffer, size = [], 0
+    if fmt == 'json':
+        buffer.append('[')
+    for index, record in enumerate(records):
+        line = json.dumps(record, ensure_ascii=False)
+        if fmt == 'json':
+            line = (',' if index else '') + line
+        else:
+            line += '\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield ''.join(buffer).encode('utf-8')
+            buffer, size = [], 0
+    if fmt == 'json':
+        buffer.append(']')
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def _history_export(name, fmt):
+    """Stream a whole history store (optionally within from/to) as NDJSON or a JSON array"""
+    if fmt not in ('ndjson', 'json'):
+        return jsonify({"error": "export must be 'ndjson' or 'json'"}), 400
     try:
-        with open(DEVICE_HISTORY_PATH, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if line:
-                    history.append(json.loads(line))
-    except Exception as e:
-        logger.error(f"Failed to read device history: {e}")
-    return history
-
-def _append_device_history(entry):
-    os.makedirs(os.path.dirname(DEVICE_HISTORY_PATH), exist_ok=True)
-    with open(DEVICE_HISTORY_PATH, "a", encoding="utf-8") as f:
-        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
-def _append_device_history(entry):
-    _ensure_static_folder()
-    with open(DEVICE_HISTORY_PATH, "a", encoding="utf-8") as f:
-        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
-
-def _load_device_history():
-    if not os.path.exists(DEVICE_HISTORY_PATH):
-        return []
-    history = []
+        store = history_store.get_store(name, user=g.user)
+        records = store.iter_range(request.args.get('from'), request.args.get('to'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    body = _export_chunks(records, fmt)
+    headers = {"Content-Disposition": f"attachment; filename={name}_history.{fmt}"}
+    if request.args.get('gzip', '').lower() in ('1', 'true', 'yes'):
+        body = _gzip_chunks(body)
+        headers["Content-Encoding"] = "gzip"
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'application/json'
+    logger.info(f"{name} history export started ({fmt})")
+    return Response(body, mimetype=mimetype, headers=headers)
+
+def _not_modified(tag):
+    """304 response if the client already has this version, else None"""
+    if tag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(tag)
+        return response
+    return None
+
+def _user_tag(user):
+    """ETag prefix so one user's cached version never validates another's"""
+    return f"{user}-" if user else ""
+
+def history_tag(name, user=None):
+    """ETag of a history store; changes with every append or rewrite"""
+    return f"{name}-{_user_tag(user)}{history_store.get_store(name, user=user).version_tag()}"
+
+def _history_page(name, descending=False):
+    """Serve one window of a history store from the from/to/limit/cursor/order query args"""
+    tag = history_tag(name, g.user)
+    cached = _not_modified(tag)
+    if cached is not None:
+        return cached
+    response = _history_body(name, descending)
+    if isinstance(response, Response) and response.status_code == 200:
+        response.set_etag(tag)
+    return response
+
+def _history_order(args, descending):
+    """The endpoint's default order unless ?order=asc|desc overrides it"""
+    order = args.get('order')
+    if order is None:
+        return descending
+    if order.lower() not in ('asc', 'desc'):
+        raise ValueError("order must be 'asc' or 'desc'")
+    return order.lower() == 'desc'
+
+def query_history(name, user, args, descending=False):
+    """
+    One page of a history store, as the history endpoints serve it.
+    Args:
+        name (str): 'device', 'transport' or 'electricity'
+        user (str): Partition, or None for the shared history
+        args (MultiDict): Query args (from, to, limit, cursor, order)
+        descending (bool): Order when the args do not set one
+    Returns:
+        tuple: (records, next_cursor)
+    Raises:
+        ValueError: If a bound, limit, cursor or order is invalid
+    """
+    descending = _history_order(args, descending)
+    with metrics.stage('history_query'):
+        return history_store.get_store(name, user=user).query(
+            start=args.get('from'),
+            end=args.get('to'),
+            limit=args.get('limit', history_store.DEFAULT_PAGE_SIZE, type=int),
+            cursor=args.get('cursor'),
+            descending=descending
+        )
+
+def _history_body(name, descending):
+    export = request.args.get('export')
+    if export:
+        return _history_export(name, export.lower())
     try:
-        with open(DEVICE_HISTORY_PATH, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if line:
-                    history.append(json.loads(line))
-    except Exception as e:
-        logger.error(f"History read error: {e}")
-    return history
-def _ensure_static_folder():
-    os.makedirs(app.static_folder, exist_ok=True)
-
-
-
-import cv2, numpy as np, easyocr, re, os, tempfile
-
-def process_electricity_bill(image_path):
-    x,y,w,h = 730,330,118,50                 # crop coordinates
-    carbon_intensity = 0.82                  # kg CO₂/kWh
-
-    def calc_bill(u):
-        fixed = 20
-        slabs = [(200,3.0),(200,4.5),(400,6.5),(400,7.0),(float('inf'),8.0)]
-        total,rem = fixed,u
-        for sz,rate in slabs:
-            if rem<=0: break
-            take = min(rem,sz) if sz!=float('inf') else rem
-            total += take*rate; rem-=take
-        return round(total,2)
-
-    img = cv2.imread(image_path)
-    if img is None: raise FileNotFoundError("Cannot read image")
-    crop = img[y:y+h, x:x+w]
-    if crop.size==0: raise ValueError("Crop empty")
-    tight = crop[int(crop.shape[0]*0.6):,:]
-    kernel = np.array([[0,-1,0],[-1,5,-1],[0,-1,0]])
-    tight = cv2.filter2D(tight,-1,kernel)
-    tight = cv2.resize(tight,None,fx=4,fy=4,interpolation=cv2.INTER_LINEAR)
-
-    reader = easyocr.Reader(['en'], gpu=False)
-    txt = " ".join([t for _,t,_ in reader.readtext(tight)])
-    cleaned = txt.replace('O','0').replace('o','0').replace('l','1').replace('I','1').replace('g','9')
-    m = re.search(r'\d+(\.\d+)?', cleaned)
-
-    if m:
-        units = float(m.group(0))
-        return {"success":True, "units":units,
-                "bill_amount":calc_bill(units),
-                "co2_emissions":round(units*carbon_intensity,2)}
-    else:
-        return {"success":False, "error":"units_not_detected",
-                "message":"Units not found - please enter manually."}
-
-
-# === DEVICE EMISSIONS HISTORY ===
-DEVICE_HISTORY_PATH = os.path.join(app.static_folder, 'device_emissions_history.json')
+        records, next_cursor = query_history(name, g.user, request.args, descending)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    logger.info(f"{name} history served: {len(records)} entries")
+    with metrics.stage('serialize_response'):
+        response = jsonify(records)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+
+import ocr_readers
+import ocr_cache
+import jobs
+from electricity import process_electricity_bill, bill_intensity, check_bill_date
+
+
 @app.route('/')
 def serve_index():
     try:
@@ -179,6 +311,37 @@ def not_found(e):
     return "Page not found", 404
 
 
+# === OCR ENDPOINTS ===
+# OCR_ENABLED=0 serves only the calculator/history API; cv2, easyocr and torch are never imported
+OCR_ENABLED = os.environ.get('OCR_ENABLED', '1') == '1'
+OCR_ENDPOINTS = {'upload_receipt', 'upload_receipt_batch', 'upload_electricity_bill', 'job_status'}
+
+@app.before_request
+def _require_ocr():
+    if not OCR_ENABLED and request.endpoint in OCR_ENDPOINTS:
+        return jsonify({"error": "OCR is not enabled on this server"}), 503
+
+# === OCR JOB MODE ===
+def _wants_async():
+    flag = request.args.get('async') or request.form.get('async') or ''
+    return flag.lower() in ('1', 'true', 'yes')
+
+def _job_accepted(job_id):
+    return jsonify({
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/jobs/{job_id}"
+    }), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    # asgi.py serves this on its event loop, so a long-poll there holds no thread
+    wait = request.args.get('wait', type=float)
+    job = jobs.wait_for_job(job_id, wait) if wait else jobs.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
 @app.route('/upload', methods=['POST'])
 def upload_receipt():
     try:
@@ -196,19 +359,18 @@ def upload_receipt():
             logger.error("No file selected")
             return jsonify({"error": "No file selected"}), 400
 
-        # Save uploaded file
-        upload_path = f"static/upload_{uuid.uuid4().hex}.png"
-        logger.debug(f"Saving uploaded image to: {upload_path}")
-        file.save(upload_path)
+        # Job mode: hand the pipeline to the OCR worker pool
+        if _wants_async():
+            job_id = jobs.submit('receipt', file.read(), shopping_list=shopping_list)
+            return _job_accepted(job_id)
 
         # Update carbon emissions with shopping list
-        for item in shopping_list:
-            item = item.strip().lower()
-            if item and item not in CARBON_EMISSIONS:
-                CARBON_EMISSIONS[item] = 1.0
+        register_shopping_list(shopping_list)
 
-        # Process receipt
-        text = extract_text(upload_path)
+        # Process receipt straight from the upload stream
+        with metrics.stage('upload_read'):
+            image_bytes = file.read()
+        text = extract_text(image_bytes)
         if not text:
             logger.error("Failed to extract text from image")
             return jsonify({"error": "Failed to extract text from image"}), 500
@@ -221,19 +383,66 @@ def upload_receipt():
         results = estimate_carbon_emissions(items)
         logger.debug(f"Upload response: {results}")
 
-        # Clean up uploaded file
-        try:
-            os.remove(upload_path)
-            logger.debug(f"Removed uploaded file: {upload_path}")
-        except Exception as e:
-            logger.warning(f"Failed to remove uploaded file {upload_path}: {str(e)}")
-
         return jsonify(results)
 
     except Exception as e:
         logger.error(f"Upload endpoint error: {str(e)}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+# === BATCH RECEIPT UPLOAD ===
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+MAX_BATCH_IMAGES = int(os.environ.get('MAX_BATCH_IMAGES', 1000))
+
+def _collect_batch_images(files):
+    """Expand uploaded images and zip/tar archives into (name, bytes) pairs"""
+    images = []
+    for file in files:
+        name = (file.filename or '').lower()
+        if name.endswith('.zip'):
+            with zipfile.ZipFile(io.BytesIO(file.read())) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                        images.append((info.filename, archive.read(info)))
+        elif name.endswith(ARCHIVE_EXTENSIONS):
+            with tarfile.open(fileobj=io.BytesIO(file.read()), mode='r:*') as archive:
+                for member in archive.getmembers():
+                    if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                        images.append((member.name, archive.extractfile(member).read()))
+        elif name:
+            images.append((file.filename, file.read()))
+        if len(images) > MAX_BATCH_IMAGES:
+            raise ValueError(f"Too many images (max {MAX_BATCH_IMAGES})")
+    return images
+
+@app.route('/upload/batch', methods=['POST'])
+def upload_receipt_batch():
+    try:
+        files = request.files.getlist('images') + request.files.getlist('archive')
+        if not files:
+            return jsonify({"error": "No images uploaded"}), 400
+
+        images = _collect_batch_images(files)
+        if not images:
+            return jsonify({"error": "No images found in upload"}), 400
+
+        register_shopping_list(request.form.get('shopping_list', '').split(','))
+        batch_size = request.form.get('batch_size', type=int)
+        logger.debug(f"Batch upload: {len(images)} images")
+
+        def generate():
+            for result in iter_receipt_batch(images, batch_size):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    except (ValueError, zipfile.BadZipFile, tarfile.TarError) as e:
+        logger.error(f"Batch upload validation error: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Batch upload endpoint error: {str(e)}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
 @app.route('/device/calculate', methods=['POST'])
 def calculate_device_emissions():
     try:
@@ -244,27 +453,29 @@ def calculate_device_emissions():
         results = device.analyze_device(data)
 
         if results.get('success'):
+            timestamp = datetime.datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
             # Save one entry PER DEVICE
-            for item in results['device_breakdown']:
-                entry = {
-                    "timestamp": datetime.datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
+            entries = [
+                {
+                    "timestamp": timestamp,
                     "device": item['device'],
                     "emissions_kg": round(item['emissions_g'] / 1000, 3),  # g → kg
                     "energy_kwh": item['energy_kwh'],
                     "wattage": item['wattage'],
                     "hours": item['hours']
                 }
-                _append_device_history(entry)
+                for item in results['device_breakdown']
+            ]
 
             # Also save total
-            total_entry = {
-                "timestamp": datetime.datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
+            entries.append({
+                "timestamp": timestamp,
                 "device": "All Devices",
                 "emissions_kg": round(results['total_emissions_kg'], 3),
                 "energy_kwh": round(results['total_energy'], 3),
                 "daily_cost": round(results['daily_cost'], 2)
-            }
-            _append_device_history(total_entry)
+            })
+            _append_device_history(entries, g.user)
 
             logger.info("History saved per device")
         return jsonify(results)
@@ -272,13 +483,32 @@ def calculate_device_emissions():
     except Exception as e:
         logger.error(f"Calculate error: {str(e)}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500   
+@app.route('/device/analyze_fleet', methods=['POST'])
+def analyze_device_fleet():
+    try:
+        if 'file' in request.files:
+            data = device.read_fleet_csv(io.TextIOWrapper(request.files['file'].stream, encoding='utf-8'))
+            data.update({k: v for k, v in request.form.items() if k in ('carbon_intensity', 'electricity_rate')})
+        else:
+            data = request.get_json(silent=True)
+        if not data or 'wattage' not in data:
+            return jsonify({"error": "No device data provided"}), 400
+
+        results = device.analyze_fleet(data)
+        if 'error' in results:
+            return jsonify(results), 400
+        return jsonify(results)
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Fleet analysis error: {str(e)}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
 # === HISTORY ENDPOINT ===
 @app.route('/device/history')
 def device_history():
-    history = _load_device_history()
-    history.sort(key=lambda x: x["timestamp"])
-    logger.info(f"History served: {len(history)} entries")
-    return jsonify(history)
+    return _history_page('device')
 
 
 @app.route('/transport/calculate', methods=['POST'])
@@ -294,7 +524,7 @@ def calculate_transport_emissions_endpoint():
         distance = float(data['distance'])
 
         # Calculate emissions using transport.py
-        result = calculate_transport_emissions(transport_mode, distance)
+        result = calculate_transport_emissions(transport_mode, distance, user=g.user)
         logger.debug(f"Transport calculate response: {result}")
         return jsonify(result)
 
@@ -305,37 +535,53 @@ def calculate_transport_emissions_endpoint():
         logger.error(f"Transport calculate endpoint error: {str(e)}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
     
-@app.route('/transport/history')
-def transport_history():
-    json_path = os.path.join(app.static_folder, 'transport_emissions.json')
-
-    if not os.path.exists(json_path):
-        return jsonify([])
-
-    history = []
+@app.route('/transport/calculate_batch', methods=['POST'])
+def calculate_transport_batch_endpoint():
     try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            for line_num, line in enumerate(f, 1):
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    record = json.loads(line)
-                    if isinstance(record, list) and len(record) > 0:
-                        history.append(record[0])
-                    else:
-                        logger.warning(f"Invalid record format at line {line_num}: {line}")
-                except json.JSONDecodeError as e:
-                    logger.error(f"JSON error at line {line_num}: {e} | Line: {line}")
-                    continue  # Skip bad line
+        if 'file' in request.files:
+            trips = parse_trips_csv(io.TextIOWrapper(request.files['file'].stream, encoding='utf-8'))
+        elif request.mimetype == 'text/csv':
+            trips = parse_trips_csv(io.StringIO(request.get_data(as_text=True)))
+        else:
+            data = request.get_json(silent=True)
+            trips = data.get('trips') if isinstance(data, dict) else data
+            if not isinstance(trips, list):
+                return jsonify({"error": "Expected a JSON array of trips or a CSV file"}), 400
+
+        results = calculate_transport_emissions_batch(trips, user=g.user)
+        logger.debug(f"Transport batch calculated: {len(results)} trips")
+        return jsonify({
+            "count": len(results),
+            "total_emissions_kg": round(sum(r['carbon_emissions_kg'] for r in results), 2),
+            "trips": results
+        })
+
+    except ValueError as e:
+        logger.error(f"Transport batch validation error: {str(e)}")
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        logger.error(f"Failed to read transport history file: {e}")
+        logger.error(f"Transport batch endpoint error: {str(e)}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
 
-    return jsonify(history)
+@app.route('/transport/history')
+def transport_history():
+    return _history_page('transport')
 @app.route('/electricity')
 def serve_electricity_page():
     return send_from_directory('static', 'bill.html')
 
+def _save_electricity_result(result, user=None):
+    # === SAVE TO HISTORY IF SUCCESS ===
+    if result.get("success"):
+        entry = {
+            "date": datetime.datetime.now().strftime("%Y-%m-%d"),
+            "units": result["units"],
+            "bill_amount": result["bill_amount"],
+            "co2_emissions": result["co2_emissions"],
+            "tariff": result.get("tariff")
+        }
+        _append_electricity_history(entry, user)
+
 @app.route('/electricity/upload', methods=['POST'])
 def upload_electricity_bill():
     try:
@@ -345,25 +591,27 @@ def upload_electricity_bill():
         if file.filename == '':
             return jsonify({"error": "No file"}), 400
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp:
-            file.save(tmp.name)
-            path = tmp.name
+        region = request.form.get('region') or request.args.get('region')
+        # Resolve the tariff before any OCR so a typo fails fast
+        tariff_name = tariff.get_tariff(request.form.get('tariff') or request.args.get('tariff')).name
 
-        result = process_electricity_bill(path)
-        os.unlink(path)
+        if _wants_async():
+            # The result arrives after this request has ended, so bind the user now
+            user = g.user
+            job_id = jobs.submit('electricity', file.read(), region=region, tariff=tariff_name,
+                                 on_result=lambda result: _save_electricity_result(result, user))
+            return _job_accepted(job_id)
 
-        # === SAVE TO HISTORY IF SUCCESS ===
-        if result.get("success"):
-            entry = {
-                "date": datetime.datetime.now().strftime("%Y-%m-%d"),
-                "units": result["units"],
-                "bill_amount": result["bill_amount"],
-                "co2_emissions": result["co2_emissions"]
-            }
-            _append_electricity_history(entry)
+        with metrics.stage('upload_read'):
+            image_bytes = file.read()
+        result = process_electricity_bill(image_bytes, region=region, tariff_name=tariff_name)
 
+        _save_electricity_result(result, g.user)
         return jsonify(result)
 
+    except ValueError as e:
+        logger.error(f"Electricity upload validation error: {e}")
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Electricity OCR error: {e}")
         return jsonify({"error": str(e)}), 500
@@ -374,52 +622,115 @@ def save_manual_bill():
     try:
         data = request.get_json()
         units = float(data.get('units', 0))
-        date = data.get('date') or datetime.datetime.now().strftime("%Y-%m-%d")
-
-        # === Delhi Slab Calculation ===
-        def calc_bill(u):
-            fixed = 20
-            slabs = [(200,3.0),(200,4.5),(400,6.5),(400,7.0),(float('inf'),8.0)]
-            total, rem = fixed, u
-            for sz, rate in slabs:
-                if rem <= 0: break
-                take = rem if sz == float('inf') else min(rem, sz)
-                total += take * rate
-                rem -= take
-            return round(total, 2)
-
-        bill = calc_bill(units)
-        co2 = round(units * 0.82, 2)
+        date = check_bill_date(data.get('date') or datetime.datetime.now().strftime("%Y-%m-%d"))
+
+        # === Slab tariff (default: Delhi) ===
+        bill_tariff = tariff.get_tariff(data.get('tariff'))
+        bill = bill_tariff.price(units)
+        co2 = round(units * bill_intensity(date, data.get('region')), 2)
 
         # === SAVE TO HISTORY ===
         entry = {
             "date": date,
             "units": units,
             "bill_amount": bill,
-            "co2_emissions": co2
+            "co2_emissions": co2,
+            "tariff": bill_tariff.name
         }
-        _append_electricity_history(entry)
+        _append_electricity_history(entry, g.user)
 
         return jsonify({
             "success": True,
             "units": units,
             "bill_amount": bill,
-            "co2_emissions": co2
+            "co2_emissions": co2,
+            "tariff": bill_tariff.name
         })
 
+    except ValueError as e:
+        logger.error(f"Manual save validation error: {e}")
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Manual save error: {e}")
         return jsonify({"error": str(e)}), 500
 @app.route('/electricity/history')
 def electricity_history():
-    history = _load_electricity_history()
-    history.sort(key=lambda x: x["date"], reverse=True)
-    return jsonify(history)
+    return _history_page('electricity', descending=True)
+
+@app.route('/electricity/tariffs')
+def electricity_tariffs():
+    return jsonify(tariff.list_tariffs())
+
+@app.route('/electricity/reprice', methods=['POST'])
+def reprice_electricity_history():
+    try:
+        data = request.get_json(silent=True) or {}
+        dry_run = str(data.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+        report = tariff.reprice(
+            history_store.get_store('electricity', user=g.user),
+            name=data.get('tariff'), start=data.get('from'), end=data.get('to'), dry_run=dry_run
+        )
+        if report['rewritten']:
+            # Rewrites bypass the append listeners, so bring the dashboard's cost totals up to date
+            rollups.rebuild(g.user)
+        return jsonify(report)
+    except ValueError as e:
+        logger.error(f"Reprice validation error: {e}")
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Reprice error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def summary_tag(user=None):
+    """ETag of the dashboard summary; changes when any of the user's stores does"""
+    return "summary-" + _user_tag(user) + "-".join(
+        history_store.get_store(name, user=user).version_tag() for name in rollups.CATEGORIES
+    )
+
+def build_summary(start=None, end=None, user=None):
+    """Rollup totals between start and end, plus the latest trip"""
+    with metrics.stage('rollups_summary'):
+        summary = rollups.summary(start, end, user=user)
+    latest, _ = history_store.get_store('transport', user=user).query(limit=1, descending=True)
+    summary['latest_transport'] = latest[0] if latest else None
+    return summary
+
+@app.route('/dashboard/summary')
+def dashboard_summary():
+    try:
+        tag = summary_tag(g.user)
+        cached = _not_modified(tag)
+        if cached is not None:
+            return cached
+        summary = build_summary(request.args.get('from'), request.args.get('to'), user=g.user)
+        response = jsonify(summary)
+        response.set_etag(tag)
+        return response
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Dashboard summary error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/ocr/readers')
+def ocr_reader_stats():
+    return jsonify(dict(ocr_readers.reader_metrics(), cache=ocr_cache.stats()))
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics/slow')
+def slow_request_samples():
+    return jsonify(metrics.slow_requests(request.args.get('limit', type=int)))
 
 @app.errorhandler(Exception)
 def handle_exception(e):
     logger.error(f"Unhandled exception: {str(e)}")
     return jsonify({"error": f"Unexpected server error: {str(e)}"}), 500
 
+if OCR_ENABLED and os.environ.get('OCR_WARMUP') == '1':
+    ocr_readers.warm_up()
+
 if __name__=='__main__':
     app.run(debug=False,  use_reloader=False, host='0.0.0.0', port=10000)
\ No newline at end of file
@@ -0,0 +1,241 @@
+import os
+import asyncio
+import logging
+import functools
+import contextvars
+from urllib.parse import parse_qsl
+
+from a2wsgi import WSGIMiddleware
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_etags, quote_etag
+
+import app as app_module
+import jobs
+import metrics
+
+# No basicConfig here: the ASGI server owns logging configuration
+logger = logging.getLogger(__name__)
+
+# Threads for blocking store reads and for the endpoints still served through Flask
+IO_THREADS = int(os.environ.get('ASGI_IO_THREADS', 32))
+# Threads for OCR requests; kept small so CPU-heavy uploads cannot take every I/O thread
+OCR_THREADS = int(os.environ.get('ASGI_OCR_THREADS', 2))
+
+flask_app = app_module.app
+
+# OCR endpoints that run the reader in-process (job_status only polls SQLite)
+CPU_ENDPOINTS = app_module.OCR_ENDPOINTS - {'job_status'}
+
+# GET endpoints answered on the event loop: history name and default order per route
+HISTORY_ENDPOINTS = {
+    'device_history': ('device', False),
+    'transport_history': ('transport', False),
+    'electricity_history': ('electricity', True),
+}
+NATIVE_ENDPOINTS = set(HISTORY_ENDPOINTS) | {'dashboard_summary', 'job_status'}
+
+# Every other route runs on a thread from start to finish, including a streamed response,
+# so the app's per-request state (history batching, metrics) behaves as under gunicorn
+_io_app = WSGIMiddleware(flask_app, workers=IO_THREADS)
+_ocr_app = WSGIMiddleware(flask_app, workers=OCR_THREADS)
+# The native routes borrow the same bounded pool for their store reads
+_io_executor = _io_app.executor
+
+
+def _route(scope):
+    """(endpoint, view_args) of the Flask route matching this request, or (None, {})"""
+    path, root_path = scope['path'], scope.get('root_path', '')
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    try:
+        return flask_app.url_map.bind('localhost').match(path, method=scope['method'])
+    except HTTPException:
+        return None, {}
+
+
+def _query_args(scope):
+    return MultiDict(parse_qsl(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True))
+
+
+def _header(scope, name):
+    for key, value in scope.get('headers', []):
+        if key.lower() == name:
+            return value.decode('latin-1')
+    return None
+
+
+def _pool_for(endpoint, scope):
+    """OCR uploads go to the OCR pool unless they only enqueue a job (?async=1)"""
+    if endpoint not in CPU_ENDPOINTS:
+        return _io_app
+    flag = _query_args(scope).get('async', '')
+    return _io_app if flag.lower() in ('1', 'true', 'yes') else _ocr_app
+
+
+def _merge_cookies(scope):
+    """Join repeated Cookie headers with '; ' (the WSGI adapter would join them with ',')"""
+    headers = scope.get('headers', [])
+    cookies = [value for name, value in headers if name.lower() == b'cookie']
+    if len(cookies) < 2:
+        return scope
+    merged = [(name, value) for name, value in headers if name.lower() != b'cookie']
+    merged.append((b'cookie', b'; '.join(cookies)))
+    return dict(scope, headers=merged)
+
+
+# === NATIVE ROUTES ===
+
+async def _run_io(fn, *args):
+    """Run a blocking call on the I/O pool, keeping this request's metrics context"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _io_executor, functools.partial(context.run, fn, *args))
+
+
+def _json(data):
+    """Serialize like Flask's jsonify (compact, sorted keys, trailing newline)"""
+    return (flask_app.json.dumps(data, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def _history_response(name, user, args, descending, if_none_match):
+    tag = app_module.history_tag(name, user)
+    headers = [('ETag', quote_etag(tag))]
+    if tag in if_none_match:
+        return 304, b'', headers
+    records, next_cursor = app_module.query_history(name, user, args, descending)
+    logger.info(f"{name} history served: {len(records)} entries")
+    with metrics.stage('serialize_response'):
+        body = _json(records)
+    if next_cursor:
+        headers.append(('X-Next-Cursor', next_cursor))
+    return 200, body, headers
+
+
+def _summary_response(user, args, if_none_match):
+    tag = app_module.summary_tag(user)
+    headers = [('ETag', quote_etag(tag))]
+    if tag in if_none_match:
+        return 304, b'', headers
+    summary = app_module.build_summary(args.get('from'), args.get('to'), user=user)
+    return 200, _json(summary), headers
+
+
+async def _job_status(job_id, args):
+    """Long-poll on the loop: the job is re-read on the I/O pool, but no thread waits"""
+    wait = args.get('wait', type=float)
+    job = await _run_io(jobs.get_job, job_id)
+    if wait:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + jobs.wait_seconds(wait)
+        while job is not None and job['status'] not in jobs.FINISHED and loop.time() < deadline:
+            await asyncio.sleep(min(jobs.POLL_INTERVAL, deadline - loop.time()))
+            job = await _run_io(jobs.get_job, job_id)
+    if job is None:
+        return 404, _json({"error": "Job not found"}), []
+    return 200, _json(job), []
+
+
+async def _handle(endpoint, view_args, scope):
+    """(status, body, headers) for a native route, with the same checks as the Flask hooks"""
+    args = _query_args(scope)
+    if endpoint == 'job_status':
+        if not app_module.OCR_ENABLED:
+            return 503, _json({"error": "OCR is not enabled on this server"}), []
+        return await _job_status(view_args['job_id'], args)
+
+    try:
+        user = app_module.request_user(_header(scope, b'x-user-id') or args.get('user'))
+    except ValueError as e:
+        return 400, _json({"error": str(e)}), []
+    if_none_match = parse_etags(_header(scope, b'if-none-match'))
+    try:
+        if endpoint == 'dashboard_summary':
+            return await _run_io(_summary_response, user, args, if_none_match)
+        name, descending = HISTORY_ENDPOINTS[endpoint]
+        return await _run_io(_history_response, name, user, args, descending, if_none_match)
+    except ValueError as e:
+        return 400, _json({"error": str(e)}), []
+
+
+async def _drain(receive):
+    """Read and drop the request body; False if the client went away"""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return False
+        if not message.get('more_body', False):
+            return True
+
+
+async def _serve_native(endpoint, view_args, scope, receive, send):
+    if not await _drain(receive):
+        return
+    metrics.begin_request(endpoint)
+    status = 500
+    try:
+        try:
+            status, body, headers = await _handle(endpoint, view_args, scope)
+        except Exception as e:
+            logger.error(f"Unhandled exception: {str(e)}")
+            status, body, headers = 500, _json({"error": f"Unexpected server error: {str(e)}"}), []
+    finally:
+        metrics.end_request(scope['method'], status)
+
+    if status != 304:
+        headers += [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))]
+    if endpoint in app_module.USER_ENDPOINTS:
+        headers.append(('Vary', 'X-User-Id'))
+    # Same headers flask_cors adds with its defaults (any origin, X-Next-Cursor exposed)
+    headers.append(('Access-Control-Allow-Origin', _header(scope, b'origin') or '*'))
+    headers.append(('Access-Control-Expose-Headers', ', '.join(app_module.CORS_EXPOSE_HEADERS)))
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _is_native(endpoint, scope):
+    if scope['method'] != 'GET' or endpoint not in NATIVE_ENDPOINTS:
+        return False
+    # Exports stream straight from storage, so they keep a thread for the whole response
+    return endpoint not in HISTORY_ENDPOINTS or 'export' not in _query_args(scope)
+
+
+# === ENTRY POINT ===
+
+def shutdown():
+    """Stop both thread pools after their current requests finish"""
+    for middleware in (_io_app, _ocr_app):
+        middleware.executor.shutdown(wait=True)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await asyncio.get_running_loop().run_in_executor(None, shutdown)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI entry point: history, summary and job polls on the loop, the rest on thread pools"""
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] == 'websocket':
+        # No websocket routes: closing before accept makes the server refuse the handshake
+        await receive()
+        return await send({'type': 'websocket.close', 'code': 1000})
+    if scope['type'] != 'http':
+        raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+    endpoint, view_args = _route(scope)
+    if _is_native(endpoint, scope):
+        return await _serve_native(endpoint, view_args, scope, receive, send)
+    return await _pool_for(endpoint, scope)(_merge_cookies(scope), receive, send)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 10000)), lifespan='on')
@@ -0,0 +1,675 @@
+import io
+import os
+import json
+import time
+import random
+import asyncio
+import shutil
+import logging
+import argparse
+import datetime
+import platform
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SECTIONS = ('receipt', 'preprocess', 'device', 'transport', 'history', 'ingest', 'endpoints', 'serving')
+DEFAULT_HISTORY_SIZES = (1000, 10000, 100000)
+RECEIPT_LINES = ["2 kg rice", "1 l milk", "500 g cheese", "6 egg", "1 bread", "3 banana"]
+
+
+class StubReader:
+    """Deterministic stand-in for easyocr.Reader that returns the same lines for every image"""
+
+    def __init__(self, lines=None):
+        self.lines = list(lines or RECEIPT_LINES)
+
+    def readtext(self, image, detail=1, **kwargs):
+        if detail == 0:
+            return list(self.lines)
+        return [([[0, 0], [1, 0], [1, 1], [0, 1]], line, 0.99) for line in self.lines]
+
+    def readtext_batched(self, images, detail=1, **kwargs):
+        return [self.readtext(image, detail) for image in images]
+
+
+# === TIMING ===
+
+def _summarize(samples):
+    """Latency statistics (milliseconds) and throughput for a list of durations in seconds"""
+    ordered = sorted(samples)
+    count = len(ordered)
+    total = sum(ordered)
+
+    def percentile(p):
+        return ordered[min(count - 1, int(round(p / 100 * (count - 1))))] * 1000
+
+    return {
+        'runs': count,
+        'mean_ms': round(total / count * 1000, 4),
+        'min_ms': round(ordered[0] * 1000, 4),
+        'p50_ms': round(percentile(50), 4),
+        'p95_ms': round(percentile(95), 4),
+        'max_ms': round(ordered[-1] * 1000, 4),
+        'per_second': round(count / total, 2) if total else None,
+    }
+
+
+def _timed(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return _summarize(samples)
+
+
+# === SYNTHETIC DATA ===
+
+def _receipt_text(rng, items):
+    import ocr
+    names = list(ocr.CARBON_EMISSIONS)
+    units = ['kg', 'g', 'l', 'unit', '']
+    lines = []
+    for _ in range(items):
+        qty = rng.choice([1, 2, 3, 0.5, 250, 500])
+        lines.append(f"{qty} {rng.choice(units)} {rng.choice(names)}".replace('  ', ' '))
+    return " ".join(lines)
+
+
+def _devices(rng, count):
+    import device
+    names = list(device.DEVICE_CLASS_KEYWORDS)
+    return [
+        {'device': f"{rng.choice(names).title()} {i}", 'wattage': rng.uniform(5, 400), 'hours': rng.uniform(0.5, 12)}
+        for i in range(count)
+    ]
+
+
+def _fleet(rng, count):
+    import device
+    devices = _devices(rng, count)
+    regions = list(device.regional_intensities)
+    return {
+        'device': [d['device'] for d in devices],
+        'wattage': [d['wattage'] for d in devices],
+        'hours': [d['hours'] for d in devices],
+        'region': [rng.choice(regions) for _ in devices],
+    }
+
+
+def _trips(rng, count):
+    from transport import TRANSPORT_EMISSION_FACTORS
+    modes = list(TRANSPORT_EMISSION_FACTORS)
+    return [{'transport_mode': rng.choice(modes), 'distance': round(rng.uniform(1, 800), 1)} for _ in range(count)]
+
+
+def _write_device_history(path, lines, rng):
+    """Write a JSON-lines device history of the given length with timestamps one minute apart"""
+    base = time.mktime((2024, 1, 1, 0, 0, 0, 0, 0, 0))
+    with open(path, 'w', encoding='utf-8') as f:
+        chunk = []
+        for i in range(lines):
+            stamp = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(base + i * 60))
+            chunk.append(
+                f'{{"timestamp":"{stamp}","device":"Device {i % 50}","emissions_kg":{rng.random():.3f},'
+                f'"energy_kwh":{rng.random():.3f},"wattage":60.0,"hours":2.0}}\n'
+            )
+            if len(chunk) >= 10000:
+                f.write(''.join(chunk))
+                chunk = []
+        f.write(''.join(chunk))
+
+
+def _image_bytes(width=1000, height=1000):
+    import cv2
+    _, encoded = cv2.imencode('.png', np.full((height, width, 3), 255, dtype=np.uint8))
+    return encoded.tobytes()
+
+
+def _receipt_photo(rng, width=4000, height=3000, angle=8.0):
+    """
+    Synthetic phone photo of a receipt: white strip with RECEIPT_LINES printed on it,
+    rotated and placed on a darker, slightly noisy background.
+    Returns:
+        tuple: (BGR image, font height in pixels on the receipt as photographed)
+    """
+    import cv2
+    font_scale, thickness = 2.2, 4
+    line_height = int(40 * font_scale)
+    lines = [f"{line} {rng.uniform(0.5, 9):.2f}" for line in RECEIPT_LINES] * 3
+    strip = np.full((line_height * (len(lines) + 2), 1100), 250, dtype=np.uint8)
+    for i, line in enumerate(lines, 1):
+        cv2.putText(strip, line, (40, i * line_height + line_height // 2), cv2.FONT_HERSHEY_SIMPLEX,
+                    font_scale, 20, thickness, cv2.LINE_AA)
+    photo = np.clip(np.random.default_rng(rng.randrange(2 ** 32)).normal(90, 8, (height, width)), 0, 255)
+    photo = photo.astype(np.uint8)
+    center = (width / 2, height / 2)
+    matrix = cv2.getRotationMatrix2D((strip.shape[1] / 2, strip.shape[0] / 2), angle, 1.0)
+    matrix[:, 2] += np.array(center) - [strip.shape[1] / 2, strip.shape[0] / 2]
+    warped = cv2.warpAffine(strip, matrix, (width, height), borderValue=0)
+    mask = cv2.warpAffine(np.full(strip.shape, 255, np.uint8), matrix, (width, height), borderValue=0)
+    photo[mask > 0] = warped[mask > 0]
+    return cv2.cvtColor(photo, cv2.COLOR_GRAY2BGR), int(22 * font_scale)
+
+
+def _item_recall(text):
+    """Share of the printed receipt items that parse_receipt recovers from OCR text"""
+    import ocr
+    expected = {line.split()[-1] for line in RECEIPT_LINES}
+    found = {item['item'] for item in ocr.estimate_carbon_emissions(ocr.parse_receipt(text))}
+    return round(sum(1 for name in expected if any(name in item for item in found)) / len(expected), 3)
+
+
+# === SECTIONS ===
+
+def bench_receipt(args, rng):
+    import ocr
+    text = _receipt_text(rng, args.items)
+    items = ocr.parse_receipt(text)
+    return {
+        'items': len(items),
+        'parse_receipt': _timed(lambda: ocr.parse_receipt(text), args.repeat),
+        'estimate_carbon_emissions': _timed(lambda: ocr.estimate_carbon_emissions(items), args.repeat),
+        'extract_text_stub': _timed(lambda: ocr.extract_text(_image_bytes(400, 300)), args.repeat),
+    }
+
+
+def bench_preprocess(args, rng):
+    """Receipt photo preparation per profile; with --real-ocr also EasyOCR latency and item recall"""
+    import cv2
+    import ocr
+    import ocr_readers
+    photo, font_px = _receipt_photo(rng)
+    encoded = cv2.imencode('.jpg', photo, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+    results = {'photo': f"{photo.shape[1]}x{photo.shape[0]}", 'font_px': font_px}
+    if args.real_ocr:
+        ocr_readers.set_reader_factory(None)
+    try:
+        for profile in ('none', 'receipt', 'document'):
+            img = ocr.preprocess_image(encoded, profile)
+            # Printed height of a capital letter after any downscaling, roughly what the recognizer sees
+            scale = img.shape[1] / float(photo.shape[1]) if profile == 'none' else img.shape[1] / 1100.0
+            result = {
+                'output': f"{img.shape[1]}x{img.shape[0]}",
+                'megapixels': round(img.shape[0] * img.shape[1] / 1e6, 3),
+                'font_px': round(font_px * scale, 1),
+                'preprocess_image': _timed(lambda: ocr.preprocess_image(encoded, profile), args.repeat),
+            }
+            if args.real_ocr:
+                with ocr_readers.get_reader() as reader:
+                    text = " ".join(reader.readtext(img, detail=0))
+                    result['readtext'] = _timed(lambda: reader.readtext(img, detail=0), max(1, args.repeat // 10), 0)
+                result['item_recall'] = _item_recall(text)
+            results[profile] = result
+    finally:
+        if args.real_ocr:
+            ocr_readers.set_reader_factory(StubReader)
+    return results
+
+
+def _write_grid_series(directory, region, years=3):
+    """Hourly intensity CSV with a daily cycle, like a grid operator's export"""
+    os.makedirs(directory, exist_ok=True)
+    start = np.datetime64('2023-01-01T00:00:00')
+    hours = np.arange(years * 365 * 24)
+    values = 300 + 120 * np.sin(hours / 24 * 2 * np.pi)
+    with open(os.path.join(directory, f"{region}.csv"), 'w', encoding='utf-8') as f:
+        f.write("timestamp,intensity\n")
+        f.writelines(f"{start + np.timedelta64(int(h), 'h')}Z,{v:.1f}\n" for h, v in zip(hours, values))
+
+
+def bench_device(args, rng):
+    import device
+    import grid_intensity
+    payload = {'devices': _devices(rng, args.devices), 'carbon_intensity': 475}
+    fleet = _fleet(rng, args.devices)
+    _write_grid_series(os.environ['GRID_INTENSITY_DIR'], 'bench')
+    start = time.perf_counter()
+    grid_intensity.reload()
+    load_ms = round((time.perf_counter() - start) * 1000, 3)
+    grid_payload = {'devices': payload['devices'], 'region': 'bench', 'start': '2024-06-01T08:00:00Z'}
+    starts = grid_intensity.to_epoch('2023-01-01') + np.array([rng.uniform(0, 2 * 365 * 86400) for _ in range(10000)])
+    return {
+        'devices': args.devices,
+        'analyze_device': _timed(lambda: device.analyze_device(payload), args.repeat),
+        'analyze_device_grid': _timed(lambda: device.analyze_device(grid_payload), args.repeat),
+        'analyze_fleet': _timed(lambda: device.analyze_fleet(fleet), args.repeat),
+        'grid_series_load_ms': load_ms,
+        'grid_mean_intensity_1': _timed(
+            lambda: grid_intensity.mean_intensity('bench', '2024-06-01T08:00:00Z', '2024-06-01T17:00:00Z'), args.repeat
+        ),
+        'grid_mean_intensity_10k': _timed(
+            lambda: grid_intensity.mean_intensity('bench', starts, starts + 8 * 3600), args.repeat
+        ),
+    }
+
+
+def bench_transport(args, rng):
+    import transport
+    trips = _trips(rng, args.trips)
+    return {
+        'trips': args.trips,
+        'calculate_transport_emissions': _timed(
+            lambda: transport.calculate_transport_emissions('car_petrol', 42.0), args.repeat
+        ),
+        'calculate_transport_emissions_batch': _timed(
+            lambda: transport.calculate_transport_emissions_batch(trips, save=False), args.repeat
+        ),
+    }
+
+
+def bench_ingest(args, rng):
+    """Bulk CSV ingestion throughput: validate-only, then written into a user partition"""
+    import ingest
+    path = os.path.join(args.workdir, 'ingest_trips.csv')
+    rows = args.ingest_rows
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("transport_mode,distance,timestamp\n")
+        for i, trip in enumerate(_trips(rng, rows)):
+            f.write(f"{trip['transport_mode']},{trip['distance']},2024-{1 + i % 12:02d}-{1 + i % 28:02d}T08:00:00Z\n")
+    results = {'rows': rows}
+    for name, dry_run in (('dry_run', True), ('write', False)):
+        start = time.perf_counter()
+        report = ingest.ingest('transport', path, user='bench-ingest', dry_run=dry_run)
+        elapsed = time.perf_counter() - start
+        results[name] = {'elapsed_s': round(elapsed, 3), 'rows_per_second': round(rows / elapsed, 1),
+                         'written': report['written'], 'invalid': report['invalid']}
+    os.remove(path)
+    return results
+
+
+def bench_history(args, rng):
+    import history_store
+    results = {}
+    for size in args.history_sizes:
+        path = os.path.join(args.workdir, f'bench_history_{size}.json')
+        start = time.perf_counter()
+        _write_device_history(path, size, rng)
+        generated = time.perf_counter() - start
+        repeat = max(1, min(args.repeat, 2_000_000 // size))
+
+        def fresh(**kwargs):
+            return history_store.JsonLinesHistoryStore('device', 'timestamp', path, **kwargs)
+
+        cached = fresh()
+        indexed = fresh(cache=False, mmap_index=True)
+        if os.path.exists(path + '.idx'):
+            os.remove(path + '.idx')
+        results[str(size)] = {
+            'lines': size,
+            'bytes': os.path.getsize(path),
+            'generate_s': round(generated, 3),
+            'load_cold': _timed(lambda: fresh().load(), repeat, warmup=0),
+            'load_uncached': _timed(lambda: fresh(cache=False).load(), repeat, warmup=0),
+            'load_warm': _timed(lambda: cached.load(), repeat),
+            'latest_page_warm': _timed(lambda: cached.query(limit=50, descending=True), repeat),
+            'index_build': _timed(lambda: indexed.query(limit=50, descending=True), 1, warmup=0),
+            'index_open': _timed(lambda: fresh(cache=False, mmap_index=True).query(limit=50, descending=True),
+                                 repeat, warmup=0),
+            'index_latest_page': _timed(lambda: indexed.query(limit=50, descending=True), repeat),
+            'index_range_day': _timed(lambda: indexed.query(start='2024-01-02', end='2024-01-02', limit=1000),
+                                      repeat),
+        }
+        os.remove(path)
+        if os.path.exists(path + '.idx'):
+            os.remove(path + '.idx')
+    return results
+
+
+def _endpoint_cases(rng):
+    """(name, method, path, kwargs factory, accepted status codes) for every API endpoint"""
+    image = _image_bytes()
+    trips = _trips(rng, 100)
+    fleet = _fleet(rng, 1000)
+    devices = _devices(rng, 10)
+    csv_trips = "transport_mode,distance\n" + "\n".join(f"{t['transport_mode']},{t['distance']}" for t in trips)
+
+    def upload(field, count=1):
+        return lambda: {'data': {field: [(io.BytesIO(image), f'r{i}.png') for i in range(count)],
+                                 'shopping_list': 'rice,milk'},
+                        'content_type': 'multipart/form-data'}
+
+    return [
+        ('upload', 'POST', '/upload', upload('image'), (200,)),
+        ('upload_batch_8', 'POST', '/upload/batch', upload('images', 8), (200,)),
+        ('device_calculate', 'POST', '/device/calculate', lambda: {'json': {'devices': devices}}, (200,)),
+        ('device_analyze_fleet_1k', 'POST', '/device/analyze_fleet', lambda: {'json': fleet}, (200,)),
+        ('device_history', 'GET', '/device/history', dict, (200,)),
+        ('device_history_page', 'GET', '/device/history?limit=50', dict, (200,)),
+        ('transport_calculate', 'POST', '/transport/calculate',
+         lambda: {'json': {'transport_mode': 'bus', 'distance': 12}}, (200,)),
+        ('transport_calculate_batch_json', 'POST', '/transport/calculate_batch', lambda: {'json': trips}, (200,)),
+        ('transport_calculate_batch_csv', 'POST', '/transport/calculate_batch',
+         lambda: {'data': csv_trips, 'content_type': 'text/csv'}, (200,)),
+        ('transport_history', 'GET', '/transport/history', dict, (200,)),
+        ('electricity_upload', 'POST', '/electricity/upload', upload('image'), (200,)),
+        ('electricity_save_manual', 'POST', '/electricity/save_manual',
+         lambda: {'json': {'units': rng.uniform(50, 900)}}, (200,)),
+        ('electricity_history', 'GET', '/electricity/history', dict, (200,)),
+        ('dashboard_summary', 'GET', '/dashboard/summary', dict, (200, 304)),
+        ('ocr_readers', 'GET', '/ocr/readers', dict, (200,)),
+    ]
+
+
+def _seed_history(rng, seed):
+    """Seed each store so history reads have realistic sizes"""
+    import history_store
+    history_store.get_store('device').append_many(
+        [dict(d, timestamp=f"2025-01-{1 + i % 28:02d}T00:00:00Z", emissions_kg=0.1, energy_kwh=0.2)
+         for i, d in enumerate(_devices(rng, seed))])
+    history_store.get_store('transport').append_many(
+        [{'transport_mode': t['transport_mode'], 'distance_km': t['distance'], 'carbon_emissions_kg': 1.0,
+          'timestamp': f"2025-02-{1 + i % 28:02d}T00:00:00Z"} for i, t in enumerate(_trips(rng, seed))])
+    history_store.get_store('electricity').append_many(
+        [{'date': f"2025-03-{1 + i % 28:02d}", 'units': 100.0, 'bill_amount': 300.0, 'co2_emissions': 82.0}
+         for i in range(max(1, seed // 100))])
+
+
+def bench_endpoints(args, rng):
+    from app import app
+
+    _seed_history(rng, args.history_seed)
+    client = app.test_client()
+    results = {}
+    for name, method, path, make_kwargs, accepted in _endpoint_cases(rng):
+        statuses = {}
+
+        def call():
+            response = client.open(path, method=method, **make_kwargs())
+            response.get_data()
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        timing = _timed(call, args.requests)
+        unexpected = {code: n for code, n in statuses.items() if code not in accepted}
+        results[name] = dict(timing, method=method, path=path, statuses=statuses)
+        if unexpected:
+            results[name]['error'] = f"unexpected status codes {unexpected}"
+    return results
+
+
+def _rss_mb():
+    """Resident memory of this process in MB"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _pending_job():
+    """A job that never finishes, so every long-poll on it waits out its full timeout"""
+    import jobs
+    now = time.time()
+    conn = jobs._connect()
+    try:
+        with conn:
+            conn.execute("INSERT INTO jobs (id, kind, status, created_at, updated_at) "
+                         "VALUES ('bench', 'receipt', 'queued', ?, ?)", (now, now))
+    finally:
+        conn.close()
+    return 'bench'
+
+
+def _serving_cases(job_id, poll_wait):
+    """Paged history reads, the dashboard summary and a job long-poll"""
+    return [
+        '/transport/history?limit=50',
+        '/device/history?limit=50',
+        '/electricity/history?limit=20',
+        '/dashboard/summary',
+        f'/jobs/{job_id}?wait={poll_wait:g}',
+    ]
+
+
+def _wsgi_load(threads, cases, delay, total):
+    """Flask on `threads` worker threads; each is held for the client's delay, as a sync worker is"""
+    from app import app
+    samples, statuses = [], {}
+    lock = threading.Lock()
+
+    def one(i):
+        start = time.perf_counter()
+        time.sleep(delay)
+        response = app.test_client().get(cases[i % len(cases)])
+        response.get_data()
+        with lock:
+            samples.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, range(total)))
+    return samples, statuses, time.perf_counter() - start
+
+
+async def _asgi_load(concurrency, cases, delay, total):
+    """asgi.app with `concurrency` requests in flight; the client's delay is awaited on the loop"""
+    import asgi
+    gate = asyncio.Semaphore(concurrency)
+    samples, statuses = [], {}
+
+    async def one(i):
+        path, _, query = cases[i % len(cases)].partition('?')
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode(), 'headers': [],
+                 'http_version': '1.1', 'scheme': 'http', 'server': ('bench', 80), 'client': ('127.0.0.1', 0)}
+
+        async def receive():
+            await asyncio.sleep(delay)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses[message['status']] = statuses.get(message['status'], 0) + 1
+
+        async with gate:
+            start = time.perf_counter()
+            await asgi.app(scope, receive, send)
+            samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    asgi.shutdown()
+    return samples, statuses, elapsed
+
+
+def _serving_run(model, concurrency, job_id, args):
+    """Load one worker model; runs in a fresh process so the RSS is that worker's alone"""
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.WARNING))
+    _setup_environment(args.workdir)
+    cases = _serving_cases(job_id, args.poll_wait_ms / 1000)
+    delay = args.client_delay_ms / 1000
+    total = max(args.requests, 4 * concurrency)
+    if model == 'asgi':
+        in_flight = concurrency
+        samples, statuses, elapsed = asyncio.run(_asgi_load(concurrency, cases, delay, total))
+    else:
+        in_flight = 1 if model == 'sync' else min(concurrency, args.threads)
+        samples, statuses, elapsed = _wsgi_load(in_flight, cases, delay, total)
+    rss = _rss_mb()
+    result = dict(_summarize(samples), statuses=statuses, in_flight=in_flight, rss_mb=round(rss, 1),
+                  per_second=round(total / elapsed, 2))
+    result['concurrent_per_gb'] = round(in_flight * 1024 / rss, 2)
+    result['throughput_per_gb'] = round(result['per_second'] * 1024 / rss, 2)
+    if set(statuses) - {200}:
+        result['error'] = f"unexpected status codes {statuses}"
+    return result
+
+
+def bench_serving(args, rng):
+    """
+    One sync worker, one threaded worker (gunicorn --threads) and one ASGI worker under the
+    same read mix. Each request carries --client-delay-ms of network time and one in five is a
+    job long-poll: a thread is held for both, the ASGI worker's native routes wait on the loop.
+    """
+    _seed_history(rng, args.history_seed)
+    job_id = _pending_job()
+    runs = [('sync', 1)] + [(model, c) for c in args.concurrency for model in ('gthread', 'asgi')]
+    results = {'client_delay_ms': args.client_delay_ms, 'poll_wait_ms': args.poll_wait_ms, 'threads': args.threads}
+    for model, concurrency in runs:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            name = model if model == 'sync' else f'{model}_c{concurrency}'
+            results[name] = pool.submit(_serving_run, model, concurrency, job_id, args).result()
+    return results
+
+
+BENCHMARKS = {
+    'receipt': bench_receipt,
+    'preprocess': bench_preprocess,
+    'device': bench_device,
+    'transport': bench_transport,
+    'history': bench_history,
+    'ingest': bench_ingest,
+    'endpoints': bench_endpoints,
+    'serving': bench_serving,
+}
+
+
+# === REPORTING ===
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(current, baseline, key='p50_ms'):
+    """Ratio current/baseline of the given statistic for every benchmark present in both"""
+    ratios = {}
+
+    def walk(cur, base, prefix):
+        if isinstance(cur, dict) and isinstance(base, dict):
+            if key in cur and key in base and base[key]:
+                ratios[prefix] = round(cur[key] / base[key], 3)
+                return
+            for name in cur:
+                if name in base:
+                    walk(cur[name], base[name], f"{prefix}.{name}" if prefix else name)
+
+    walk(current.get('results', {}), baseline.get('results', {}), '')
+    return ratios
+
+
+def _setup_environment(workdir):
+    """Point every store at the scratch directory before the app modules read their settings"""
+    os.environ['HISTORY_DIR'] = os.path.join(workdir, 'history')
+    os.environ['HISTORY_DB'] = os.path.join(workdir, 'history.db')
+    os.environ['HISTORY_USERS_DIR'] = os.path.join(workdir, 'users')
+    os.environ['ROLLUPS_DB'] = os.path.join(workdir, 'rollups.db')
+    os.environ['OCR_JOBS_DB'] = os.path.join(workdir, 'jobs.db')
+    os.environ['METRICS_DIR'] = os.path.join(workdir, 'metrics')
+    os.environ['GRID_INTENSITY_DIR'] = os.path.join(workdir, 'grid_intensity')
+    os.environ.setdefault('HISTORY_COMPACT_INTERVAL_HOURS', '0')
+    # Repeated uploads use the same image; measure the OCR path unless asked to include the cache
+    os.environ.setdefault('OCR_CACHE_SIZE', '0')
+    os.makedirs(os.environ['HISTORY_DIR'], exist_ok=True)
+
+
+def run(args):
+    _setup_environment(args.workdir)
+    import ocr_readers
+    ocr_readers.set_reader_factory(StubReader)
+
+    results = {}
+    for section in args.sections:
+        rng = random.Random(args.seed)
+        logger.warning(f"Running {section} benchmarks")
+        start = time.perf_counter()
+        results[section] = BENCHMARKS[section](args, rng)
+        results[section]['elapsed_s'] = round(time.perf_counter() - start, 3)
+
+    return {
+        'meta': {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'cpu_count': os.cpu_count(),
+            'settings': {k: v for k, v in vars(args).items() if k not in ('workdir', 'output', 'compare')},
+        },
+        'results': results,
+    }
+
+
+def _sizes(value):
+    try:
+        sizes = [int(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected comma-separated counts")
+    if not sizes or min(sizes) <= 0:
+        raise argparse.ArgumentTypeError("counts must be positive")
+    return sizes
+
+
+def _section_list(value):
+    sections = [part.strip() for part in value.split(',') if part.strip()]
+    unknown = [s for s in sections if s not in SECTIONS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown sections {unknown}; choose from {', '.join(SECTIONS)}")
+    return sections
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark CarbonTracker functions and endpoints")
+    parser.add_argument('--sections', type=_section_list, default=list(SECTIONS))
+    parser.add_argument('--repeat', type=int, default=20, help="timed runs per function")
+    parser.add_argument('--requests', type=int, default=50, help="requests per endpoint")
+    parser.add_argument('--items', type=int, default=1000, help="items per synthetic receipt")
+    parser.add_argument('--devices', type=int, default=10000, help="devices per analyze_device call")
+    parser.add_argument('--trips', type=int, default=10000, help="trips per transport batch")
+    parser.add_argument('--history-sizes', type=_sizes, default=list(DEFAULT_HISTORY_SIZES),
+                        help="history file sizes in lines, e.g. 1000,100000,10000000")
+    parser.add_argument('--ingest-rows', type=int, default=100000, help="CSV rows per ingestion run")
+    parser.add_argument('--history-seed', type=int, default=1000, help="records per store before endpoint runs")
+    parser.add_argument('--concurrency', type=_sizes, default=[16, 64, 256],
+                        help="comma-separated in-flight request counts for the serving benchmark")
+    parser.add_argument('--threads', type=int, default=32,
+                        help="threads of the threaded sync worker in the serving benchmark")
+    parser.add_argument('--client-delay-ms', type=float, default=20,
+                        help="simulated network time per request in the serving benchmark")
+    parser.add_argument('--poll-wait-ms', type=float, default=100,
+                        help="wait of the job long-polls in the serving benchmark")
+    parser.add_argument('--real-ocr', action='store_true',
+                        help="run EasyOCR in the preprocess section to measure accuracy (slow; needs easyocr)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--log-level', default='WARNING', help="use DEBUG to include the app's request logging")
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    parser.add_argument('--compare', help="earlier JSON report to compute p50 ratios against")
+    args = parser.parse_args(argv)
+
+    # Configure the root logger first; the app modules' basicConfig calls are then no-ops
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.WARNING))
+    args.workdir = tempfile.mkdtemp(prefix='carbontracker-bench-')
+    try:
+        report = run(args)
+    finally:
+        shutil.rmtree(args.workdir, ignore_errors=True)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            report['p50_ratio_vs_baseline'] = compare(report, json.load(f))
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import datetime
+import threading
+from datetime import timezone
+
+try:
+    import fcntl
+except ImportError:  # non-POSIX: every process that starts the scheduler runs it
+    fcntl = None
+
+import history_store
+import rollups
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Raw entries older than this many days are rolled into daily aggregates
+COMPACT_AFTER_DAYS = int(os.environ.get('HISTORY_COMPACT_AFTER_DAYS', 90))
+# Entries (raw or aggregated) older than this many days are deleted; 0 keeps everything
+RETENTION_DAYS = int(os.environ.get('HISTORY_RETENTION_DAYS', 0))
+# > 0 runs compaction in the background every N hours
+COMPACT_INTERVAL_HOURS = float(os.environ.get('HISTORY_COMPACT_INTERVAL_HOURS', 0))
+# Only the process holding this lock runs scheduled compaction, however many workers start the scheduler
+SCHEDULER_LOCK_PATH = os.environ.get('HISTORY_COMPACT_LOCK',
+                                     os.path.join(history_store.HISTORY_DIR, '.compaction.lock'))
+
+# Per store: fields identifying one daily aggregate and fields summed into it.
+# "All Devices" totals are their own group: their daily_cost is stored nowhere else.
+# Electricity bills are kept as they are; only retention applies to them.
+COMPACT_SPECS = {
+    'device': {
+        'group': ('device', 'wattage'),
+        'sum': ('emissions_kg', 'energy_kwh', 'hours', 'daily_cost'),
+    },
+    'transport': {
+        'group': ('transport_mode',),
+        'sum': ('distance_km', 'carbon_emissions_kg'),
+    },
+    'electricity': None,
+}
+
+
+def _cutoff_day(days, now):
+    if not days:
+        return None
+    return (now - datetime.timedelta(days=days)).date().isoformat()
+
+
+def _entry_day(store, entry):
+    day = store.sort_key(entry)[:10]
+    try:
+        datetime.date.fromisoformat(day)
+    except ValueError:
+        return None
+    return day
+
+
+def _number(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class _Compactor:
+    """Plans and applies compaction of one store's records"""
+
+    def __init__(self, store, compact_before, expire_before):
+        self.store = store
+        self.spec = COMPACT_SPECS.get(store.name)
+        self.compact_before = compact_before if self.spec else None
+        self.expire_before = expire_before
+        self.stats = {'records': 0, 'compacted': 0, 'aggregates': 0, 'expired': 0}
+
+    def _action(self, entry):
+        """'expire', 'fold' or 'keep' for one stored entry"""
+        day = _entry_day(self.store, entry)
+        if day is None:
+            return 'keep', None
+        if self.expire_before and day < self.expire_before:
+            return 'expire', day
+        if self.compact_before and day < self.compact_before:
+            return 'fold', day
+        return 'keep', day
+
+    def _plan(self, records):
+        """Single pass: count what would change and build the daily aggregates"""
+        aggregates = {}
+        changed = False
+        for entry in records:
+            self.stats['records'] += 1
+            action, day = self._action(entry)
+            if action == 'expire':
+                self.stats['expired'] += 1
+                changed = True
+            elif action == 'fold':
+                key = (day,) + tuple(entry.get(field) for field in self.spec['group'])
+                totals = aggregates.setdefault(key, [0] + [None] * len(self.spec['sum']))
+                totals[0] += int(entry.get('entries') or 1)
+                # Fields no folded entry has (e.g. daily_cost on per-device rows) stay absent
+                for i, field in enumerate(self.spec['sum'], 1):
+                    if entry.get(field) is not None:
+                        totals[i] = (totals[i] or 0.0) + _number(entry.get(field))
+                if not entry.get('compacted'):
+                    self.stats['compacted'] += 1
+                    changed = True
+        self.stats['aggregates'] = len(aggregates)
+        return aggregates, changed
+
+    def _aggregate_records(self, aggregates):
+        sort_field = self.store.sort_field
+        for key in sorted(aggregates, key=lambda k: tuple(str(part) for part in k)):
+            day, group_values = key[0], key[1:]
+            totals = aggregates[key]
+            record = {sort_field: f"{day}T00:00:00Z"}
+            record.update(zip(self.spec['group'], group_values))
+            for i, field in enumerate(self.spec['sum'], 1):
+                if totals[i] is not None:
+                    record[field] = round(totals[i], 2 if field == 'daily_cost' else 3)
+            record['entries'] = totals[0]
+            record['compacted'] = True
+            yield record
+
+    def transform(self, records):
+        aggregates, changed = self._plan(records())
+        if not changed:
+            return None
+
+        def generate():
+            # Aggregates cover the oldest days, so they go first to keep the file roughly in order
+            yield from self._aggregate_records(aggregates)
+            for entry in records():
+                if self._action(entry)[0] == 'keep':
+                    yield entry
+        return generate()
+
+
+def _compact_partition(names, compact_before, expire_before, dry_run, user):
+    report = {}
+    for name in names or history_store.STORE_SPECS:
+        store = history_store.get_store(name, user=user)
+        compactor = _Compactor(store, compact_before, expire_before)
+        if dry_run:
+            compactor._plan(store.iter_records())
+            rewritten = False
+        else:
+            rewritten = store.rewrite(compactor.transform)
+        report[name] = dict(compactor.stats, rewritten=rewritten)
+        logger.info(f"Compaction of {name} history{f' for user {user}' if user else ''}: {report[name]}")
+    # Aggregates keep their days' totals, but expired rows must leave the dashboard too
+    if any(stats['rewritten'] and stats['expired'] for stats in report.values()):
+        rollups.rebuild(user)
+    return report
+
+
+def compact(names=None, older_than_days=None, retention_days=None, dry_run=False, now=None, users=None):
+    """
+    Roll old history into daily aggregates and apply retention.
+    Args:
+        names (list): Stores to compact (default: all)
+        older_than_days (int): Age after which raw entries are aggregated (default HISTORY_COMPACT_AFTER_DAYS)
+        retention_days (int): Age after which entries are deleted, 0 to keep all (default HISTORY_RETENTION_DAYS)
+        dry_run (bool): Report what would change without rewriting anything
+        now (datetime): Reference time (default: current UTC time)
+        users (list): User partitions to compact, None meaning the shared history
+                      (default: the shared history and every user partition)
+    Returns:
+        dict: Per store counts of records scanned, compacted, aggregates written
+              and expired rows, plus whether it was rewritten.
+              User partitions are reported under "users" by user id.
+    """
+    older_than_days = COMPACT_AFTER_DAYS if older_than_days is None else older_than_days
+    retention_days = RETENTION_DAYS if retention_days is None else retention_days
+    if older_than_days < 0 or retention_days < 0:
+        raise ValueError("Compaction ages must not be negative")
+    now = now or datetime.datetime.now(timezone.utc)
+    compact_before = _cutoff_day(older_than_days, now)
+    expire_before = _cutoff_day(retention_days, now)
+    if users is None:
+        users = [None] + history_store.list_users()
+
+    report = {}
+    for user in users:
+        partition = _compact_partition(names, compact_before, expire_before, dry_run, history_store.check_user(user))
+        if user:
+            report.setdefault('users', {})[user] = partition
+        else:
+            report.update(partition)
+    return report
+
+
+def _try_lead():
+    """Take the scheduler lock without waiting; returns its fd (kept open while leading) or None"""
+    if fcntl is None:
+        return -1
+    os.makedirs(os.path.dirname(SCHEDULER_LOCK_PATH) or '.', exist_ok=True)
+    fd = os.open(SCHEDULER_LOCK_PATH, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _scheduler_loop(interval):
+    leader = None
+    while True:
+        time.sleep(interval)
+        # Followers retry each interval, so another worker takes over if the leader exits
+        if leader is None:
+            leader = _try_lead()
+            if leader is None:
+                continue
+            logger.info(f"Process {os.getpid()} leads scheduled history compaction")
+        try:
+            compact()
+        except Exception as e:
+            logger.error(f"Scheduled history compaction failed: {e}")
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start_scheduler(interval_hours=None):
+    """
+    Run compact() every interval_hours in a daemon thread (no-op if the interval is 0).
+    Every worker may call this; only the one holding SCHEDULER_LOCK_PATH actually compacts.
+    """
+    global _scheduler
+    interval_hours = COMPACT_INTERVAL_HOURS if interval_hours is None else interval_hours
+    if interval_hours <= 0:
+        return
+    with _scheduler_lock:
+        if _scheduler is not None and _scheduler.is_alive():
+            return
+        _scheduler = threading.Thread(
+            target=_scheduler_loop, args=(interval_hours * 3600,), name="history-compaction", daemon=True
+        )
+        _scheduler.start()
+    logger.info(f"History compaction scheduled every {interval_hours}h")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compact CarbonTracker history and apply retention")
+    parser.add_argument('stores', nargs='*', help="device, transport and/or electricity (default: all)")
+    parser.add_argument('--older-than', type=int, default=None, help="days before raw entries are aggregated")
+    parser.add_argument('--retention', type=int, default=None, help="days before entries are deleted (0 = keep)")
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--user', action='append', dest='users',
+                        help="only this user's partition (repeatable; default: shared history and all users)")
+    args = parser.parse_args()
+    try:
+        result = compact(args.stores or None, args.older_than, args.retention, args.dry_run, users=args.users)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print(json.dumps(result))
@@ -1,3 +1,11 @@
+import re
+import csv
+import time
+import numpy as np
+
+import grid_intensity
+import metrics
+
 regional_intensities = {
     'global': 475,
     'india': 708,
@@ -7,12 +15,13 @@ regional_intensities = {
     'uk': 200,
     'australia': 600
 }
+DEFAULT_INTENSITY = 475
 
 def calculate_emissions(power_watts, hours, carbon_intensity):
-    """Calculate energy consumption and carbon emissions for a device"""
-    if hours <= 0:
+    """Calculate energy consumption and carbon emissions for a device (or arrays of devices)"""
+    if np.any(np.asarray(hours) <= 0):
         raise ValueError("Usage hours must be positive")
-    if power_watts <= 0:
+    if np.any(np.asarray(power_watts) <= 0):
         raise ValueError("Power consumption must be positive")
     
     energy_kwh = (power_watts / 1000) * hours
@@ -53,46 +62,88 @@ def get_reduction_tips(emissions_kg):
     
     return tips[:5] + specific_tips
 
+def _window_starts(start, hours, now):
+    """Epoch start of each usage window: the given start (scalar or per row), else the hours leading up to now"""
+    starts = now - hours * 3600
+    if isinstance(start, (list, tuple)):
+        given = np.array([bool(value) for value in start], dtype=bool)
+        if given.any():
+            starts[given] = grid_intensity.to_epoch([value for value in start if value])
+    elif start:
+        starts[:] = grid_intensity.to_epoch(start)
+    return starts
+
+def usage_intensity(region, hours, start, fallback):
+    """
+    Per-device intensity (g/kWh) and where it came from.
+    A region with a grid intensity series uses its mean over each device's usage
+    window; otherwise the region's static figure, or the fallback.
+    """
+    if grid_intensity.get_series(region) is not None:
+        starts = _window_starts(start, hours, time.time())
+        return grid_intensity.mean_intensity(region, starts, starts + hours * 3600), 'grid'
+    if region in regional_intensities:
+        return np.full(len(hours), float(regional_intensities[region])), 'regional'
+    return np.full(len(hours), float(fallback)), 'default'
+
+@metrics.timed('analyze_device')
 def analyze_device(request_data):
-    """Analyze carbon emissions for multiple devices"""
+    """
+    Analyze carbon emissions for multiple devices.
+    An explicit 'carbon_intensity' (g/kWh) applies to every device. Otherwise a 'region'
+    with a grid intensity series gives each device the mean intensity over its usage
+    window, starting at the device's (or request's) 'start' or else ending now.
+    """
     try:
-        carbon_intensity = float(request_data.get('carbon_intensity', 475))  
         electricity_rate = float(request_data.get('electricity_rate', 10))   
+        region = str(request_data.get('region') or '').lower()
         
         devices = request_data.get('devices', [])
         
         if not devices:
             return {"error": "No devices provided"}
         
-        total_energy = 0
-        total_emissions = 0
-        device_breakdown = []
-        
+        valid_devices = []
         for device in devices:
             try:
                 wattage = float(device.get('wattage', 0))
                 hours = float(device.get('hours', 0))
-                device_name = device.get('device', 'Unknown Device')
-                
                 if wattage <= 0 or hours <= 0:
                     continue
-                
-                energy_kwh, emissions_g = calculate_emissions(wattage, hours, carbon_intensity)
-                total_energy += energy_kwh
-                total_emissions += emissions_g
-                
-                device_breakdown.append({
-                    'device': device_name,
-                    'wattage': wattage,
-                    'hours': hours,
-                    'energy_kwh': round(energy_kwh, 3),
-                    'emissions_g': round(emissions_g, 1)
-                })
-            except (ValueError, TypeError) as e:
+                valid_devices.append((device.get('device', 'Unknown Device'), wattage, hours,
+                                      device.get('start') or request_data.get('start')))
+            except (ValueError, TypeError, AttributeError) as e:
                 continue  
         
-        if total_energy == 0:
+        if not valid_devices:
             return {"error": "No valid devices found"}
+
+        if 'carbon_intensity' in request_data:
+            intensities = np.full(len(valid_devices), float(request_data['carbon_intensity']))
+            source = 'request'
+        else:
+            hours_column = np.array([hours for _, _, hours, _ in valid_devices], dtype=np.float64)
+            intensities, source = usage_intensity(
+                region, hours_column, [start for _, _, _, start in valid_devices], DEFAULT_INTENSITY
+            )
+
+        total_energy = 0
+        total_emissions = 0
+        device_breakdown = []
+        
+        for (device_name, wattage, hours, _), intensity in zip(valid_devices, intensities.tolist()):
+            energy_kwh, emissions_g = calculate_emissions(wattage, hours, intensity)
+            total_energy += energy_kwh
+            total_emissions += emissions_g
+            
+            device_breakdown.append({
+                'device': device_name,
+                'wattage': wattage,
+                'hours': hours,
+                'energy_kwh': round(energy_kwh, 3),
+                'emissions_g': round(emissions_g, 1),
+                'carbon_intensity': round(intensity, 1)
+            })
         
         emissions_kg = total_emissions / 1000
         daily_cost = total_energy * electricity_rate
@@ -110,7 +161,9 @@ def analyze_device(request_data):
             'annual_projection': round(annual_emissions_kg, 2),
             'device_breakdown': device_breakdown,
             'tips': tips,
-            'carbon_intensity': carbon_intensity,
+            # Energy-weighted when devices were used at different intensities
+            'carbon_intensity': round(total_emissions / total_energy, 1) if source == 'grid' else float(intensities[0]),
+            'intensity_source': source,
             'electricity_rate': electricity_rate
         }
         
@@ -130,4 +183,176 @@ def get_device_presets():
         'router': {'wattage': 10, 'name': 'Wi-Fi Router'},
         'printer': {'wattage': 50, 'name': 'Inkjet Printer'},
         'external_hdd': {'wattage': 8, 'name': 'External Hard Drive'}
-    }
\ No newline at end of file
+    }
+
+# Whole words or phrases (an optional plural 's' allowed) that bucket free-text device names
+# into preset classes; ambiguous words like 'switch' or 'phone' only count in a specific phrase
+DEVICE_CLASS_KEYWORDS = {
+    'laptop': ('laptop', 'notebook', 'macbook', 'chromebook'),
+    'desktop': ('desktop', 'pc', 'workstation', 'tower pc', 'imac'),
+    'monitor': ('monitor', 'display', 'screen'),
+    'smartphone': ('smartphone', 'iphone', 'mobile phone', 'cell phone', 'cellphone', 'android phone'),
+    'tablet': ('tablet', 'ipad'),
+    'gaming_console': ('console', 'playstation', 'ps4', 'ps5', 'xbox', 'nintendo switch'),
+    'tv': ('tv', 'television'),
+    'router': ('router', 'wi-fi', 'wifi', 'modem'),
+    'printer': ('printer', 'scanner'),
+    'external_hdd': ('hdd', 'hard drive', 'ssd', 'nas'),
+}
+_DEVICE_CLASS_PATTERNS = [
+    (device_class, re.compile(r'\b(?:' + '|'.join(re.escape(k) for k in keywords) + r')s?\b'))
+    for device_class, keywords in DEVICE_CLASS_KEYWORDS.items()
+]
+
+def classify_device(name):
+    """Map a device name to a preset class key, or 'other'"""
+    name = str(name).lower().replace('_', ' ')
+    for device_class, pattern in _DEVICE_CLASS_PATTERNS:
+        if pattern.search(name):
+            return device_class
+    return 'other'
+
+def read_fleet_csv(stream):
+    """Read a device inventory CSV (device, wattage, hours, optional region/device_class) into columns"""
+    reader = csv.DictReader(stream)
+    if not reader.fieldnames or 'wattage' not in reader.fieldnames or 'hours' not in reader.fieldnames:
+        raise ValueError("CSV must have 'wattage' and 'hours' columns")
+    columns = {field: [] for field in reader.fieldnames}
+    for row in reader:
+        for field in reader.fieldnames:
+            columns[field].append(row[field])
+    return columns
+
+def _as_float_array(values, size):
+    try:
+        return np.asarray(values, dtype=np.float64).reshape(size)
+    except (TypeError, ValueError):
+        out = np.full(size, np.nan)
+        for i, value in enumerate(values):
+            try:
+                out[i] = float(value)
+            except (TypeError, ValueError):
+                pass
+        return out
+
+def _encode_labels(values, fn):
+    """Map each distinct value through fn once; return (sorted labels, per-row label codes)"""
+    keys, inverse = np.unique(np.asarray(values).astype(str), return_inverse=True)
+    mapped = [fn(key) for key in keys.tolist()]
+    labels = sorted(set(mapped))
+    index = {label: i for i, label in enumerate(labels)}
+    return labels, np.array([index[m] for m in mapped], dtype=np.int64)[inverse.reshape(-1)]
+
+def _group_totals(labels, codes, energy, emissions, cost):
+    size = len(labels)
+    counts = np.bincount(codes, minlength=size)
+    energy_sum = np.bincount(codes, weights=energy, minlength=size)
+    emissions_sum = np.bincount(codes, weights=emissions, minlength=size) / 1000
+    cost_sum = np.bincount(codes, weights=cost, minlength=size)
+    return [
+        {
+            'name': label,
+            'devices': int(count),
+            'energy_kwh': round(float(e), 3),
+            'emissions_kg': round(float(kg), 3),
+            'daily_cost': round(float(c), 2),
+            'annual_projection': round(float(kg) * 365, 2)
+        }
+        for label, count, e, kg, c in zip(labels, counts, energy_sum, emissions_sum, cost_sum)
+        if count
+    ]
+
+@metrics.timed('analyze_fleet')
+def analyze_fleet(request_data):
+    """
+    Analyze a whole device inventory in one vectorized pass.
+    Args:
+        request_data (dict): Columns 'wattage' and 'hours' (equal-length lists), optional
+            'device', 'device_class', 'region' and 'start' columns, plus scalar 'carbon_intensity'
+            (used where a row has no known region), 'electricity_rate', 'include_devices'
+            and 'start' (usage window start for every row; default: the hours up to now)
+    Returns:
+        dict: Fleet totals, per-region and per-device-class aggregates
+    """
+    try:
+        carbon_intensity = float(request_data.get('carbon_intensity', 475))
+        electricity_rate = float(request_data.get('electricity_rate', 10))
+
+        wattage_col = request_data.get('wattage') or []
+        size = len(wattage_col)
+        if size == 0:
+            return {"error": "No devices provided"}
+        for column in ('hours', 'device', 'device_class', 'region'):
+            if column in request_data and len(request_data[column]) != size:
+                return {"error": f"Column '{column}' must have {size} values"}
+        start = request_data.get('start')
+        if isinstance(start, (list, tuple)) and len(start) != size:
+            return {"error": f"Column 'start' must have {size} values"}
+
+        wattage = _as_float_array(wattage_col, size)
+        hours = _as_float_array(request_data.get('hours') or [], size) if 'hours' in request_data else np.full(size, np.nan)
+        names = request_data.get('device') or ['Unknown Device'] * size
+
+        # Region and class columns are encoded once per distinct value, then handled as integer codes
+        region_labels, region_codes = _encode_labels(
+            request_data.get('region') or [''] * size,
+            lambda r: r.lower() if r.lower() in regional_intensities or grid_intensity.get_series(r) else 'default'
+        )
+        if 'device_class' in request_data:
+            class_labels, class_codes = _encode_labels(request_data['device_class'], lambda c: c.lower() or 'other')
+        else:
+            class_labels, class_codes = _encode_labels(names, classify_device)
+
+        valid = (wattage > 0) & (hours > 0)
+        skipped = int(size - np.count_nonzero(valid))
+        if not valid.any():
+            return {"error": "No valid devices found"}
+        wattage, hours = wattage[valid], hours[valid]
+        region_codes, class_codes = region_codes[valid], class_codes[valid]
+        if isinstance(start, (list, tuple)):
+            start = np.asarray(start, dtype=object)[valid].tolist()
+
+        # Per-row intensity: the row's region if known, otherwise the request default;
+        # regions with a grid series use its mean over each row's usage window
+        region_table = np.array([regional_intensities.get(label, carbon_intensity) for label in region_labels],
+                                dtype=np.float64)
+        intensity = region_table[region_codes]
+        for code, label in enumerate(region_labels):
+            rows = region_codes == code
+            if grid_intensity.get_series(label) is not None and rows.any():
+                rows_start = np.asarray(start, dtype=object)[rows].tolist() if isinstance(start, list) else start
+                intensity[rows], _ = usage_intensity(label, hours[rows], rows_start, carbon_intensity)
+
+        energy_kwh = wattage / 1000 * hours
+        emissions_g = energy_kwh * intensity
+        cost = energy_kwh * electricity_rate
+
+        total_energy = float(energy_kwh.sum())
+        emissions_kg = float(emissions_g.sum()) / 1000
+        result = {
+            'success': True,
+            'devices': int(valid.sum()),
+            'skipped': skipped,
+            'total_energy': round(total_energy, 3),
+            'total_emissions_kg': round(emissions_kg, 3),
+            'daily_cost': round(total_energy * electricity_rate, 2),
+            'monthly_projection': round(emissions_kg * 30, 2),
+            'annual_projection': round(emissions_kg * 365, 2),
+            'by_region': _group_totals(region_labels, region_codes, energy_kwh, emissions_g, cost),
+            'by_class': _group_totals(class_labels, class_codes, energy_kwh, emissions_g, cost),
+            'tips': get_reduction_tips(emissions_kg),
+            'carbon_intensity': carbon_intensity,
+            'electricity_rate': electricity_rate
+        }
+        if request_data.get('include_devices'):
+            result['device_breakdown'] = {
+                'device': np.asarray(names, dtype=object)[valid].tolist(),
+                'region': np.asarray(region_labels, dtype=object)[region_codes].tolist(),
+                'device_class': np.asarray(class_labels, dtype=object)[class_codes].tolist(),
+                'energy_kwh': np.round(energy_kwh, 3).tolist(),
+                'emissions_g': np.round(emissions_g, 1).tolist()
+            }
+        return result
+
+    except Exception as e:
+        return {"error": f"Fleet analysis failed: {str(e)}"}
@@ -0,0 +1,117 @@
+import os
+import re
+import logging
+import datetime
+
+import numpy as np
+
+import grid_intensity
+import metrics
+import ocr_cache
+import ocr_readers
+import tariff
+from ocr import decode_image
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# kg CO2e/kWh used when the bill's region has no grid intensity series
+FALLBACK_INTENSITY = 0.82
+# Region whose grid intensity series applies to bills by default
+BILL_REGION = os.environ.get('ELECTRICITY_REGION', 'india')
+# A bill's emissions use the mean intensity over this many days up to the bill date
+BILL_PERIOD_DAYS = int(os.environ.get('ELECTRICITY_BILL_DAYS', 30))
+
+
+def check_bill_date(date):
+    """
+    Validate a bill date.
+    Args:
+        date (str): ISO date or timestamp
+    Returns:
+        str: The bill day (YYYY-MM-DD)
+    Raises:
+        ValueError: If the date cannot be parsed
+    """
+    try:
+        return datetime.datetime.fromisoformat(str(date).strip().replace('Z', '+00:00')).date().isoformat()
+    except ValueError:
+        raise ValueError("Invalid 'date' value, expected an ISO date (YYYY-MM-DD)")
+
+
+def bill_intensity(date=None, region=None):
+    """
+    Carbon intensity for a bill.
+    Args:
+        date (str): Bill date (ISO, default today); the period is the BILL_PERIOD_DAYS ending that day
+        region (str): Grid region (default ELECTRICITY_REGION)
+    Returns:
+        float: kg CO2e/kWh, the region's mean over the billing period or FALLBACK_INTENSITY
+    Raises:
+        ValueError: If the date cannot be parsed
+    """
+    return float(bill_intensity_many([str(date or datetime.date.today().isoformat())[:10]], region)[0])
+
+
+def bill_intensity_many(dates, region=None):
+    """
+    Carbon intensity for many bills in one region.
+    Args:
+        dates: Bill dates (ISO days, or epoch seconds at the start of each day)
+        region (str): Grid region (default ELECTRICITY_REGION)
+    Returns:
+        numpy.ndarray: kg CO2e/kWh per bill
+    Raises:
+        ValueError: If a date cannot be parsed
+    """
+    region = (region or BILL_REGION).lower()
+    # Parse first, so a bad date is rejected whether or not the region has a series
+    end = grid_intensity.to_epoch(dates) + 86400
+    if grid_intensity.get_series(region) is None:
+        return np.full(end.shape, FALLBACK_INTENSITY)
+    return np.asarray(grid_intensity.mean_intensity(region, end - BILL_PERIOD_DAYS * 86400, end)) / 1000
+
+
+def _read_units(image):
+    """OCR the units figure from the bill's meter-reading box; None if not found"""
+    x,y,w,h = 730,330,118,50                 # crop coordinates
+
+    import cv2  # deferred with the rest of the OCR stack
+
+    with metrics.stage('preprocess_image'):
+        img = decode_image(image)
+        crop = img[y:y+h, x:x+w]
+        if crop.size==0: raise ValueError("Crop empty")
+        tight = crop[int(crop.shape[0]*0.6):,:]
+        kernel = np.array([[0,-1,0],[-1,5,-1],[0,-1,0]])
+        tight = cv2.filter2D(tight,-1,kernel)
+        tight = cv2.resize(tight,None,fx=4,fy=4,interpolation=cv2.INTER_LINEAR)
+
+    with ocr_readers.get_reader() as reader:
+        with metrics.stage('readtext'):
+            txt = " ".join([t for _,t,_ in reader.readtext(tight)])
+    cleaned = txt.replace('O','0').replace('o','0').replace('l','1').replace('I','1').replace('g','9')
+    m = re.search(r'\d+(\.\d+)?', cleaned)
+    return float(m.group(0)) if m else None
+
+
+def process_electricity_bill(image, region=None, date=None, tariff_name=None):
+    carbon_intensity = bill_intensity(date, region)  # kg CO₂/kWh
+    bill_tariff = tariff.get_tariff(tariff_name)
+
+    # Re-uploads of the same photo reuse the units read last time; pricing is always redone
+    key = ocr_cache.content_key(image)
+    units = ocr_cache.get('electricity', key)
+    if units is None:
+        ocr_cache.miss('electricity')
+        units = _read_units(image)
+        ocr_cache.put('electricity', key, units)
+
+    if units is not None:
+        return {"success":True, "units":units,
+                "bill_amount":bill_tariff.price(units),
+                "co2_emissions":round(units*carbon_intensity,2),
+                "tariff":bill_tariff.name}
+    else:
+        return {"success":False, "error":"units_not_detected",
+                "message":"Units not found - please enter manually."}
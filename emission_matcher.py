@@ -0,0 +1,150 @@
+import weakref
+import threading
+import logging
+from collections import deque
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+
+class FactorTable(dict):
+    """Emission factor dict that bumps a version counter on every change"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+
+    def _changed(self):
+        self.version += 1
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        result = super().pop(key, *default)
+        self._changed()
+        return result
+
+    def popitem(self):
+        result = super().popitem()
+        self._changed()
+        return result
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+
+class FactorMatcher:
+    """
+    Aho-Corasick automaton over the factor keys.
+    A single pass over an item name finds every key that occurs in it; the
+    longest key wins and ties go to the key that comes first in the table.
+    """
+
+    def __init__(self, keys):
+        self._goto = [{}]
+        self._fail = [0]
+        # best (length, -order, key) ending at each node, including via fail links
+        self._best = [None]
+        for order, key in enumerate(keys):
+            self._add(key, order)
+        self._link()
+
+    def _add(self, key, order):
+        node = 0
+        for char in key:
+            nxt = self._goto[node].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._best.append(None)
+            node = nxt
+        candidate = (len(key), -order, key)
+        if self._best[node] is None or candidate > self._best[node]:
+            self._best[node] = candidate
+
+    def _link(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                inherited = self._best[self._fail[child]]
+                if inherited is not None and (self._best[child] is None or inherited > self._best[child]):
+                    self._best[child] = inherited
+                queue.append(child)
+
+    def longest_match(self, text):
+        """Return the best factor key contained in text, or None"""
+        goto, fail, best_at = self._goto, self._fail, self._best
+        node, best = 0, None
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            found = best_at[node]
+            if found is not None and (best is None or found > best):
+                best = found
+        return best[2] if best is not None else None
+
+
+# Re-entrant: a table collected while the lock is held runs _forget on the same thread
+_lock = threading.RLock()
+_compiled = {}  # id(table) -> (weakref to table, version, matcher)
+
+
+def _cached(table, version):
+    # The weakref check stops a new table that reuses a collected table's id from getting its matcher
+    cached = _compiled.get(id(table))
+    if cached is not None and cached[0]() is table and cached[1] == version:
+        return cached[2]
+    return None
+
+
+def get_matcher(table):
+    """Return the compiled matcher for table, rebuilding only when it has changed"""
+    version = getattr(table, 'version', None)
+    if version is None:
+        # Plain dicts cannot report changes, so they are compiled on every call
+        return FactorMatcher(list(table.keys()))
+    matcher = _cached(table, version)
+    if matcher is not None:
+        return matcher
+    with _lock:
+        matcher = _cached(table, version)
+        if matcher is not None:
+            return matcher
+        matcher = FactorMatcher(list(table.keys()))
+        key = id(table)
+        _compiled[key] = (weakref.ref(table, lambda ref: _forget(key, ref)), version, matcher)
+        logger.debug(f"Compiled emission factor matcher for {len(table)} keys")
+        return matcher
+
+
+def _forget(key, ref):
+    """Drop a collected table's matcher unless its id already belongs to a newer table"""
+    with _lock:
+        cached = _compiled.get(key)
+        if cached is not None and cached[0] is ref:
+            del _compiled[key]
@@ -0,0 +1,247 @@
+import os
+import csv
+import glob
+import logging
+import datetime
+import warnings
+import threading
+
+import numpy as np
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Directory of intensity time series: <region>.csv / <region>.parquet, or files with a 'region' column
+GRID_INTENSITY_DIR = os.environ.get('GRID_INTENSITY_DIR', os.path.join(BASE_DIR, 'grid_intensity'))
+# Longest span (hours) expanded into the hourly lookup grid per region (~30 years)
+MAX_GRID_HOURS = int(os.environ.get('GRID_INTENSITY_MAX_HOURS', 30 * 366 * 24))
+HOUR = 3600
+
+_lock = threading.Lock()
+_series = None  # region -> _Series, built on first lookup
+
+
+class _Series:
+    """
+    One region's intensity (g CO2e/kWh) interpolated onto an hourly grid.
+    The running sum of the grid turns the mean over any window into two lookups.
+    """
+    __slots__ = ('region', 'start', 'hourly', 'cumulative', 'points')
+
+    def __init__(self, region, times, values):
+        order = np.argsort(times, kind='stable')
+        times, values = times[order], values[order]
+        self.region = region
+        self.points = len(times)
+        self.start = int(times[0] // HOUR * HOUR)
+        hours = min(int((times[-1] - self.start) // HOUR) + 1, MAX_GRID_HOURS)
+        grid_times = self.start + np.arange(hours, dtype=np.float64) * HOUR
+        self.hourly = np.interp(grid_times, times, values).astype(np.float32)
+        self.cumulative = np.concatenate(([0.0], np.cumsum(self.hourly, dtype=np.float64)))
+
+    @property
+    def end(self):
+        return self.start + len(self.hourly) * HOUR
+
+    def _integral(self, hours):
+        """
+        Integral of the hourly step function from the grid start to each (fractional) hour offset.
+        Before and after the grid the first and last hours' values carry on, as they do in at().
+        """
+        whole = np.clip(np.floor(hours).astype(np.int64), 0, len(self.hourly) - 1)
+        return self.cumulative[whole] + (hours - whole) * self.hourly[whole]
+
+    def at(self, times):
+        index = ((np.asarray(times, dtype=np.float64) - self.start) // HOUR).astype(np.int64)
+        return self.hourly[np.clip(index, 0, len(self.hourly) - 1)].astype(np.float64)
+
+    def mean(self, starts, ends):
+        """
+        Mean intensity over each [start, end) window. Hours outside the series' span count at
+        the nearest edge hour's value, so a mean always agrees with averaging at() hour by hour.
+        """
+        lo = (np.asarray(starts, dtype=np.float64) - self.start) / HOUR
+        hi = (np.asarray(ends, dtype=np.float64) - self.start) / HOUR
+        width = hi - lo
+        point = self.at(starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = (self._integral(hi) - self._integral(lo)) / width
+        # Zero-width (or reversed) windows use the value of the hour they start in
+        return np.where(width > 1e-9, mean, point)
+
+
+def to_epoch(values):
+    """
+    Convert ISO dates/timestamps, datetimes or epoch seconds to a float64 array of epoch seconds.
+    Naive values and a trailing 'Z' are read as UTC.
+    Raises:
+        ValueError: If a value cannot be parsed
+    """
+    array = np.asarray(values)
+    if array.dtype.kind in 'iuf':
+        return array.astype(np.float64)
+    if array.dtype.kind == 'M':
+        return array.astype('datetime64[s]').astype(np.float64)
+    if array.dtype == object and array.size and isinstance(array.flat[0], datetime.datetime):
+        return np.array([_datetime_epoch(v) for v in array.flat], dtype=np.float64).reshape(array.shape)
+    text = np.char.strip(array.astype(str))
+    text = np.where(np.char.endswith(text, 'Z'), np.char.rstrip(text, 'Z'), text)
+    try:
+        with warnings.catch_warnings():
+            # NumPy applies UTC offsets correctly but warns that datetime64 has no timezone
+            warnings.simplefilter('ignore')
+            return text.astype('datetime64[s]').astype(np.float64)
+    except ValueError:
+        # Formats NumPy rejects: fall back to the standard library, one value at a time
+        try:
+            return np.array([_datetime_epoch(datetime.datetime.fromisoformat(v)) for v in text.flat],
+                            dtype=np.float64).reshape(text.shape)
+        except ValueError:
+            raise ValueError("Invalid timestamp, expected an ISO date or timestamp")
+
+
+def _datetime_epoch(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value.timestamp()
+
+
+# === LOADING ===
+
+def _read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        fields = reader.fieldnames or []
+        if 'timestamp' not in fields or 'intensity' not in fields:
+            raise ValueError(f"{path}: expected 'timestamp' and 'intensity' columns")
+        columns = {field: [] for field in ('timestamp', 'intensity', 'region') if field in fields}
+        for row in reader:
+            for field, values in columns.items():
+                values.append(row[field])
+    return columns
+
+
+def _read_parquet(path):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError(f"{path}: reading Parquet needs the pyarrow package")
+    table = pq.read_table(path)
+    if 'timestamp' not in table.column_names or 'intensity' not in table.column_names:
+        raise ValueError(f"{path}: expected 'timestamp' and 'intensity' columns")
+    columns = {'timestamp': table.column('timestamp').to_numpy(), 'intensity': table.column('intensity').to_numpy()}
+    if 'region' in table.column_names:
+        columns['region'] = table.column('region').to_numpy()
+    return columns
+
+
+def _load_file(path):
+    """Yield (region, epoch seconds, intensities) for every region in one file"""
+    columns = _read_parquet(path) if path.endswith('.parquet') else _read_csv(path)
+    times = to_epoch(columns['timestamp'])
+    values = np.asarray(columns['intensity'], dtype=np.float64)
+    valid = np.isfinite(times) & np.isfinite(values) & (values >= 0)
+    if 'region' not in columns:
+        region = os.path.splitext(os.path.basename(path))[0].lower()
+        yield region, times[valid], values[valid]
+        return
+    regions = np.char.lower(np.asarray(columns['region']).astype(str))
+    for region in np.unique(regions[valid]).tolist():
+        rows = valid & (regions == region)
+        yield region, times[rows], values[rows]
+
+
+def _load_all(directory):
+    loaded = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.csv')) + glob.glob(os.path.join(directory, '*.parquet'))):
+        try:
+            for region, times, values in _load_file(path):
+                if len(times) == 0:
+                    continue
+                if region in loaded:
+                    logger.warning(f"Grid intensity for {region} in {path} replaces an earlier file")
+                loaded[region] = _Series(region, times, values)
+        except (OSError, ValueError) as e:
+            logger.error(f"Skipping grid intensity file {path}: {e}")
+    logger.info(f"Loaded grid intensity series for {len(loaded)} regions from {directory}")
+    return loaded
+
+
+def _get_all():
+    global _series
+    series = _series
+    if series is None:
+        with _lock:
+            if _series is None:
+                _series = _load_all(GRID_INTENSITY_DIR)
+            series = _series
+    return series
+
+
+def reload(directory=None):
+    """Re-read the series directory (default GRID_INTENSITY_DIR), e.g. after dropping in new data"""
+    global _series
+    loaded = _load_all(directory or GRID_INTENSITY_DIR)
+    with _lock:
+        _series = loaded
+    return sorted(loaded)
+
+
+# === LOOKUPS ===
+
+def get_series(region):
+    """The memoized series for a region, or None if there is no data for it"""
+    if not region:
+        return None
+    return _get_all().get(str(region).lower())
+
+
+def regions():
+    """Summary of every loaded region: span, input points and hourly grid size"""
+    return {
+        region: {
+            'from': datetime.datetime.fromtimestamp(s.start, datetime.timezone.utc).isoformat(),
+            'to': datetime.datetime.fromtimestamp(s.end, datetime.timezone.utc).isoformat(),
+            'points': s.points,
+            'hours': len(s.hourly),
+        }
+        for region, s in sorted(_get_all().items())
+    }
+
+
+def intensity_at(region, times, default=None):
+    """
+    Intensity (g/kWh) for the hour containing each timestamp.
+    Args:
+        region (str): Region name (file stem or 'region' column value)
+        times: Timestamp or array of timestamps (see to_epoch)
+        default (float): Returned where the region has no series
+    Returns:
+        float or numpy.ndarray matching the shape of times
+    """
+    series = get_series(region)
+    epoch = to_epoch(times)
+    values = series.at(epoch) if series is not None else np.full(epoch.shape, np.nan if default is None else default)
+    return float(values) if values.ndim == 0 else values
+
+
+def mean_intensity(region, starts, ends, default=None):
+    """
+    Mean intensity (g/kWh) over each usage window [start, end).
+    Args:
+        region (str): Region name
+        starts: Window start timestamp(s)
+        ends: Window end timestamp(s), broadcast against starts
+        default (float): Returned where the region has no series
+    Returns:
+        float or numpy.ndarray matching the broadcast shape of starts and ends
+    """
+    series = get_series(region)
+    lo, hi = np.broadcast_arrays(to_epoch(starts), to_epoch(ends))
+    if series is None:
+        values = np.full(lo.shape, np.nan if default is None else default, dtype=np.float64)
+    else:
+        values = series.mean(lo, hi)
+    return float(values) if values.ndim == 0 else values
@@ -0,0 +1,6 @@
+import metrics
+
+
+def child_exit(server, worker):
+    """Fold an exited worker's metrics into the exited totals, even if it was killed"""
+    metrics.mark_process_dead(worker.pid)
@@ -0,0 +1,244 @@
+import os
+import mmap
+import json
+import struct
+import logging
+import threading
+
+import numpy as np
+
+import history_writer
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Sidecar layout: header, then one fixed-size entry per indexed line
+MAGIC = b'CTIDX002'
+HEADER = struct.Struct('<8sQQQQ')         # magic, checkpoint (bytes indexed), lines seen, data file inode, rewrite generation
+KEY_WIDTH = 32
+ENTRY_DTYPE = np.dtype([('offset', '<u8'), ('length', '<u4'), ('seq', '<u4'), ('key', f'S{KEY_WIDTH}')])
+_RANGE_END = b'\xff'
+
+
+class MmapHistoryIndex:
+    """
+    Offset index over a JSON-lines history file.
+    A sidecar <file>.idx stores each line's byte offset, length, line number and
+    sort key plus a checkpoint of how much of the file has been indexed. Range
+    and "last N" queries binary-search the sorted keys and decode only the
+    matching lines through mmap.
+    """
+
+    def __init__(self, path, sort_field, wrapped=False):
+        self.path = path
+        self.idx_path = path + '.idx'
+        self.sort_field = sort_field
+        self.wrapped = wrapped
+        self._lock = threading.Lock()
+        self._entries = np.zeros(0, dtype=ENTRY_DTYPE)
+        self._inode = None
+        self._generation = None
+        self._checkpoint = 0
+        self._orders = {}
+
+    # === SIDECAR MAINTENANCE ===
+
+    def _key(self, record):
+        if self.wrapped:
+            record = record[0] if isinstance(record, list) and record else None
+        if not isinstance(record, dict):
+            return None
+        return str(record.get(self.sort_field) or '').encode('utf-8')[:KEY_WIDTH]
+
+    def _read_header(self, f):
+        f.seek(0)
+        raw = f.read(HEADER.size)
+        if len(raw) < HEADER.size:
+            return None
+        magic, checkpoint, lines, inode, generation = HEADER.unpack(raw)
+        return (checkpoint, lines, inode, generation) if magic == MAGIC else None
+
+    def _index_new_lines(self, f, checkpoint, lines, size):
+        """Parse lines between checkpoint and the last complete line; append their entries"""
+        with open(self.path, 'rb') as data_file:
+            with mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                end = mm.rfind(b'\n', checkpoint, size) + 1
+                if end <= checkpoint:
+                    return checkpoint, lines
+                rows = []
+                pos = checkpoint
+                while pos < end:
+                    nl = mm.find(b'\n', pos, end)
+                    lines += 1
+                    raw = mm[pos:nl]
+                    if raw.strip():
+                        try:
+                            key = self._key(json.loads(raw))
+                        except ValueError:
+                            key = None
+                        if key is not None:
+                            rows.append((pos, nl - pos, lines, key))
+                    pos = nl + 1
+        if rows:
+            f.seek(0, os.SEEK_END)
+            f.write(np.array(rows, dtype=ENTRY_DTYPE).tobytes())
+        return end, lines
+
+    def _sync_sidecar(self, st, generation):
+        """Bring the sidecar up to date under a lock shared with other workers"""
+        with history_writer.file_lock(self.idx_path):
+            mode = 'r+b' if os.path.exists(self.idx_path) else 'w+b'
+            with open(self.idx_path, mode) as f:
+                header = self._read_header(f)
+                if (header is None or header[2] != st.st_ino or header[3] != generation
+                        or header[0] > st.st_size):
+                    f.seek(0)
+                    f.truncate()
+                    header = (0, 0, st.st_ino, generation)
+                    f.write(HEADER.pack(MAGIC, 0, 0, st.st_ino, generation))
+                checkpoint, lines, _, _ = header
+                if checkpoint == 0:
+                    self._inode = None  # sidecar was (re)built: reload every entry
+                if checkpoint < st.st_size:
+                    checkpoint, lines = self._index_new_lines(f, checkpoint, lines, st.st_size)
+                    f.seek(0)
+                    f.write(HEADER.pack(MAGIC, checkpoint, lines, st.st_ino, generation))
+                count = (os.fstat(f.fileno()).st_size - HEADER.size) // ENTRY_DTYPE.itemsize
+                known = len(self._entries) if self._inode == st.st_ino else 0
+                if count > known:
+                    f.seek(HEADER.size + known * ENTRY_DTYPE.itemsize)
+                    new = np.frombuffer(f.read((count - known) * ENTRY_DTYPE.itemsize), dtype=ENTRY_DTYPE)
+                else:
+                    new = np.zeros(0, dtype=ENTRY_DTYPE)
+        return checkpoint, known, new
+
+    def refresh(self):
+        """Index anything appended since the last call; rebuild if the file was replaced"""
+        history_writer.flush(self.path)
+        generation = history_writer.read_generation(self.path)
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._entries = np.zeros(0, dtype=ENTRY_DTYPE)
+            self._inode, self._checkpoint, self._orders = None, 0, {}
+            return
+        if generation != self._generation:
+            self._inode = None  # rewritten, possibly onto a reused inode of the same size
+        if st.st_ino == self._inode and st.st_size == self._checkpoint:
+            return
+        if st.st_ino == self._inode and st.st_size < self._checkpoint:
+            self._inode = None  # rewritten in place
+        checkpoint, known, new = self._sync_sidecar(st, generation)
+        if self._inode != st.st_ino or known == 0:
+            self._entries = new.copy()
+            self._orders = {}
+        elif len(new):
+            asc = self._orders.get(False)
+            self._entries = np.concatenate([self._entries, new])
+            self._orders = {}
+            # Appends usually arrive in key order, so the ascending view just grows
+            in_order = np.all(new['key'][1:] >= new['key'][:-1])
+            if asc is not None and in_order and (not len(asc) or new['key'][0] >= asc['key'][-1]):
+                self._orders[False] = np.concatenate([asc, new])
+        self._inode = st.st_ino
+        self._generation = generation
+        self._checkpoint = checkpoint
+
+    # === QUERIES ===
+
+    def _ordered(self, descending):
+        """Entries sorted by (key, line) ascending, or newest key first with ties in append order"""
+        ordered = self._orders.get(descending)
+        if ordered is not None:
+            return ordered
+        entries = self._entries
+        asc = self._orders.get(False)
+        if asc is None:
+            asc = entries[np.lexsort((entries['seq'], entries['key']))]
+            self._orders[False] = asc
+        if not descending:
+            return asc
+        keys = asc['key']
+        if len(keys):
+            group = np.concatenate([[0], np.cumsum(keys[1:] != keys[:-1])])
+            ordered = asc[np.lexsort((asc['seq'], -group))]
+        else:
+            ordered = asc
+        self._orders[True] = ordered
+        return ordered
+
+    def _window(self, keys, start, upper, descending):
+        """Index range [a, b) of ordered keys within the bounds"""
+        n = len(keys)
+        if not descending:
+            a = np.searchsorted(keys, start, 'left') if start is not None else 0
+            b = np.searchsorted(keys, upper, 'right') if upper is not None else n
+            return int(a), int(b)
+        rev = keys[::-1]
+        lo = np.searchsorted(rev, start, 'left') if start is not None else 0
+        hi = np.searchsorted(rev, upper, 'right') if upper is not None else n
+        return int(n - hi), int(n - lo)
+
+    def _after_cursor(self, keys, seqs, after, descending):
+        """First ordered position strictly after the cursor row"""
+        key, seq = after
+        block_start, block_end = self._window(keys, key, key, descending)
+        return block_start + int(np.searchsorted(seqs[block_start:block_end], seq, 'right'))
+
+    def query(self, start=None, end=None, limit=None, after=None, descending=False):
+        """
+        Return (rows, more) where rows are (key, seq, record) in page order.
+        Bounds are validated strings; after is a decoded (key, seq) cursor.
+        """
+        with self._lock:
+            data_file = self._open_snapshot()
+            if data_file is None:
+                return [], False
+            with data_file:
+                ordered = self._ordered(descending)
+                keys, seqs = ordered['key'], ordered['seq']
+                start_b = start.encode('utf-8')[:KEY_WIDTH] if start is not None else None
+                upper_b = end.encode('utf-8')[:KEY_WIDTH - 1] + _RANGE_END if end is not None else None
+                a, b = self._window(keys, start_b, upper_b, descending)
+                if after is not None:
+                    a = max(a, self._after_cursor(keys, seqs, (after[0].encode('utf-8')[:KEY_WIDTH], after[1]), descending))
+                stop = b if limit is None else min(b, a + limit)
+                page = ordered[a:stop] if a < stop else ordered[:0]
+                more = stop < b
+
+                # Offsets are read from the pinned descriptor, so a rewrite that swaps in a
+                # new file after this point cannot mix its lines into the page
+                rows = []
+                if len(page):
+                    with mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        for offset, length, seq, key in page.tolist():
+                            record = json.loads(mm[offset:offset + length])
+                            if self.wrapped:
+                                record = record[0]
+                            rows.append((key.decode('utf-8'), seq, record))
+        return rows, more
+
+    def _open_snapshot(self):
+        """
+        Refresh the entries and open the data file they describe. Call with the lock held.
+        Returns None if there is nothing indexed; the open file pins the indexed inode.
+        """
+        while True:
+            self.refresh()
+            if not len(self._entries):
+                return None
+            try:
+                data_file = open(self.path, 'rb')
+            except FileNotFoundError:
+                continue
+            st = os.fstat(data_file.fileno())
+            if (st.st_ino == self._inode and st.st_size >= self._checkpoint
+                    and history_writer.read_generation(self.path) == self._generation):
+                return data_file
+            # Replaced or truncated between refresh() and open(): index the new file
+            data_file.close()
+
+    def tail(self, n):
+        """Last n records by sort key, newest first"""
+        rows, _ = self.query(limit=n, descending=True)
+        return [record for _, _, record in rows]
@@ -0,0 +1,688 @@
+import os
+import re
+import sys
+import json
+import heapq
+import base64
+import datetime
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+import history_writer
+import metrics
+from history_index import MmapHistoryIndex
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 'jsonl' keeps the flat files in static/, 'sqlite' uses an indexed database
+HISTORY_BACKEND = os.environ.get('HISTORY_BACKEND', 'jsonl')
+HISTORY_DIR = os.environ.get('HISTORY_DIR', os.path.join(BASE_DIR, 'static'))
+HISTORY_DB_PATH = os.environ.get('HISTORY_DB', os.path.join(BASE_DIR, 'history.db'))
+MAX_PAGE_SIZE = int(os.environ.get('HISTORY_MAX_PAGE_SIZE', 1000))
+# Page size of history endpoints when the request gives no limit
+DEFAULT_PAGE_SIZE = int(os.environ.get('HISTORY_DEFAULT_PAGE_SIZE', 100))
+# Keep parsed JSON-lines history in memory per worker, re-parsing only appended bytes
+HISTORY_CACHE = os.environ.get('HISTORY_CACHE', '1') == '1'
+# Serve ordered/range reads of JSON-lines files from an mmap-backed sidecar offset index
+HISTORY_MMAP_INDEX = os.environ.get('HISTORY_MMAP_INDEX', '0') == '1'
+# Each user's history lives in its own directory here (JSON-lines files or history.db);
+# kept out of static/ so partitions are not downloadable as static files
+USERS_DIR = os.environ.get('HISTORY_USERS_DIR', os.path.join(BASE_DIR, 'users'))
+# Per-user stores kept open per worker; the least recently used are closed beyond this
+MAX_OPEN_USERS = int(os.environ.get('HISTORY_MAX_OPEN_USERS', 256))
+
+# User ids become directory names, so only a safe subset of characters is accepted
+_USER_ID = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9_.@-]{0,63}\Z')
+
+# Appended to 'to' bounds so they include everything at the given precision
+_RANGE_END = '\uffff'
+
+# Store name -> flat file, field used for ordering, and whether lines are wrapped in a list
+STORE_SPECS = {
+    'device': {'filename': 'device_emissions_history.json', 'sort_field': 'timestamp', 'wrapped': False},
+    'transport': {'filename': 'transport_emissions.json', 'sort_field': 'timestamp', 'wrapped': True},
+    'electricity': {'filename': 'electricity_history.json', 'sort_field': 'date', 'wrapped': False},
+}
+
+
+def encode_cursor(key, seq, descending):
+    raw = json.dumps([key, seq, int(descending)]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, descending):
+    """Return (sort_key, seq) from an opaque cursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key, seq, direction = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if bool(direction) != bool(descending):
+        raise ValueError("Cursor does not match the requested order")
+    return str(key), int(seq)
+
+
+def check_bound(value, label):
+    """Validate an inclusive from/to bound; raises ValueError unless it is an ISO date or timestamp"""
+    if value is None:
+        return None
+    try:
+        datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"Invalid '{label}' value, expected an ISO date or timestamp")
+    return value
+
+
+def _check_limit(limit):
+    if limit is None:
+        return None
+    if limit <= 0:
+        raise ValueError("limit must be positive")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def check_user(user):
+    """
+    Validate a user id used to partition history.
+    Returns:
+        str: The user id, or None for the shared (anonymous) partition
+    Raises:
+        ValueError: If the id is not 1-64 letters, digits, '_', '-', '.' or '@'
+    """
+    if user is None or user == '':
+        return None
+    if not isinstance(user, str) or not _USER_ID.match(user):
+        raise ValueError("Invalid user id: use 1-64 letters, digits, '_', '-', '.' or '@'")
+    return user
+
+
+def user_dir(user):
+    """Directory holding one user's history partition"""
+    return os.path.join(USERS_DIR, check_user(user))
+
+
+def list_users():
+    """User ids that have a history partition on disk"""
+    try:
+        return sorted(entry for entry in os.listdir(USERS_DIR)
+                      if _USER_ID.match(entry) and os.path.isdir(os.path.join(USERS_DIR, entry)))
+    except FileNotFoundError:
+        return []
+
+
+_listeners = []
+
+
+def add_append_listener(listener):
+    """
+    Call listener(store_name, entries, user) once appended entries are durably written.
+    Listeners run under the store's lock(), so a reader holding it sees history and
+    listener side effects in step.
+    """
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def _notify(name, entries, user):
+    for listener in _listeners:
+        try:
+            listener(name, entries, user)
+        except Exception as e:
+            logger.error(f"History append listener failed for {name}: {e}")
+
+
+class HistoryStore:
+    """Repository interface shared by every history backend"""
+
+    def __init__(self, name, sort_field, user=None):
+        self.name = name
+        self.sort_field = sort_field
+        self.user = user
+
+    def sort_key(self, entry):
+        return str(entry.get(self.sort_field) or '')
+
+    def append(self, entry):
+        self.append_many([entry])
+
+    def append_many(self, entries):
+        if not entries:
+            return
+        def on_written():
+            with metrics.stage('history_listeners'):
+                _notify(self.name, entries, self.user)
+
+        with metrics.stage('history_append'):
+            self._write(entries, on_written)
+
+    def _write(self, entries, on_written=None):
+        """Store entries; call on_written() under lock() once they are committed"""
+        raise NotImplementedError
+
+    def lock(self):
+        """Hold off appends and their listeners, e.g. while rebuilding derived data"""
+        raise NotImplementedError
+
+    def iter_indexed(self):
+        """Yield (seq, record) in storage (append) order; seq increases with each append"""
+        raise NotImplementedError
+
+    def iter_records(self):
+        """Yield records in storage (append) order"""
+        for _, record in self.iter_indexed():
+            yield record
+
+    def query(self, start=None, end=None, limit=None, cursor=None, descending=False):
+        """
+        Return one page of records ordered by the sort field.
+        Args:
+            start (str): Inclusive lower bound (ISO date or timestamp)
+            end (str): Inclusive upper bound at the given precision
+            limit (int): Page size, capped at HISTORY_MAX_PAGE_SIZE
+            cursor (str): Opaque cursor returned by the previous page
+            descending (bool): Newest first
+        Returns:
+            tuple: (records, next_cursor or None)
+        """
+        if start is None and end is None and limit is None and not cursor:
+            return self.load(descending), None
+        start = check_bound(start, 'from')
+        end = check_bound(end, 'to')
+        limit = _check_limit(limit)
+        after = decode_cursor(cursor, descending) if cursor else None
+
+        def in_window(item):
+            key, seq = item[0], item[1]
+            if start is not None and key < start:
+                return False
+            if end is not None and key > end + _RANGE_END:
+                return False
+            if after is not None:
+                if descending:
+                    return key < after[0] or (key == after[0] and seq > after[1])
+                return (key, seq) > after
+            return True
+
+        # Stream the file and keep at most limit + 1 candidates in memory
+        candidates = filter(in_window, ((self.sort_key(r), seq, r) for seq, r in self.iter_indexed()))
+        if descending:
+            order = lambda item: (_Reversed(item[0]), item[1])
+        else:
+            order = lambda item: (item[0], item[1])
+        if limit is None:
+            page = sorted(candidates, key=order)
+        else:
+            page = heapq.nsmallest(limit + 1, candidates, key=order)
+        return self._paginate(page, limit, descending)
+
+    def _paginate(self, page, limit, descending):
+        next_cursor = None
+        if limit is not None and len(page) > limit:
+            page = page[:limit]
+            key, seq, _ = page[-1]
+            next_cursor = encode_cursor(key, seq, descending)
+        return [record for _, _, record in page], next_cursor
+
+    def iter_range(self, start=None, end=None):
+        """Stream records within [start, end] in storage order without buffering them"""
+        start = check_bound(start, 'from')
+        end = check_bound(end, 'to')
+        upper = end + _RANGE_END if end is not None else None
+
+        def generate():
+            for record in self.iter_records():
+                key = self.sort_key(record)
+                if (start is None or key >= start) and (upper is None or key <= upper):
+                    yield record
+        return generate()
+
+    def load(self, descending=False):
+        """Return all records ordered by the store's sort field"""
+        return sorted(self.iter_records(), key=self.sort_key, reverse=descending)
+
+    def count(self):
+        return sum(1 for _ in self.iter_records())
+
+    def version_tag(self):
+        """Opaque string that changes whenever the stored history changes (used for ETags)"""
+        raise NotImplementedError
+
+    def rewrite(self, transform):
+        """
+        Atomically replace the stored history, e.g. for compaction.
+        transform(records) runs while appends are held off; records() returns a fresh
+        iterator over the current history in storage order, so it can be read more
+        than once. Append listeners are not notified.
+        Args:
+            transform (callable): Returns the new records, or None to leave history untouched
+        Returns:
+            bool: Whether the history was replaced
+        """
+        raise NotImplementedError
+
+
+class _Reversed:
+    """Sort wrapper that inverts string ordering for newest-first pages"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return self.value > other.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+class JsonLinesHistoryStore(HistoryStore):
+    """One JSON document per line in a flat file under static/"""
+
+    def __init__(self, name, sort_field, path, wrapped=False, cache=HISTORY_CACHE, mmap_index=HISTORY_MMAP_INDEX,
+                 user=None):
+        super().__init__(name, sort_field, user)
+        self.path = path
+        self.wrapped = wrapped
+        self.cache = cache
+        self.index = MmapHistoryIndex(path, sort_field, wrapped) if mmap_index else None
+        self._cache_lock = threading.Lock()
+        self._reset_cache()
+
+    def _reset_cache(self, inode=None):
+        self._records = []
+        self._sorted = {}
+        self._offset = 0
+        self._lines = 0
+        self._inode = inode
+        self._mtime_ns = None
+        self._generation = None
+
+    def _encode(self, entry):
+        return json.dumps([entry] if self.wrapped else entry, ensure_ascii=False) + "\n"
+
+    def _write(self, entries, on_written=None):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        data = "".join(self._encode(entry) for entry in entries)
+        history_writer.append(self.path, data.encode("utf-8"), on_written)
+
+    def lock(self):
+        return history_writer.file_lock(self.path)
+
+    def _decode(self, line, line_num):
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            logger.error(f"{self.name} history: JSON error at line {line_num}: {e}")
+            return None
+        if self.wrapped:
+            if isinstance(record, list) and len(record) > 0:
+                return record[0]
+            logger.warning(f"{self.name} history: invalid record format at line {line_num}")
+            return None
+        return record
+
+    def _refresh(self):
+        """
+        Bring the cached records up to date with the file.
+        Appends are parsed incrementally from the last read offset; a replaced,
+        truncated or rewritten file is parsed again from the start.
+        """
+        history_writer.flush(self.path)
+        # Read before stat: a rewrite bumps it only after the new file is in place
+        generation = history_writer.read_generation(self.path)
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._reset_cache()
+            return
+        rewritten = (
+            generation != self._generation
+            or st.st_ino != self._inode
+            or st.st_size < self._offset
+            or (st.st_size == self._offset and st.st_mtime_ns != self._mtime_ns)
+        )
+        if rewritten:
+            self._reset_cache(st.st_ino)
+            self._generation = generation
+        if st.st_size > self._offset:
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read(st.st_size - self._offset)
+            # Only complete lines; a partially written tail is picked up next time
+            end = data.rfind(b"\n") + 1
+            for raw in data[:end].split(b"\n")[:-1]:
+                self._lines += 1
+                line = raw.decode("utf-8", errors="replace").strip()
+                if not line:
+                    continue
+                record = self._decode(line, self._lines)
+                if record is not None:
+                    self._records.append((self._lines, record))
+            if end:
+                self._offset += end
+                self._sorted = {}
+        self._mtime_ns = st.st_mtime_ns
+
+    def iter_indexed(self):
+        if self.cache:
+            with self._cache_lock:
+                self._refresh()
+                records = self._records
+            # The cache list is only ever appended to (a reset swaps in a new one), so no copy is needed
+            return iter(records)
+        return self._scan()
+
+    def iter_records(self):
+        """Stream from the file even when cached, so exports and rebuilds run in constant memory"""
+        for _, record in self._scan():
+            yield record
+
+    def query(self, start=None, end=None, limit=None, cursor=None, descending=False):
+        if self.index is None:
+            return super().query(start, end, limit, cursor, descending)
+        start = check_bound(start, 'from')
+        end = check_bound(end, 'to')
+        limit = _check_limit(limit)
+        after = decode_cursor(cursor, descending) if cursor else None
+        rows, more = self.index.query(start, end, limit, after, descending)
+        next_cursor = None
+        if more and rows:
+            key, seq, _ = rows[-1]
+            next_cursor = encode_cursor(key, seq, descending)
+        return [record for _, _, record in rows], next_cursor
+
+    def load(self, descending=False):
+        if self.index is not None:
+            rows, _ = self.index.query(descending=descending)
+            return [record for _, _, record in rows]
+        if not self.cache:
+            return super().load(descending)
+        with self._cache_lock:
+            self._refresh()
+            ordered = self._sorted.get(descending)
+            if ordered is None:
+                ordered = sorted((r for _, r in self._records), key=self.sort_key, reverse=descending)
+                self._sorted[descending] = ordered
+        return list(ordered)
+
+    def count(self):
+        if not self.cache:
+            return super().count()
+        with self._cache_lock:
+            self._refresh()
+            return len(self._records)
+
+    def version_tag(self):
+        history_writer.flush(self.path)
+        generation = history_writer.read_generation(self.path)
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return "empty"
+        return f"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}-{generation:x}"
+
+    def rewrite(self, transform):
+        history_writer.flush(self.path)
+        with history_writer.file_lock(self.path):
+            if not os.path.exists(self.path):
+                return False
+            records = transform(lambda: (record for _, record in self._parse_file()))
+            if records is None:
+                return False
+            # Write beside the original so os.replace swaps it in atomically
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    for record in records:
+                        f.write(self._encode(record))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+                # The swapped-in file can reuse the old inode, size and mtime; readers also check this
+                history_writer.bump_generation(self.path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        logger.info(f"Rewrote {self.name} history at {self.path}")
+        return True
+
+    def _scan(self):
+        history_writer.flush(self.path)
+        return self._parse_file()
+
+    def _parse_file(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line_num, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    record = self._decode(line, line_num)
+                    if record is not None:
+                        yield line_num, record
+        except OSError as e:
+            logger.error(f"Failed to read {self.name} history: {e}")
+
+
+class SqliteHistoryStore(HistoryStore):
+    """Records kept as JSON text in SQLite with an index on the sort field"""
+
+    def __init__(self, name, sort_field, db_path, user=None):
+        super().__init__(name, sort_field, user)
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.name} ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, sort_key TEXT NOT NULL, data TEXT NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.name}_sort_key ON {self.name} (sort_key, id)")
+            conn.commit()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _write(self, entries, on_written=None):
+        rows = [(self.sort_key(entry), json.dumps(entry, ensure_ascii=False)) for entry in entries]
+        conn = self._conn()
+        with self.lock():
+            with conn:
+                conn.executemany(f"INSERT INTO {self.name} (sort_key, data) VALUES (?, ?)", rows)
+            if on_written is not None:
+                on_written()
+
+    def lock(self):
+        return history_writer.file_lock(f"{self.db_path}.{self.name}")
+
+    def iter_indexed(self):
+        for seq, data in self._conn().execute(f"SELECT id, data FROM {self.name} ORDER BY id"):
+            yield seq, json.loads(data)
+
+    def iter_range(self, start=None, end=None):
+        start = check_bound(start, 'from')
+        end = check_bound(end, 'to')
+        sql = f"SELECT data FROM {self.name} WHERE sort_key >= ? AND sort_key <= ? ORDER BY sort_key, id"
+        params = (start or '', (end or '') + _RANGE_END)
+        # A dedicated connection so the open cursor never collides with other queries on this thread
+        conn = sqlite3.connect(self.db_path, timeout=30)
+
+        def generate():
+            try:
+                for (data,) in conn.execute(sql, params):
+                    yield json.loads(data)
+            finally:
+                conn.close()
+        return generate()
+
+    def query(self, start=None, end=None, limit=None, cursor=None, descending=False):
+        start = check_bound(start, 'from')
+        end = check_bound(end, 'to')
+        limit = _check_limit(limit)
+        where, params = [], []
+        if start is not None:
+            where.append("sort_key >= ?")
+            params.append(start)
+        if end is not None:
+            where.append("sort_key <= ?")
+            params.append(end + _RANGE_END)
+        if cursor:
+            key, seq = decode_cursor(cursor, descending)
+            op = "<" if descending else ">"
+            where.append(f"(sort_key {op} ? OR (sort_key = ? AND id > ?))")
+            params.extend([key, key, seq])
+        sql = f"SELECT sort_key, id, data FROM {self.name}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY sort_key {'DESC' if descending else 'ASC'}, id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+        page = [(key, seq, json.loads(data)) for key, seq, data in self._conn().execute(sql, params)]
+        return self._paginate(page, limit, descending)
+
+    def load(self, descending=False):
+        order = "DESC" if descending else "ASC"
+        rows = self._conn().execute(
+            f"SELECT data FROM {self.name} ORDER BY sort_key {order}, id"
+        )
+        return [json.loads(data) for (data,) in rows]
+
+    def count(self):
+        return self._conn().execute(f"SELECT COUNT(*) FROM {self.name}").fetchone()[0]
+
+    def version_tag(self):
+        last_id, total = self._conn().execute(f"SELECT MAX(id), COUNT(*) FROM {self.name}").fetchone()
+        return f"{last_id or 0:x}-{total:x}"
+
+    def rewrite(self, transform):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+
+            def records():
+                for (data,) in conn.execute(f"SELECT data FROM {self.name} ORDER BY id"):
+                    yield json.loads(data)
+
+            new_records = transform(records)
+            if new_records is None:
+                return False
+            # Stage into a temp table so the transform can keep reading the original
+            conn.execute(f"DROP TABLE IF EXISTS temp.{self.name}_rewrite")
+            conn.execute(f"CREATE TEMP TABLE {self.name}_rewrite (sort_key TEXT NOT NULL, data TEXT NOT NULL)")
+            conn.executemany(
+                f"INSERT INTO temp.{self.name}_rewrite (sort_key, data) VALUES (?, ?)",
+                ((self.sort_key(r), json.dumps(r, ensure_ascii=False)) for r in new_records),
+            )
+            conn.execute(f"DELETE FROM {self.name}")
+            conn.execute(
+                f"INSERT INTO {self.name} (sort_key, data)"
+                f" SELECT sort_key, data FROM temp.{self.name}_rewrite ORDER BY rowid"
+            )
+            conn.execute(f"DROP TABLE temp.{self.name}_rewrite")
+        logger.info(f"Rewrote {self.name} history in {self.db_path}")
+        return True
+
+
+_stores = {}
+_user_stores = OrderedDict()
+_stores_lock = threading.Lock()
+
+
+def _build_store(name, backend, user=None):
+    spec = STORE_SPECS[name]
+    if backend == 'sqlite':
+        db_path = os.path.join(user_dir(user), 'history.db') if user else HISTORY_DB_PATH
+        return SqliteHistoryStore(name, spec['sort_field'], db_path, user=user)
+    if backend == 'jsonl':
+        path = os.path.join(user_dir(user) if user else HISTORY_DIR, spec['filename'])
+        return JsonLinesHistoryStore(name, spec['sort_field'], path, wrapped=spec['wrapped'], user=user)
+    raise ValueError(f"Unknown history backend: {backend}")
+
+
+def get_store(name, backend=None, user=None):
+    """
+    Return the store for 'device', 'transport' or 'electricity'.
+    Without a user this is the shared history under static/; with one it is
+    that user's own partition under HISTORY_USERS_DIR.
+    """
+    if name not in STORE_SPECS:
+        raise ValueError(f"Unknown history store: {name}")
+    backend = backend or HISTORY_BACKEND
+    user = check_user(user)
+    with _stores_lock:
+        if user is None:
+            store = _stores.get((backend, name))
+            if store is None:
+                store = _stores[(backend, name)] = _build_store(name, backend)
+            return store
+        key = (backend, name, user)
+        store = _user_stores.get(key)
+        if store is None:
+            store = _user_stores[key] = _build_store(name, backend, user)
+            while len(_user_stores) > MAX_OPEN_USERS * len(STORE_SPECS):
+                _user_stores.popitem(last=False)
+        else:
+            _user_stores.move_to_end(key)
+        return store
+
+
+def migrate(names=None, force=False, batch_size=5000):
+    """
+    Copy the JSON-lines history files into the SQLite backend.
+    Args:
+        names (list): Stores to migrate (default: all)
+        force (bool): Replace the SQLite table's rows if it already has any
+        batch_size (int): Records inserted per transaction
+    Returns:
+        dict: Number of records migrated per store
+    """
+    migrated = {}
+    for name in names or STORE_SPECS:
+        source = get_store(name, 'jsonl')
+        target = get_store(name, 'sqlite')
+        if target.count():
+            if not force:
+                logger.warning(f"Skipping {name}: SQLite table already populated (use --force)")
+                migrated[name] = 0
+                continue
+            # Replace the table's contents in one transaction instead of appending a second copy
+            target.rewrite(lambda records: source.iter_records())
+            migrated[name] = target.count()
+            logger.info(f"Replaced {name} records in {HISTORY_DB_PATH} with {migrated[name]} migrated records")
+            continue
+        batch, total = [], 0
+        for record in source.iter_records():
+            batch.append(record)
+            if len(batch) >= batch_size:
+                target._write(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            target._write(batch)
+        total += len(batch)
+        migrated[name] = total
+        logger.info(f"Migrated {total} {name} records to {HISTORY_DB_PATH}")
+    return migrated
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if not args or args[0] != 'migrate':
+        print("Usage: python history_store.py migrate [--force] [device|transport|electricity ...]")
+        sys.exit(1)
+    force = '--force' in args
+    names = [arg for arg in args[1:] if not arg.startswith('--')]
+    print(json.dumps(migrate(names or None, force=force)))
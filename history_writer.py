@@ -0,0 +1,237 @@
+import os
+import time
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # non-POSIX: fall back to in-process locking only
+    fcntl = None
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# 'none' leaves flushing to the OS, 'always' fsyncs every append, 'interval' at most every HISTORY_FSYNC_INTERVAL s
+FSYNC_POLICY = os.environ.get('HISTORY_FSYNC', 'none')
+FSYNC_INTERVAL = float(os.environ.get('HISTORY_FSYNC_INTERVAL', 1.0))
+# > 0 coalesces appends from concurrent requests and writes them once per window
+FLUSH_WINDOW = float(os.environ.get('HISTORY_FLUSH_WINDOW_MS', 0)) / 1000
+
+_local = threading.local()
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+_pending = {}
+_pending_lock = threading.Lock()
+_flusher = None
+_flusher_pid = None
+_last_fsync = {}
+
+
+def _thread_lock(path):
+    with _thread_locks_guard:
+        lock = _thread_locks.get(path)
+        if lock is None:
+            lock = _thread_locks[path] = threading.Lock()
+        return lock
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Exclusive lock on path's sidecar .lock file, shared by threads and worker processes.
+    Re-entrant within a thread, so a reader holding it can still flush pending appends.
+    """
+    held = getattr(_local, 'held', None)
+    if held is None:
+        held = _local.held = set()
+    if path in held:
+        yield
+        return
+    with _thread_lock(path):
+        held.add(path)
+        try:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+        finally:
+            held.discard(path)
+
+
+def read_generation(path):
+    """
+    How many times path has been rewritten in place (kept in its .lock file).
+    Readers compare it, as well as the file's inode, size and mtime, to detect a swapped-in file.
+    """
+    try:
+        with open(path + '.lock', 'rb') as f:
+            raw = f.read(16)
+    except FileNotFoundError:
+        return 0
+    try:
+        return int(raw, 16) if raw.strip() else 0
+    except ValueError:
+        return 0
+
+
+def bump_generation(path):
+    """Record a rewrite of path; call with file_lock(path) held, after the new file is in place"""
+    generation = read_generation(path) + 1
+    fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        os.pwrite(fd, f"{generation:016x}".encode('ascii'), 0)
+    finally:
+        os.close(fd)
+    return generation
+
+
+def _should_fsync(path):
+    if FSYNC_POLICY == 'always':
+        return True
+    if FSYNC_POLICY == 'interval':
+        now = time.monotonic()
+        if now - _last_fsync.get(path, 0) >= FSYNC_INTERVAL:
+            _last_fsync[path] = now
+            return True
+    return False
+
+
+def write_now(path, data, callbacks=()):
+    """
+    Append data (bytes) to path as one locked write.
+    callbacks run once the data is written (and fsynced, per policy), still under
+    the file lock, so anyone holding the lock sees the rows and their callbacks together.
+    """
+    if not data:
+        return
+    with file_lock(path):
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                written = os.write(fd, view)
+                view = view[written:]
+            if _should_fsync(path):
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"History write callback failed for {path}: {e}")
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_WINDOW)
+        flush()
+
+
+def _ensure_flusher():
+    global _flusher, _flusher_pid
+    if _flusher is None or _flusher_pid != os.getpid():
+        _flusher = threading.Thread(target=_flush_loop, name="history-flusher", daemon=True)
+        _flusher_pid = os.getpid()
+        _flusher.start()
+
+
+def _enqueue(path, chunks, callbacks):
+    with _pending_lock:
+        pending = _pending.setdefault(path, ([], []))
+        pending[0].extend(chunks)
+        pending[1].extend(callbacks)
+        _ensure_flusher()
+
+
+def append(path, data, on_written=None):
+    """
+    Append encoded JSON lines to a history file.
+    Inside a batch the data is held until the batch ends; with a flush window it
+    is coalesced with other requests' appends; otherwise it is written at once.
+    on_written() is called only after the data actually reaches the file; if the
+    write fails it is never called.
+    """
+    callbacks = [on_written] if on_written is not None else []
+    batch = getattr(_local, 'batch', None)
+    if batch is not None:
+        pending = batch.setdefault(path, ([], []))
+        pending[0].append(data)
+        pending[1].extend(callbacks)
+    elif FLUSH_WINDOW > 0:
+        _enqueue(path, [data], callbacks)
+    else:
+        write_now(path, data, callbacks)
+
+
+def flush(path=None):
+    """Write out coalesced appends (for one path or all) so readers see them"""
+    with _pending_lock:
+        if path is None:
+            items = list(_pending.items())
+            _pending.clear()
+        else:
+            items = [(path, _pending.pop(path))] if path in _pending else []
+    for target, (chunks, callbacks) in items:
+        try:
+            write_now(target, b"".join(chunks), callbacks)
+        except OSError as e:
+            logger.error(f"CRITICAL: Failed to flush history to {target}: {e}")
+
+
+def begin_batch():
+    """Start buffering this thread's appends (e.g. for the duration of a request)"""
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    if _local.depth == 1:
+        _local.batch = {}
+
+
+def end_batch(discard=False):
+    """
+    Write everything buffered since begin_batch, one append per file.
+    With discard=True (e.g. the request failed) the buffered appends are dropped instead.
+    """
+    depth = getattr(_local, 'depth', 0)
+    if depth == 0:
+        return
+    _local.depth = depth - 1
+    if _local.depth:
+        return
+    batch, _local.batch = _local.batch, None
+    if discard:
+        if batch:
+            logger.warning(f"Discarded unwritten history appends for {', '.join(batch)}")
+        return
+    for path, (chunks, callbacks) in batch.items():
+        if FLUSH_WINDOW > 0:
+            _enqueue(path, chunks, callbacks)
+            continue
+        try:
+            write_now(path, b"".join(chunks), callbacks)
+        except OSError as e:
+            logger.error(f"CRITICAL: Failed to write history to {path}: {e}")
+
+
+@contextmanager
+def batch():
+    begin_batch()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        end_batch(discard=failed)
+
+
+atexit.register(flush)
@@ -0,0 +1,356 @@
+import io
+import os
+import sys
+import csv
+import gzip
+import json
+import time
+import logging
+import argparse
+import datetime
+import itertools
+from datetime import timezone
+
+import numpy as np
+
+import device
+import electricity
+import grid_intensity
+import history_store
+import history_writer
+import rollups
+import tariff
+from transport import TRANSPORT_EMISSION_FACTORS
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Rows read, validated and written per chunk; bounds memory regardless of file size
+CHUNK_ROWS = int(os.environ.get('INGEST_CHUNK_ROWS', 50000))
+MAX_REPORTED_ERRORS = 10
+
+# Columns each history store's files must have
+REQUIRED_COLUMNS = {
+    'transport': ('transport_mode', 'distance'),
+    'device': ('wattage', 'hours'),
+    'electricity': ('date', 'units'),
+}
+
+
+# === COLUMN PARSING ===
+
+def _text(values):
+    """Stripped string column; missing values become ''"""
+    array = np.asarray(values)
+    if array.dtype == object:
+        array = np.array(['' if value is None or value != value else str(value) for value in array.tolist()])
+    return np.char.strip(array.astype(str))
+
+
+def _floats(values):
+    """Float64 column; NaN where a value is empty or not a number"""
+    array = np.asarray(values)
+    if array.dtype.kind in 'iufb':
+        return array.astype(np.float64)
+    text = _text(array)
+    out = np.full(len(text), np.nan)
+    given = text != ''
+    try:
+        out[given] = text[given].astype(np.float64)
+    except ValueError:
+        for i in np.flatnonzero(given).tolist():
+            try:
+                out[i] = float(text[i])
+            except ValueError:
+                pass
+    return out
+
+
+def _times(values):
+    """
+    Epoch seconds per value, NaN where missing.
+    Returns:
+        tuple: (epoch seconds, mask of values that were given but could not be parsed)
+    """
+    array = np.asarray(values)
+    if array.dtype.kind == 'M':
+        missing = np.isnat(array)
+        epoch = grid_intensity.to_epoch(array)
+        epoch[missing] = np.nan
+        return epoch, np.zeros(len(array), dtype=bool)
+    text = _text(array)
+    epoch = np.full(len(text), np.nan)
+    given = text != ''
+    try:
+        epoch[given] = grid_intensity.to_epoch(text[given])
+    except ValueError:
+        # One bad value fails the whole column; parse row by row to find it
+        for i in np.flatnonzero(given).tolist():
+            try:
+                epoch[i] = grid_intensity.to_epoch(text[i])
+            except ValueError:
+                pass
+    return epoch, given & np.isnan(epoch)
+
+
+def _optional_times(columns, name, size):
+    if name not in columns:
+        return np.full(size, np.nan), np.zeros(size, dtype=bool)
+    return _times(columns[name])
+
+
+def _iso(epoch, unit='s'):
+    """ISO strings for epoch seconds: timestamps with a trailing Z, or days with unit='D'"""
+    text = np.datetime_as_string(epoch.astype('datetime64[s]'), unit=unit)
+    return text if unit == 'D' else np.char.add(text, 'Z')
+
+
+def _now():
+    return datetime.datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+# === CHUNK PROCESSORS ===
+# Each turns one chunk of columns into history entries, in the shape the API
+# endpoints save, plus a mask of the rows that failed validation.
+
+def _transport_entries(columns, size, options):
+    modes = np.char.lower(_text(columns['transport_mode']))
+    distances = _floats(columns['distance'])
+    keys, inverse = np.unique(modes, return_inverse=True)
+    factors = np.array([TRANSPORT_EMISSION_FACTORS.get(key, np.nan) for key in keys.tolist()])[inverse.reshape(-1)]
+    times, bad_time = _optional_times(columns, 'timestamp', size)
+
+    valid = np.isfinite(factors) & np.isfinite(distances) & (distances > 0) & ~bad_time
+    emissions = distances[valid] * factors[valid]
+    times = times[valid]
+    stamps = np.where(np.isnan(times), _now(), _iso(np.nan_to_num(times)))
+    entries = [
+        {
+            'transport_mode': mode,
+            'distance_km': distance,
+            'carbon_emissions_kg': round(emission, 2),
+            'timestamp': stamp
+        }
+        for mode, distance, emission, stamp in zip(
+            modes[valid].tolist(), distances[valid].tolist(), emissions.tolist(), stamps.tolist())
+    ]
+    return entries, ~valid
+
+
+def _device_entries(columns, size, options):
+    wattage = _floats(columns['wattage'])
+    hours = _floats(columns['hours'])
+    names = _text(columns['device']) if 'device' in columns else np.full(size, '')
+    regions = np.char.lower(_text(columns['region'])) if 'region' in columns else np.full(size, '')
+    regions = np.where(regions == '', (options.get('region') or '').lower(), regions)
+    starts, bad_start = _optional_times(columns, 'start', size)
+    times, bad_time = _optional_times(columns, 'timestamp', size)
+
+    valid = np.isfinite(wattage) & np.isfinite(hours) & (wattage > 0) & (hours > 0) & ~bad_start & ~bad_time
+    wattage, hours, names, regions = wattage[valid], hours[valid], names[valid], regions[valid]
+    # A usage window starts at 'start', else at the record's timestamp, else ends now
+    starts = np.where(np.isnan(starts[valid]), times[valid], starts[valid])
+    times = np.where(np.isnan(times[valid]), starts, times[valid])
+
+    if options.get('carbon_intensity') is not None:
+        intensity = np.full(len(hours), float(options['carbon_intensity']))
+    else:
+        intensity = np.empty(len(hours))
+        for region in np.unique(regions).tolist():
+            rows = regions == region
+            window = [None if np.isnan(value) else value for value in starts[rows].tolist()]
+            intensity[rows], _ = device.usage_intensity(region, hours[rows], window, device.DEFAULT_INTENSITY)
+
+    energy_kwh, emissions_g = device.calculate_emissions(wattage, hours, intensity)
+    stamps = np.where(np.isnan(times), _now(), _iso(np.nan_to_num(times)))
+    entries = [
+        {
+            'timestamp': stamp,
+            'device': name or 'Unknown Device',
+            'emissions_kg': round(grams / 1000, 3),
+            'energy_kwh': round(kwh, 3),
+            'wattage': watts,
+            'hours': hour_count
+        }
+        for stamp, name, grams, kwh, watts, hour_count in zip(
+            stamps.tolist(), names.tolist(), emissions_g.tolist(), energy_kwh.tolist(),
+            wattage.tolist(), hours.tolist())
+    ]
+    return entries, ~valid
+
+
+def _electricity_entries(columns, size, options):
+    units = _floats(columns['units'])
+    dates, _ = _times(columns['date'])
+    names = np.char.lower(_text(columns['tariff'])) if 'tariff' in columns else np.full(size, '')
+    names = np.where(names == '', (options.get('tariff') or tariff.DEFAULT_TARIFF).lower(), names)
+    regions = np.char.lower(_text(columns['region'])) if 'region' in columns else np.full(size, '')
+    regions = np.where(regions == '', (options.get('region') or electricity.BILL_REGION).lower(), regions)
+
+    valid = np.isfinite(units) & (units >= 0) & np.isfinite(dates)
+    amounts = np.full(size, np.nan)
+    for name in np.unique(names[valid]).tolist():
+        rows = valid & (names == name)
+        try:
+            amounts[rows] = tariff.get_tariff(name).price_many(units[rows])
+        except ValueError:
+            valid &= ~rows
+    # Bills are dated by day, so the intensity window ends at the end of that day
+    days = np.floor(dates / 86400) * 86400
+    intensity = np.full(size, np.nan)
+    for region in np.unique(regions[valid]).tolist():
+        rows = valid & (regions == region)
+        intensity[rows] = electricity.bill_intensity_many(days[rows], region)
+
+    entries = [
+        {
+            'date': day,
+            'units': reading,
+            'bill_amount': amount,
+            'co2_emissions': round(reading * kg_per_kwh, 2),
+            'tariff': name
+        }
+        for day, reading, amount, kg_per_kwh, name in zip(
+            _iso(days[valid], 'D').tolist(), units[valid].tolist(), amounts[valid].tolist(),
+            intensity[valid].tolist(), names[valid].tolist())
+    ]
+    return entries, ~valid
+
+
+PROCESSORS = {
+    'transport': _transport_entries,
+    'device': _device_entries,
+    'electricity': _electricity_entries,
+}
+
+
+# === READERS ===
+
+def _csv_chunks(path, chunk_size):
+    """Yield ({column: values}, rows, fraction of the file read) for a CSV or gzipped CSV file"""
+    with open(path, 'rb') as raw:
+        total = os.fstat(raw.fileno()).st_size
+        stream = gzip.GzipFile(fileobj=raw) if path.endswith('.gz') else raw
+        reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+        fields = [field.strip() for field in next(reader, [])]
+        width = len(fields)
+        while True:
+            rows = list(itertools.islice(reader, chunk_size))
+            if not rows:
+                break
+            rows = [row if len(row) == width else (row + [''] * width)[:width] for row in rows]
+            columns = dict(zip(fields, (list(values) for values in zip(*rows))))
+            yield columns, len(rows), raw.tell() / total if total else 1.0
+
+
+def _parquet_chunks(path, chunk_size):
+    """Yield ({column: values}, rows, fraction of the file read) for a Parquet file, one row batch at a time"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError(f"{path}: reading Parquet needs the pyarrow package")
+    parquet = pq.ParquetFile(path)
+    total = parquet.metadata.num_rows
+    done = 0
+    for batch in parquet.iter_batches(batch_size=chunk_size):
+        columns = {name: batch.column(i).to_numpy(zero_copy_only=False) for i, name in enumerate(batch.schema.names)}
+        done += batch.num_rows
+        yield columns, batch.num_rows, done / total if total else 1.0
+
+
+def read_chunks(path, chunk_size=CHUNK_ROWS):
+    """Stream a .csv, .csv.gz or .parquet file as column chunks of at most chunk_size rows"""
+    if chunk_size <= 0:
+        raise ValueError("Chunk size must be positive")
+    if path.endswith('.parquet'):
+        return _parquet_chunks(path, chunk_size)
+    if path.endswith('.csv') or path.endswith('.csv.gz'):
+        return _csv_chunks(path, chunk_size)
+    raise ValueError(f"{path}: expected a .csv, .csv.gz or .parquet file")
+
+
+# === INGESTION ===
+
+def ingest(kind, path, user=None, chunk_size=CHUNK_ROWS, dry_run=False, options=None, progress=None):
+    """
+    Stream a CSV or Parquet file into a history store, one chunk at a time.
+    Rows are validated and calculated per chunk with the same factors, device
+    intensity and slab tariffs as the API; invalid rows are skipped and counted.
+    Args:
+        kind (str): 'transport', 'device' or 'electricity'
+        path (str): .csv, .csv.gz or .parquet file
+        user (str): User partition to write to (default: the shared history)
+        chunk_size (int): Rows per chunk (and per history write)
+        dry_run (bool): Validate and calculate without writing anything
+        options (dict): Defaults for rows without them: 'region', 'tariff',
+            and 'carbon_intensity' (g/kWh, overrides every device row)
+        progress (callable): Called with the running report after every chunk
+    Returns:
+        dict: Rows read, written and rejected, the first rejected row numbers, and timing
+    Raises:
+        ValueError: If the kind, user, file type or required columns are invalid
+    """
+    if kind not in PROCESSORS:
+        raise ValueError(f"Unknown history store: {kind}. Choose from: {', '.join(PROCESSORS)}")
+    options = dict(options or {})
+    if options.get('tariff'):
+        tariff.get_tariff(options['tariff'])
+    store = history_store.get_store(kind, user=user)
+    report = {'kind': kind, 'path': path, 'user': history_store.check_user(user), 'dry_run': dry_run,
+              'rows': 0, 'written': 0, 'invalid': 0, 'invalid_rows': [], 'chunks': 0, 'progress': 0.0}
+    started = time.perf_counter()
+
+    for columns, size, fraction in read_chunks(path, chunk_size):
+        missing = [column for column in REQUIRED_COLUMNS[kind] if column not in columns]
+        if missing:
+            raise ValueError(f"{path}: missing required columns {', '.join(missing)}")
+        entries, invalid = PROCESSORS[kind](columns, size, options)
+        rejected = np.flatnonzero(invalid)
+        if rejected.size and len(report['invalid_rows']) < MAX_REPORTED_ERRORS:
+            report['invalid_rows'].extend(
+                (report['rows'] + rejected[:MAX_REPORTED_ERRORS - len(report['invalid_rows'])] + 1).tolist())
+        if entries and not dry_run:
+            store.append_many(entries)
+        report['rows'] += size
+        report['written'] += 0 if dry_run else len(entries)
+        report['invalid'] += int(rejected.size)
+        report['chunks'] += 1
+        report['progress'] = round(fraction, 4)
+        report['elapsed_s'] = round(time.perf_counter() - started, 3)
+        report['rows_per_second'] = round(report['rows'] / report['elapsed_s'], 1) if report['elapsed_s'] else None
+        if progress is not None:
+            progress(report)
+
+    history_writer.flush()
+    report['elapsed_s'] = round(time.perf_counter() - started, 3)
+    logger.info(f"Ingested {path} into {kind} history{f' for user {user}' if user else ''}: "
+                f"{report['written']} written, {report['invalid']} invalid of {report['rows']} rows")
+    return report
+
+
+def _print_progress(report):
+    print(f"{report['kind']}: {report['rows']:,} rows ({report['progress']:.0%}), {report['written']:,} written, "
+          f"{report['invalid']:,} invalid, {report['rows_per_second'] or 0:,.0f} rows/s", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk-load historical CSV or Parquet data into CarbonTracker history")
+    parser.add_argument('kind', choices=sorted(PROCESSORS))
+    parser.add_argument('path', help=".csv, .csv.gz or .parquet file")
+    parser.add_argument('--user', help="a user's partition instead of the shared history")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_ROWS, help="rows per chunk")
+    parser.add_argument('--region', help="grid region for rows without a 'region' column value")
+    parser.add_argument('--tariff', help="electricity tariff for rows without a 'tariff' column value")
+    parser.add_argument('--carbon-intensity', type=float, help="g/kWh for every device row instead of the region's")
+    parser.add_argument('--dry-run', action='store_true', help="validate and calculate without writing")
+    parser.add_argument('--quiet', action='store_true', help="no per-chunk progress on stderr")
+    args = parser.parse_args()
+    rollups.install()
+    try:
+        result = ingest(args.kind, args.path, args.user, args.chunk_size, args.dry_run,
+                        {'region': args.region, 'tariff': args.tariff, 'carbon_intensity': args.carbon_intensity},
+                        None if args.quiet else _print_progress)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print(json.dumps(result))
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Job store shared by every gunicorn worker on the host
+JOBS_DB_PATH = os.environ.get('OCR_JOBS_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs.db'))
+JOB_WORKERS = int(os.environ.get('OCR_JOB_WORKERS', 1))
+JOB_TTL_SECONDS = int(os.environ.get('OCR_JOB_TTL', 24 * 3600))
+MAX_WAIT_SECONDS = 30
+# How often a long-poll re-reads the job
+POLL_INTERVAL = 0.25
+FINISHED = ('done', 'failed')
+
+_executor = None
+_executor_lock = threading.Lock()
+_schema_ready = False
+
+
+def _connect():
+    global _schema_ready
+    conn = sqlite3.connect(JOBS_DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    if not _schema_ready:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL,"
+            " result TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.commit()
+        _schema_ready = True
+    return conn
+
+
+def _set_status(job_id, status, result=None, error=None):
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+            )
+    finally:
+        conn.close()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn keeps torch/easyocr state out of the forked gunicorn worker
+            _executor = ProcessPoolExecutor(max_workers=JOB_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+# === WORKER-SIDE RUNNERS (executed in the process pool) ===
+
+def _run_receipt(image_bytes, params):
+    from ocr import extract_text, parse_receipt, estimate_carbon_emissions, register_shopping_list
+
+    register_shopping_list(params.get('shopping_list', []))
+    text = extract_text(image_bytes)
+    if not text:
+        raise RuntimeError("Failed to extract text from image")
+    items = parse_receipt(text)
+    if not items:
+        raise RuntimeError("No items detected in receipt")
+    return estimate_carbon_emissions(items)
+
+
+def _run_electricity(image_bytes, params):
+    from electricity import process_electricity_bill
+
+    return process_electricity_bill(image_bytes, region=params.get('region'), tariff_name=params.get('tariff'))
+
+
+_RUNNERS = {
+    'receipt': _run_receipt,
+    'electricity': _run_electricity,
+}
+
+
+def _execute(job_id, kind, image_bytes, params):
+    _set_status(job_id, 'running')
+    return _RUNNERS[kind](image_bytes, params)
+
+
+# === PUBLIC API (called from the web worker) ===
+
+def submit(kind, image_bytes, on_result=None, **params):
+    """
+    Queue an OCR job and return its ID immediately.
+    Args:
+        kind (str): 'receipt' or 'electricity'
+        image_bytes (bytes): Uploaded image content
+        on_result (callable): Optional hook run in this process with the result before it is stored
+    Returns:
+        str: Job ID to poll with get_job/wait_for_job
+    """
+    if kind not in _RUNNERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("DELETE FROM jobs WHERE updated_at < ?", (now - JOB_TTL_SECONDS,))
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, kind, now, now),
+            )
+    finally:
+        conn.close()
+
+    def _done(future):
+        try:
+            result = future.result()
+            if on_result is not None:
+                on_result(result)
+            _set_status(job_id, 'done', result=result)
+        except Exception as e:
+            logger.error(f"Job {job_id} ({kind}) failed: {e}")
+            _set_status(job_id, 'failed', error=str(e))
+
+    future = _get_executor().submit(_execute, job_id, kind, image_bytes, params)
+    future.add_done_callback(_done)
+    logger.debug(f"Queued {kind} job {job_id}")
+    return job_id
+
+
+def get_job(job_id):
+    """Return the job as a dict, or None if it does not exist"""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return {
+        'job_id': row['id'],
+        'kind': row['kind'],
+        'status': row['status'],
+        'result': json.loads(row['result']) if row['result'] else None,
+        'error': row['error'],
+        'created_at': row['created_at'],
+        'updated_at': row['updated_at'],
+    }
+
+
+def wait_seconds(timeout):
+    """Clamp a requested long-poll timeout to 0..MAX_WAIT_SECONDS"""
+    return min(max(timeout, 0), MAX_WAIT_SECONDS)
+
+
+def wait_for_job(job_id, timeout, interval=POLL_INTERVAL):
+    """Long-poll until the job finishes or the timeout (capped at MAX_WAIT_SECONDS) expires"""
+    deadline = time.monotonic() + wait_seconds(timeout)
+    while True:
+        job = get_job(job_id)
+        if job is None or job['status'] in FINISHED or time.monotonic() >= deadline:
+            return job
+        time.sleep(min(interval, deadline - time.monotonic()))
@@ -0,0 +1,343 @@
+import os
+import json
+import time
+import glob
+import atexit
+import bisect
+import logging
+import datetime
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+import history_writer
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+# Each process (gunicorn worker, OCR job worker) snapshots its metrics here; /metrics merges them
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(BASE_DIR, '.metrics'))
+FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 2.0))
+# Requests slower than this keep their per-stage breakdown
+SLOW_REQUEST_MS = float(os.environ.get('METRICS_SLOW_REQUEST_MS', 1000))
+SLOW_SAMPLES = int(os.environ.get('METRICS_SLOW_SAMPLES', 50))
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_HELP = {
+    'carbontracker_request_seconds': ('histogram', 'HTTP request latency by endpoint, method and status'),
+    'carbontracker_stage_seconds': ('histogram', 'Time spent in each processing stage, by endpoint'),
+    'carbontracker_slow_requests_total': ('counter', f'Requests slower than {SLOW_REQUEST_MS:g} ms'),
+    'carbontracker_ocr_cache_total': ('counter', 'OCR cache lookups by kind and result'),
+}
+
+_lock = threading.Lock()
+# The current request's endpoint, start time and stages. A context variable rather than a
+# thread-local, so it follows a request served on the ASGI event loop into executor threads
+_request = contextvars.ContextVar('metrics_request', default=None)
+_histograms = {}
+_counters = {}
+_slow = deque(maxlen=SLOW_SAMPLES)
+_pid = os.getpid()
+_last_flush = 0.0
+_owned_pid = None
+
+
+def _check_pid():
+    """Start from empty metrics in a forked child (e.g. gunicorn --preload)"""
+    global _pid, _last_flush
+    if _pid != os.getpid():
+        _histograms.clear()
+        _counters.clear()
+        _slow.clear()
+        _pid = os.getpid()
+        _last_flush = 0.0
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def observe(name, seconds, **labels):
+    """Add one observation to a histogram"""
+    with _lock:
+        _check_pid()
+        hist = _histograms.get(_key(name, labels))
+        if hist is None:
+            hist = _histograms[_key(name, labels)] = [[0] * len(BUCKETS), 0.0, 0]
+        index = bisect.bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            hist[0][index] += 1
+        hist[1] += seconds
+        hist[2] += 1
+
+
+def inc(name, value=1, **labels):
+    with _lock:
+        _check_pid()
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + value
+
+
+@contextmanager
+def stage(name):
+    """Time a block as a named stage of the current request (or of background work)"""
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        current = _request.get()
+        if current is not None:
+            current['stages'].append((name, elapsed))
+        observe('carbontracker_stage_seconds', elapsed, stage=name,
+                endpoint=current['endpoint'] if current is not None else 'none')
+        _maybe_flush()
+
+
+def timed(name):
+    """Decorator form of stage()"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def begin_request(endpoint):
+    if not METRICS_ENABLED:
+        return
+    _request.set({'endpoint': endpoint or 'unmatched', 'stages': [], 'start': time.perf_counter()})
+
+
+def end_request(method, status):
+    """Record the request started by begin_request; sample its stages if it was slow"""
+    current = _request.get()
+    if current is None:
+        return
+    elapsed = time.perf_counter() - current['start']
+    endpoint, stages = current['endpoint'], current['stages']
+    _request.set(None)
+
+    observe('carbontracker_request_seconds', elapsed, endpoint=endpoint, method=method, status=status)
+    if elapsed * 1000 >= SLOW_REQUEST_MS:
+        sample = {
+            'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'pid': os.getpid(),
+            'endpoint': endpoint,
+            'method': method,
+            'status': status,
+            'duration_ms': round(elapsed * 1000, 1),
+            'stages': [{'stage': name, 'ms': round(seconds * 1000, 1)} for name, seconds in stages],
+        }
+        with _lock:
+            _slow.append(sample)
+        inc('carbontracker_slow_requests_total', endpoint=endpoint)
+        logger.warning(f"Slow request: {json.dumps(sample)}")
+    _maybe_flush()
+
+
+# === CROSS-WORKER SNAPSHOTS ===
+
+def _snapshot_path(pid):
+    return os.path.join(METRICS_DIR, f"metrics-{pid}.json")
+
+
+def _exited_path():
+    """Totals of every process that has exited, so counters never go backwards"""
+    return os.path.join(METRICS_DIR, "metrics-exited.json")
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Skipping unreadable metrics snapshot {path}: {e}")
+        return None
+
+
+def _merge(snapshots):
+    """Sum snapshots into ({key: [buckets, sum, count]}, {key: value}, slow samples newest first)"""
+    histograms, counters, slow = {}, {}, []
+    for snapshot in snapshots:
+        for name, labels, buckets, total, count in snapshot.get('histograms', []):
+            merged = histograms.setdefault(_key(name, labels), [[0] * len(BUCKETS), 0.0, 0])
+            for i, value in enumerate(buckets[:len(BUCKETS)]):
+                merged[0][i] += value
+            merged[1] += total
+            merged[2] += count
+        for name, labels, value in snapshot.get('counters', []):
+            key = _key(name, labels)
+            counters[key] = counters.get(key, 0) + value
+        slow.extend(snapshot.get('slow', []))
+    slow.sort(key=lambda sample: sample['time'], reverse=True)
+    return histograms, counters, slow
+
+
+def mark_process_dead(pid):
+    """
+    Fold an exited process's snapshot into the exited totals and delete its file.
+    Call it from gunicorn's child_exit hook; workers also call it for themselves at exit.
+    """
+    path = _snapshot_path(pid)
+    if not os.path.exists(path):
+        return
+    exited_path = _exited_path()
+    try:
+        with history_writer.file_lock(exited_path):
+            if not os.path.exists(path):
+                return  # another process retired it first
+            snapshot = _read_json(path)
+            if snapshot is not None:
+                histograms, counters, slow = _merge([_read_json(exited_path) or {}, snapshot])
+                _write_json(exited_path, {
+                    'pid': None,
+                    'histograms': [[name, dict(labels), *hist] for (name, labels), hist in histograms.items()],
+                    'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+                    'slow': slow[:SLOW_SAMPLES],
+                })
+            os.remove(path)
+    except OSError as e:
+        logger.error(f"Failed to retire metrics snapshot {path}: {e}")
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _retire_dead_snapshots():
+    """Catch workers that were killed before they could clean up after themselves"""
+    for path in glob.glob(os.path.join(METRICS_DIR, 'metrics-*.json')):
+        pid = os.path.basename(path)[len('metrics-'):-len('.json')]
+        if pid.isdigit() and int(pid) != os.getpid() and not _is_alive(int(pid)):
+            mark_process_dead(int(pid))
+
+
+def flush():
+    """Write this process's metrics to its snapshot file"""
+    global _last_flush, _owned_pid
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        _check_pid()
+        snapshot = {
+            'pid': _pid,
+            'histograms': [[name, dict(labels), hist[0], hist[1], hist[2]]
+                           for (name, labels), hist in _histograms.items()],
+            'counters': [[name, dict(labels), value] for (name, labels), value in _counters.items()],
+            'slow': list(_slow),
+        }
+        _last_flush = time.monotonic()
+    if not snapshot['histograms'] and not snapshot['counters']:
+        return
+    path = _snapshot_path(snapshot['pid'])
+    if _owned_pid != snapshot['pid']:
+        # A file under our pid before our first write belongs to an earlier process
+        mark_process_dead(snapshot['pid'])
+        _owned_pid = snapshot['pid']
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        _write_json(path, snapshot)
+    except OSError as e:
+        logger.error(f"Failed to write metrics snapshot {path}: {e}")
+
+
+def _maybe_flush():
+    if time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+        flush()
+
+
+def _load_snapshots():
+    """Snapshots of every live process plus the exited totals"""
+    flush()
+    _retire_dead_snapshots()
+    snapshots = []
+    for path in glob.glob(os.path.join(METRICS_DIR, 'metrics-*.json')):
+        snapshot = _read_json(path)
+        if snapshot is not None:
+            snapshots.append(snapshot)
+    return snapshots
+
+
+def collect():
+    """Merge all processes' snapshots into ({key: [buckets, sum, count]}, {key: value}, slow samples)"""
+    return _merge(_load_snapshots())
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def render_prometheus():
+    """All workers' metrics in the Prometheus text exposition format"""
+    histograms, counters, _ = collect()
+    lines = []
+    for name, (kind, help_text) in METRIC_HELP.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == 'histogram':
+            for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, value in zip(BUCKETS, buckets):
+                    cumulative += value
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', f'{bound:g}'))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        else:
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def slow_requests(limit=None):
+    """Most recent slow-request samples across all workers"""
+    _, _, slow = collect()
+    return slow[:limit] if limit else slow
+
+
+def _on_exit():
+    flush()
+    if _owned_pid == os.getpid():
+        mark_process_dead(_owned_pid)
+        # Anything recorded by later exit handlers is new, not already in the exited totals
+        with _lock:
+            _histograms.clear()
+            _counters.clear()
+            _slow.clear()
+
+
+atexit.register(_on_exit)
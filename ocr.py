@@ -1,16 +1,28 @@
-import easyocr
-from PIL import Image
-import re
 import os
+import re
 import logging
-import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import metrics
+import ocr_cache
+import preprocess
+from ocr_readers import get_reader
+from emission_matcher import FactorTable, get_matcher
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# Batch OCR settings
+BATCH_SIZE = int(os.environ.get('OCR_BATCH_SIZE', 8))
+BATCH_WORKERS = int(os.environ.get('OCR_BATCH_WORKERS', os.environ.get('OCR_READER_POOL_SIZE', 1)))
+# Images share a padded batch only while the padded canvas is at most this many times their own area
+BATCH_MAX_PAD = float(os.environ.get('OCR_BATCH_MAX_PAD', 2.0))
+
+_batch_executor = None
+
 # Carbon emission data (kg CO2e per unit)
-CARBON_EMISSIONS = {
+CARBON_EMISSIONS = FactorTable({
     "milk": 1.5, "chicken": 6.9, "bread": 1.0, "egg": 0.2, "beef": 60.0,
     "apple": 0.3, "rice": 2.7, "pasta": 1.8, "cheese": 13.5, "tomato": 1.1,
     "coffee": 0.7, "water": 0.2, "soda": 0.5, "plastic bag": 0.05, "paper bag": 0.04,
@@ -27,45 +39,221 @@ CARBON_EMISSIONS = {
     "cheese crackers": 1.5,
     "chocolate cookies": 2.0,
     "chicken breast": 6.6,
-}
+})
 
-def preprocess_image(image_path):
+def register_shopping_list(shopping_list):
+    """Give unknown shopping-list items a default factor so they are matched"""
+    for item in shopping_list:
+        item = item.strip().lower()
+        if item and item not in CARBON_EMISSIONS:
+            CARBON_EMISSIONS[item] = 1.0
+
+def decode_image(image):
+    """
+    Decode an image once into a BGR NumPy array.
+    Args:
+        image (bytes | numpy.ndarray | str): Encoded upload bytes, an already decoded array, or a file path
+    Returns:
+        numpy.ndarray: Decoded image
+    Raises:
+        ValueError: If the data cannot be decoded as an image
+    """
+    if isinstance(image, np.ndarray):
+        return image
+    # OpenCV is imported on first use so workers that never see an image don't load it
+    import cv2
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        img = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+    else:
+        img = cv2.imread(image)
+    if img is None:
+        raise ValueError("Cannot decode image")
+    return img
+
+def preprocess_image(image, profile='receipt'):
+    """Decode, grayscale, then crop/deskew/downscale per the document profile (see preprocess.py)"""
     try:
-        logger.debug(f"Preprocessing image: {image_path}")
-        img = Image.open(image_path)
-        img = img.convert("L")  # Grayscale
-        return img
+        logger.debug("Preprocessing image")
+        img = decode_image(image)
+        if img.ndim == 3:
+            import cv2
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)  # Grayscale
+        return preprocess.prepare(img, profile)
     except Exception as e:
         logger.error(f"Image preprocessing error: {str(e)}")
         return None
 
-def extract_text(image_path):
+def extract_text(image):
+    """
+    Run OCR on upload bytes, a decoded array or a file path without touching disk.
+    Text for previously seen upload bytes is served from the OCR cache.
+    """
     try:
-        logger.debug("Initializing EasyOCR reader")
-        reader = easyocr.Reader(['en'], gpu=False)
-        logger.debug(f"Reading image: {image_path}")
-        img = preprocess_image(image_path)
+        key = ocr_cache.content_key(image)
+        cached = ocr_cache.get('receipt', key)
+        if cached is not None:
+            logger.debug("Extracted text served from OCR cache")
+            return cached
+        with metrics.stage('preprocess_image'):
+            img = preprocess_image(image)
         if img is None:
             logger.error("Image preprocessing failed")
             return ""
-        temp_path = f"static/temp_{uuid.uuid4().hex}.png"
-        logger.debug(f"Saving preprocessed image to: {temp_path}")
-        img.save(temp_path)
+        similar, image_hash = ocr_cache.get_similar('receipt', img)
+        if similar is not None:
+            ocr_cache.put('receipt', key, similar, image_hash)
+            return similar
+        ocr_cache.miss('receipt')
         logger.debug("Running OCR")
-        results = reader.readtext(temp_path, detail=0)
+        with get_reader() as reader:
+            with metrics.stage('readtext'):
+                results = reader.readtext(img, detail=0)
         text = " ".join(results)
         logger.debug(f"Extracted text: {text}")
-
-        try:
-            os.remove(temp_path)
-            logger.debug(f"Removed temporary file: {temp_path}")
-        except Exception as e:
-            logger.warning(f"Failed to remove temp file {temp_path}: {str(e)}")
+        if text:
+            ocr_cache.put('receipt', key, text, image_hash)
         return text
     except Exception as e:
         logger.error(f"OCR error: {str(e)}")
         return ""
 
+def _pad_to_common_size(images):
+    """Pad grayscale images with white to the largest height/width in the batch"""
+    height = max(img.shape[0] for img in images)
+    width = max(img.shape[1] for img in images)
+    padded = []
+    for img in images:
+        canvas = np.full((height, width), 255, dtype=img.dtype)
+        canvas[:img.shape[0], :img.shape[1]] = img
+        padded.append(canvas)
+    return padded
+
+def _size_buckets(prepared, batch_size):
+    """
+    Group (index, image) pairs of similar size, at most batch_size per group, so
+    padding to the largest image in a group never inflates a small one by more
+    than BATCH_MAX_PAD.
+    """
+    buckets, current, height, width = [], [], 0, 0
+    for item in sorted(prepared, key=lambda item: (item[1].shape[0] * item[1].shape[1], item[1].shape)):
+        h, w = item[1].shape[:2]
+        grown_h, grown_w = max(height, h), max(width, w)
+        smallest = current[0][1].shape[0] * current[0][1].shape[1] if current else h * w
+        if current and (len(current) >= batch_size or grown_h * grown_w > BATCH_MAX_PAD * max(smallest, 1)):
+            buckets.append(current)
+            current, grown_h, grown_w = [], h, w
+        current.append(item)
+        height, width = grown_h, grown_w
+    if current:
+        buckets.append(current)
+    return buckets
+
+def _read_bucket(reader, bucket, batch_size):
+    """Text per image of one size bucket; a failed batch falls back to reading each image alone"""
+    images = [img for _, img in bucket]
+    try:
+        with metrics.stage('readtext_batched'):
+            results = reader.readtext_batched(_pad_to_common_size(images), detail=0, batch_size=batch_size)
+        return [" ".join(lines) for lines in results]
+    except Exception as e:
+        logger.error(f"Batch OCR error, reading {len(images)} images one by one: {str(e)}")
+    texts = []
+    for img in images:
+        try:
+            with metrics.stage('readtext'):
+                texts.append(" ".join(reader.readtext(img, detail=0)))
+        except Exception as e:
+            logger.error(f"OCR error: {str(e)}")
+            texts.append("")
+    return texts
+
+def extract_text_batch(images, batch_size=None):
+    """
+    Run OCR over several images with EasyOCR's batched readtext.
+    Images are batched with others of similar size, and one image that breaks a
+    batch only costs the rest of its batch a per-image retry.
+    Args:
+        images (list): Upload bytes, decoded arrays or file paths
+        batch_size (int): Images per detector/recognizer batch
+    Returns:
+        list: Extracted text per image ("" where an image failed)
+    """
+    batch_size = batch_size or BATCH_SIZE
+    texts = [""] * len(images)
+    keys = [ocr_cache.content_key(image) for image in images]
+    hashes = [None] * len(images)
+    prepared = []
+    with metrics.stage('preprocess_image'):
+        for index, image in enumerate(images):
+            cached = ocr_cache.get('receipt', keys[index])
+            if cached is not None:
+                texts[index] = cached
+                continue
+            img = preprocess_image(image)
+            if img is None:
+                continue
+            similar, hashes[index] = ocr_cache.get_similar('receipt', img)
+            if similar is not None:
+                texts[index] = similar
+                ocr_cache.put('receipt', keys[index], similar, hashes[index])
+                continue
+            ocr_cache.miss('receipt')
+            prepared.append((index, img))
+    if not prepared:
+        return texts
+
+    try:
+        with get_reader() as reader:
+            for bucket in _size_buckets(prepared, batch_size):
+                for (index, _), text in zip(bucket, _read_bucket(reader, bucket, batch_size)):
+                    texts[index] = text
+                    if text:
+                        ocr_cache.put('receipt', keys[index], text, hashes[index])
+    except Exception as e:
+        logger.error(f"Batch OCR error: {str(e)}")
+    return texts
+
+def _receipt_result(text):
+    if not text:
+        return {"error": "Failed to extract text from image"}
+    items = parse_receipt(text)
+    if not items:
+        return {"error": "No items detected in receipt"}
+    return {"results": estimate_carbon_emissions(items)}
+
+def _get_batch_executor():
+    global _batch_executor
+    if _batch_executor is None:
+        _batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="ocr-batch")
+    return _batch_executor
+
+def iter_receipt_batch(named_images, batch_size=None):
+    """
+    Estimate emissions for many receipts, yielding each result as its batch finishes.
+    Args:
+        named_images (list): (name, image) pairs
+        batch_size (int): Images per OCR batch
+    Yields:
+        dict: {"name": ..., "results": [...]} or {"name": ..., "error": ...}
+    """
+    batch_size = batch_size or BATCH_SIZE
+    chunks = [named_images[i:i + batch_size] for i in range(0, len(named_images), batch_size)]
+    executor = _get_batch_executor()
+    futures = {
+        executor.submit(extract_text_batch, [image for _, image in chunk], batch_size): chunk
+        for chunk in chunks
+    }
+    for future in as_completed(futures):
+        chunk = futures[future]
+        try:
+            texts = future.result()
+        except Exception as e:
+            logger.error(f"Batch worker error: {str(e)}")
+            texts = [""] * len(chunk)
+        for (name, _), text in zip(chunk, texts):
+            yield {"name": name, **_receipt_result(text)}
+
+@metrics.timed('parse_receipt')
 def parse_receipt(text):
     try:
         logger.debug(f"Parsing text: {text}")
@@ -85,18 +273,19 @@ def parse_receipt(text):
         logger.error(f"Receipt parsing error: {str(e)}")
         return []
 
+@metrics.timed('estimate_emissions')
 def estimate_carbon_emissions(items):
     try:
         logger.debug(f"Estimating emissions for items: {items}")
         results = []
+        matcher = get_matcher(CARBON_EMISSIONS)
         for entry in items:
             item = entry["item"]
             quantity = entry["quantity"]
-            for key in CARBON_EMISSIONS:
-                if key in item:
-                    emissions = CARBON_EMISSIONS[key] * quantity
-                    results.append({"item": item, "quantity": quantity, "emissions": emissions})
-                    break
+            key = matcher.longest_match(item)
+            if key is not None:
+                emissions = CARBON_EMISSIONS[key] * quantity
+                results.append({"item": item, "quantity": quantity, "emissions": emissions})
         logger.debug(f"Emissions results: {results}")
         return results
     except Exception as e:
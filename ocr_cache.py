@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Entries kept in memory per process; 0 disables the cache
+CACHE_SIZE = int(os.environ.get('OCR_CACHE_SIZE', 512))
+# SQLite file for a tier that survives restarts and is shared by workers; empty keeps memory only
+CACHE_DB_PATH = os.environ.get('OCR_CACHE_DB', '')
+CACHE_DB_MAX_ROWS = int(os.environ.get('OCR_CACHE_DB_MAX_ROWS', 100000))
+# > 0 also matches near-duplicate images whose 256-bit dHash differs in at most this many bits
+DHASH_DISTANCE = int(os.environ.get('OCR_CACHE_DHASH_DISTANCE', 0))
+HASH_SIZE = 16
+# Bump when the OCR pipeline changes so results cached on disk by older code are ignored
+CACHE_VERSION = 2
+PRUNE_EVERY = 256
+
+_lock = threading.Lock()
+_memory = OrderedDict()  # (kind, key) -> (value, dhash or None)
+_stats = {'hits_memory': 0, 'hits_disk': 0, 'hits_similar': 0, 'misses': 0, 'stores': 0}
+_local = threading.local()
+_puts_since_prune = 0
+
+
+def content_key(image):
+    """sha256 of upload bytes, or None for inputs that are not raw bytes"""
+    if CACHE_SIZE <= 0 or not isinstance(image, (bytes, bytearray, memoryview)):
+        return None
+    return hashlib.sha256(image).hexdigest()
+
+
+def dhash(gray):
+    """
+    256-bit difference hash of a grayscale document image, or None if it is blank.
+    The hash is taken over the bounding box of the ink (Otsu threshold), since a
+    thumbnail of a mostly white page would hash alike for any receipt.
+    """
+    import cv2
+    _, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    points = cv2.findNonZero(ink)
+    if points is None:
+        return None
+    x, y, w, h = cv2.boundingRect(points)
+    small = cv2.resize(gray[y:y + h, x:x + w], (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def _count(kind, result):
+    with _lock:
+        _stats[result] += 1
+    metrics.inc('carbontracker_ocr_cache_total', kind=kind, result=result)
+
+
+# === DISK TIER ===
+
+def _conn():
+    if not CACHE_DB_PATH:
+        return None
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'pid', None) != os.getpid():
+        os.makedirs(os.path.dirname(CACHE_DB_PATH) or '.', exist_ok=True)
+        conn = sqlite3.connect(CACHE_DB_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_cache ("
+            " kind TEXT NOT NULL, key TEXT NOT NULL, version INTEGER NOT NULL,"
+            " value TEXT NOT NULL, used REAL NOT NULL, PRIMARY KEY (kind, key))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ocr_cache_used ON ocr_cache (used)")
+        conn.commit()
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+def _disk_get(kind, key):
+    try:
+        conn = _conn()
+        if conn is None:
+            return None
+        row = conn.execute(
+            "SELECT value FROM ocr_cache WHERE kind = ? AND key = ? AND version = ?", (kind, key, CACHE_VERSION)
+        ).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute("UPDATE ocr_cache SET used = ? WHERE kind = ? AND key = ?", (time.time(), kind, key))
+        return json.loads(row[0])
+    except (sqlite3.Error, ValueError) as e:
+        logger.error(f"OCR cache read failed: {e}")
+        return None
+
+
+def _disk_put(kind, key, value):
+    global _puts_since_prune
+    try:
+        conn = _conn()
+        if conn is None:
+            return
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO ocr_cache (kind, key, version, value, used) VALUES (?, ?, ?, ?, ?)",
+                (kind, key, CACHE_VERSION, json.dumps(value), time.time()),
+            )
+        _puts_since_prune += 1
+        if _puts_since_prune >= PRUNE_EVERY:
+            _puts_since_prune = 0
+            with conn:
+                conn.execute(
+                    "DELETE FROM ocr_cache WHERE rowid IN (SELECT rowid FROM ocr_cache ORDER BY used DESC"
+                    " LIMIT -1 OFFSET ?)", (CACHE_DB_MAX_ROWS,)
+                )
+    except sqlite3.Error as e:
+        logger.error(f"OCR cache write failed: {e}")
+
+
+# === PUBLIC API ===
+
+def get(kind, key):
+    """
+    Cached OCR value for an exact image, checking memory first and then disk.
+    Args:
+        kind (str): 'receipt' (extracted text) or 'electricity' (units)
+        key (str): content_key() of the upload
+    Returns:
+        The cached value, or None on a miss
+    """
+    if key is None:
+        return None
+    with _lock:
+        entry = _memory.get((kind, key))
+        if entry is not None:
+            _memory.move_to_end((kind, key))
+    if entry is not None:
+        _count(kind, 'hits_memory')
+        return entry[0]
+    value = _disk_get(kind, key)
+    if value is not None:
+        _remember(kind, key, value, None)
+        _count(kind, 'hits_disk')
+        return value
+    return None
+
+
+def get_similar(kind, gray):
+    """
+    Near-duplicate lookup by perceptual hash (only when OCR_CACHE_DHASH_DISTANCE > 0).
+    Returns:
+        tuple: (cached value or None, the image's dhash to pass to put())
+    """
+    if CACHE_SIZE <= 0 or DHASH_DISTANCE <= 0 or gray is None:
+        return None, None
+    image_hash = dhash(gray)
+    if image_hash is None:
+        return None, None
+    best, best_distance = None, DHASH_DISTANCE + 1
+    with _lock:
+        for (entry_kind, _), (value, entry_hash) in _memory.items():
+            if entry_kind != kind or entry_hash is None:
+                continue
+            distance = bin(entry_hash ^ image_hash).count('1')
+            if distance < best_distance:
+                best, best_distance = value, distance
+    if best is not None:
+        _count(kind, 'hits_similar')
+    return best, image_hash
+
+
+def miss(kind):
+    """Record that a lookup fell through to OCR"""
+    _count(kind, 'misses')
+
+
+def _remember(kind, key, value, image_hash):
+    with _lock:
+        _memory[(kind, key)] = (value, image_hash)
+        _memory.move_to_end((kind, key))
+        while len(_memory) > CACHE_SIZE:
+            _memory.popitem(last=False)
+
+
+def put(kind, key, value, image_hash=None):
+    """Cache an OCR value for an image in memory and, if configured, on disk"""
+    if key is None or value is None:
+        return
+    _remember(kind, key, value, image_hash)
+    _disk_put(kind, key, value)
+    with _lock:
+        _stats['stores'] += 1
+
+
+def stats():
+    with _lock:
+        result = dict(_stats, entries=len(_memory))
+    result.update(size=CACHE_SIZE, disk=bool(CACHE_DB_PATH), dhash_distance=DHASH_DISTANCE)
+    return result
+
+
+def clear():
+    """Drop the in-memory tier (the disk tier is left alone)"""
+    with _lock:
+        _memory.clear()
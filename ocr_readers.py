@@ -0,0 +1,155 @@
+import os
+import queue
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+import metrics
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Pool configuration (per gunicorn worker process)
+POOL_SIZE = int(os.environ.get('OCR_READER_POOL_SIZE', 1))
+ACQUIRE_TIMEOUT = float(os.environ.get('OCR_READER_TIMEOUT', 120))
+READER_LANGS = ['en']
+READER_GPU = os.environ.get('OCR_READER_GPU', '0') == '1'
+
+_pool = queue.Queue()
+_pool_lock = threading.Lock()
+_pool_pid = None
+_created = 0
+# Optional callable returning a reader, used instead of easyocr.Reader (e.g. a benchmark stub)
+_reader_factory = None
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    'readers_loaded': 0,
+    'load_seconds_total': 0.0,
+    'load_seconds_last': 0.0,
+    'acquisitions': 0,
+    'wait_seconds_total': 0.0,
+    'wait_seconds_max': 0.0,
+    'in_use': 0,
+    'timeouts': 0,
+}
+
+
+def _reset_after_fork():
+    """Drop readers inherited from a parent process (e.g. gunicorn --preload)"""
+    global _pool, _pool_pid, _created
+    _pool = queue.Queue()
+    _pool_pid = os.getpid()
+    _created = 0
+
+
+@metrics.timed('reader_load')
+def _load_reader():
+    start = time.perf_counter()
+    if _reader_factory is not None:
+        reader = _reader_factory()
+    else:
+        # easyocr pulls in torch; import it only when the first reader is built
+        import easyocr
+        reader = easyocr.Reader(READER_LANGS, gpu=READER_GPU)
+    elapsed = time.perf_counter() - start
+    with _metrics_lock:
+        _metrics['readers_loaded'] += 1
+        _metrics['load_seconds_total'] += elapsed
+        _metrics['load_seconds_last'] = elapsed
+    logger.info(f"Loaded EasyOCR reader in {elapsed:.2f}s (pid {os.getpid()})")
+    return reader
+
+
+def set_reader_factory(factory):
+    """
+    Build readers with factory() instead of easyocr.Reader, e.g. a deterministic
+    stub for benchmarks. Readers already in the pool are dropped; pass None to
+    go back to EasyOCR.
+    """
+    global _reader_factory
+    with _pool_lock:
+        _reader_factory = factory
+        _reset_after_fork()
+
+
+def _checkout(timeout):
+    """Take an idle reader, creating one if the pool is not yet full"""
+    global _created
+    with _pool_lock:
+        if _pool_pid != os.getpid():
+            _reset_after_fork()
+        try:
+            return _pool.get_nowait()
+        except queue.Empty:
+            pass
+        create = _created < POOL_SIZE
+        if create:
+            _created += 1
+    if create:
+        try:
+            return _load_reader()
+        except Exception:
+            with _pool_lock:
+                _created -= 1
+            raise
+    return _pool.get(timeout=timeout)
+
+
+@contextmanager
+def get_reader(timeout=None):
+    """
+    Borrow a shared EasyOCR reader from the process-wide pool.
+    Readers are created lazily up to OCR_READER_POOL_SIZE and reused across
+    requests; callers block until one is free.
+    Raises:
+        TimeoutError: If no reader becomes available within the timeout
+    """
+    timeout = ACQUIRE_TIMEOUT if timeout is None else timeout
+    start = time.perf_counter()
+    try:
+        with metrics.stage('reader_acquire'):
+            reader = _checkout(timeout)
+    except queue.Empty:
+        with _metrics_lock:
+            _metrics['timeouts'] += 1
+        raise TimeoutError("Timed out waiting for an OCR reader")
+    waited = time.perf_counter() - start
+
+    with _metrics_lock:
+        _metrics['acquisitions'] += 1
+        _metrics['wait_seconds_total'] += waited
+        _metrics['wait_seconds_max'] = max(_metrics['wait_seconds_max'], waited)
+        _metrics['in_use'] += 1
+    try:
+        yield reader
+    finally:
+        with _metrics_lock:
+            _metrics['in_use'] -= 1
+        _pool.put(reader)
+
+
+def warm_up(count=None):
+    """Load readers ahead of the first request"""
+    count = POOL_SIZE if count is None else min(count, POOL_SIZE)
+    readers = []
+    try:
+        for _ in range(count):
+            readers.append(_checkout(ACQUIRE_TIMEOUT))
+    finally:
+        for reader in readers:
+            _pool.put(reader)
+    logger.info(f"Warmed {len(readers)} OCR reader(s)")
+
+
+def reader_metrics():
+    """Return load-time and queue-wait statistics for this worker"""
+    with _metrics_lock:
+        stats = dict(_metrics)
+    acquisitions = stats['acquisitions']
+    stats['wait_seconds_avg'] = stats['wait_seconds_total'] / acquisitions if acquisitions else 0.0
+    stats['pool_size'] = POOL_SIZE
+    stats['idle'] = _pool.qsize()
+    stats['pid'] = os.getpid()
+    return stats
@@ -0,0 +1,186 @@
+import os
+import logging
+
+import numpy as np
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+PREPROCESS_ENABLED = os.environ.get('OCR_PREPROCESS', '1') == '1'
+MM_PER_INCH = 25.4
+# Document detection runs on a copy no larger than this (pixels on the long side)
+DETECT_MAX_SIDE = 800
+# A detected region must cover this share of the photo, and leave at least the rest uncovered, to be cropped
+MIN_DOCUMENT_AREA = 0.1
+MAX_DOCUMENT_AREA = 0.95
+# Text-based deskew only corrects angles in this range (degrees)
+MIN_SKEW, MAX_SKEW = 0.5, 20.0
+# Without a detected document, photos are only shrunk while their median glyph stays this tall (pixels)
+MIN_GLYPH_PX = int(os.environ.get('OCR_MIN_GLYPH_PX', 20))
+# Glyph heights are measured on a copy no larger than this (pixels on the long side)
+MEASURE_MAX_SIDE = 2000
+# Fewer glyph-sized blobs than this and the text height is treated as unknown
+MIN_GLYPHS = 20
+
+# Per document type: whether to look for the document and straighten it, the
+# physical width it is assumed to have, and the resolution OCR should see.
+# Thermal receipts are 58-80 mm wide; ~200 DPI keeps their small print legible.
+PROFILES = {
+    'receipt': {'detect': True, 'deskew': True, 'width_mm': 80,
+                'dpi': int(os.environ.get('OCR_RECEIPT_DPI', 200))},
+    'document': {'detect': True, 'deskew': True, 'width_mm': 210,
+                 'dpi': int(os.environ.get('OCR_DOCUMENT_DPI', 150))},
+    'none': {'detect': False, 'deskew': False, 'width_mm': None, 'dpi': None},
+}
+
+
+def _order_corners(points):
+    """Return corners as top-left, top-right, bottom-right, bottom-left"""
+    points = np.asarray(points, dtype=np.float32).reshape(4, 2)
+    sums = points.sum(axis=1)
+    diffs = np.diff(points, axis=1).ravel()
+    return np.array([
+        points[np.argmin(sums)], points[np.argmin(diffs)],
+        points[np.argmax(sums)], points[np.argmax(diffs)],
+    ], dtype=np.float32)
+
+
+def find_document(gray):
+    """
+    Locate a bright document (receipt, bill) against a darker background.
+    Args:
+        gray (numpy.ndarray): Grayscale photo
+    Returns:
+        numpy.ndarray: 4x2 corners in image coordinates, or None if the photo is
+        already just the document or nothing plausible was found
+    """
+    import cv2
+    height, width = gray.shape[:2]
+    scale = min(1.0, DETECT_MAX_SIDE / max(height, width))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+    blurred = cv2.GaussianBlur(small, (5, 5), 0)
+    _, mask = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Close the gaps left by printed text so the page is one blob
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((9, 9), np.uint8))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    contour = max(contours, key=cv2.contourArea)
+    share = cv2.contourArea(contour) / float(small.shape[0] * small.shape[1])
+    if share < MIN_DOCUMENT_AREA or share > MAX_DOCUMENT_AREA:
+        return None
+    approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+    corners = approx.reshape(-1, 2) if len(approx) == 4 else cv2.boxPoints(cv2.minAreaRect(contour))
+    return _order_corners(corners) / scale
+
+
+def skew_angle(gray):
+    """Angle (degrees) of the printed text block, or 0.0 if it looks straight or unclear"""
+    import cv2
+    scale = min(1.0, DETECT_MAX_SIDE / max(gray.shape[:2]))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+    _, ink = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    points = cv2.findNonZero(ink)
+    if points is None or len(points) < 50:
+        return 0.0
+    angle = cv2.minAreaRect(points)[2]
+    if angle > 45:
+        angle -= 90
+    elif angle < -45:
+        angle += 90
+    return float(angle) if MIN_SKEW <= abs(angle) <= MAX_SKEW else 0.0
+
+
+def text_height(gray):
+    """
+    Median height in pixels of the glyph-sized ink blobs in a photo.
+    Returns:
+        float: Height in the photo's own pixels, or None if too little text was found
+    """
+    import cv2
+    scale = min(1.0, MEASURE_MAX_SIDE / max(gray.shape[:2]))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+    _, ink = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    widths, heights = stats[1:, cv2.CC_STAT_WIDTH], stats[1:, cv2.CC_STAT_HEIGHT]
+    # Drop specks, rules and blobs far too big to be a character
+    glyphs = (heights >= 3) & (heights <= small.shape[0] / 10) & (widths <= heights * 3)
+    if glyphs.sum() < MIN_GLYPHS:
+        return None
+    return float(np.median(heights[glyphs])) / scale
+
+
+def _glyph_scale(gray):
+    """Downscale factor that keeps the median glyph at least MIN_GLYPH_PX tall (1.0 if unknown)"""
+    height = text_height(gray)
+    if not height:
+        return 1.0
+    return min(1.0, MIN_GLYPH_PX / height)
+
+
+def _target_scale(width_px, settings):
+    """Downscale factor that brings the document width to the profile's DPI (never upscales)"""
+    if not settings['dpi'] or not settings['width_mm']:
+        return 1.0
+    target = settings['width_mm'] / MM_PER_INCH * settings['dpi']
+    return min(1.0, target / float(width_px))
+
+
+def _warp_document(gray, corners, settings):
+    import cv2
+    tl, tr, br, bl = corners
+    width = max(np.linalg.norm(tr - tl), np.linalg.norm(br - bl))
+    height = max(np.linalg.norm(bl - tl), np.linalg.norm(br - tr))
+    scale = _target_scale(width, settings)
+
+    # Crop to the document's bounding box and shrink with area averaging before warping
+    x0, y0 = np.floor(corners.min(axis=0)).astype(int).clip(0)
+    x1, y1 = np.ceil(corners.max(axis=0)).astype(int)
+    crop = gray[y0:y1, x0:x1]
+    if scale < 1:
+        crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    source = (corners - [x0, y0]) * scale
+    out_w, out_h = max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+    target = np.array([[0, 0], [out_w - 1, 0], [out_w - 1, out_h - 1], [0, out_h - 1]], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(source.astype(np.float32), target)
+    return cv2.warpPerspective(crop, matrix, (out_w, out_h), flags=cv2.INTER_LINEAR,
+                               borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+
+
+def _deskew_and_scale(gray, settings):
+    import cv2
+    # The document's width is unknown here (it may fill only part of the frame),
+    # so scale by the measured text size rather than the photo width
+    scale = _glyph_scale(gray) if settings['dpi'] else 1.0
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    angle = skew_angle(gray) if settings['deskew'] else 0.0
+    if angle:
+        height, width = gray.shape[:2]
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+        gray = cv2.warpAffine(gray, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                              borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+    return gray
+
+
+def prepare(gray, profile='receipt'):
+    """
+    Crop, deskew and downscale a grayscale photo for OCR.
+    Args:
+        gray (numpy.ndarray): Grayscale image
+        profile (str): Key of PROFILES describing the document type
+    Returns:
+        numpy.ndarray: Image to hand to the OCR reader
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown preprocessing profile: {profile}")
+    settings = PROFILES[profile]
+    if not PREPROCESS_ENABLED or gray is None or gray.ndim != 2:
+        return gray
+    corners = find_document(gray) if settings['detect'] else None
+    if corners is not None:
+        result = _warp_document(gray, corners, settings)
+    else:
+        result = _deskew_and_scale(gray, settings)
+    logger.debug(f"Preprocessed {gray.shape[1]}x{gray.shape[0]} -> {result.shape[1]}x{result.shape[0]} ({profile})")
+    return result
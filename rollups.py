@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import sqlite3
+import logging
+import datetime
+import threading
+from contextlib import ExitStack
+from collections import OrderedDict
+
+import history_store
+import history_writer
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+ROLLUPS_DB_PATH = os.environ.get('ROLLUPS_DB', os.path.join(history_store.BASE_DIR, 'rollups.db'))
+CATEGORIES = ('device', 'transport', 'electricity')
+
+# Per category: field holding the day, emissions field, quantity field, cost field
+_FIELDS = {
+    'device': {'day': 'timestamp', 'emissions': 'emissions_kg', 'quantity': 'energy_kwh', 'cost': None},
+    'transport': {'day': 'timestamp', 'emissions': 'carbon_emissions_kg', 'quantity': 'distance_km', 'cost': None},
+    'electricity': {'day': 'date', 'emissions': 'co2_emissions', 'quantity': 'units', 'cost': 'bill_amount'},
+}
+
+_local = threading.local()
+
+
+def _db_path(user):
+    """Each user's rollups sit beside their history, so summaries only read their partition"""
+    if user is None:
+        return ROLLUPS_DB_PATH
+    return os.path.join(history_store.user_dir(user), 'rollups.db')
+
+
+def _conn(user=None):
+    if getattr(_local, 'pid', None) != os.getpid():
+        _local.conns = OrderedDict()
+        _local.pid = os.getpid()
+    conn = _local.conns.get(user)
+    if conn is not None:
+        _local.conns.move_to_end(user)
+        return conn
+    path = _db_path(user)
+    if user is not None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS daily ("
+        " category TEXT NOT NULL, day TEXT NOT NULL, count INTEGER NOT NULL,"
+        " emissions_kg REAL NOT NULL, quantity REAL NOT NULL, cost REAL NOT NULL,"
+        " PRIMARY KEY (category, day))"
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.commit()
+    _local.conns[user] = conn
+    # Bound open files per thread when many users are active
+    while len(_local.conns) > history_store.MAX_OPEN_USERS:
+        _, stale = _local.conns.popitem(last=False)
+        stale.close()
+    return conn
+
+
+def _number(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _daily_rows(category, entries):
+    """Fold raw history entries into {day: [count, emissions, quantity, cost]}"""
+    fields = _FIELDS[category]
+    totals = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        # The per-request total duplicates the per-device rows
+        if category == 'device' and entry.get('device') == 'All Devices':
+            continue
+        day = str(entry.get(fields['day']) or '')[:10]
+        if not day:
+            continue
+        row = totals.setdefault(day, [0, 0.0, 0.0, 0.0])
+        # Compacted daily aggregates stand for several original entries
+        row[0] += int(entry.get('entries') or 1)
+        row[1] += _number(entry.get(fields['emissions']))
+        row[2] += _number(entry.get(fields['quantity']))
+        if fields['cost']:
+            row[3] += _number(entry.get(fields['cost']))
+    return totals
+
+
+def _upsert(conn, category, totals):
+    conn.executemany(
+        "INSERT INTO daily (category, day, count, emissions_kg, quantity, cost) VALUES (?, ?, ?, ?, ?, ?)"
+        " ON CONFLICT (category, day) DO UPDATE SET"
+        " count = count + excluded.count, emissions_kg = emissions_kg + excluded.emissions_kg,"
+        " quantity = quantity + excluded.quantity, cost = cost + excluded.cost",
+        [(category, day, *row) for day, row in totals.items()],
+    )
+
+
+def record(category, entries, user=None):
+    """History append listener: add new entries to the daily totals of the user's partition"""
+    if category not in _FIELDS:
+        return
+    totals = _daily_rows(category, entries)
+    if not totals:
+        return
+    conn = _conn(user)
+    with conn:
+        _upsert(conn, category, totals)
+
+
+def rebuild(user=None):
+    """Recompute every daily total of one partition (default: the shared one) from its history"""
+    stores = [history_store.get_store(category, user=user) for category in CATEGORIES]
+    # Appends and their listener calls wait until the new totals are committed, so a row
+    # is either in the history read here or recorded afterwards, never both or neither
+    with ExitStack() as locks:
+        for store in stores:
+            locks.enter_context(store.lock())
+        totals = {store.name: _daily_rows(store.name, store.iter_records()) for store in stores}
+        conn = _conn(user)
+        with conn:
+            conn.execute("DELETE FROM daily")
+            for category, rows in totals.items():
+                _upsert(conn, category, rows)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built_at', ?)",
+                         (datetime.datetime.now().isoformat(),))
+    logger.info(f"Rebuilt dashboard rollups from history{f' for user {user}' if user else ''}")
+
+
+def _ensure_built(user=None):
+    conn = _conn(user)
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'built_at'").fetchone() is None:
+        rebuild(user)
+
+
+def install():
+    """Keep rollups up to date with every history write"""
+    history_store.add_append_listener(record)
+
+
+def _period_key(day, period):
+    if period == 'monthly':
+        return day[:7]
+    if period == 'weekly':
+        year, week, _ = datetime.date.fromisoformat(day).isocalendar()
+        return f"{year}-W{week:02d}"
+    return day
+
+
+def summary(start=None, end=None, user=None):
+    """
+    Daily, weekly and monthly totals per category.
+    Args:
+        start (str): Inclusive first day (YYYY-MM-DD)
+        end (str): Inclusive last day (YYYY-MM-DD)
+        user (str): User partition to summarize (default: the shared history)
+    Returns:
+        dict: {"daily": [...], "weekly": [...], "monthly": [...]}, oldest first
+    Raises:
+        ValueError: If start or end is not an ISO date or timestamp
+    """
+    start = history_store.check_bound(start or None, 'from')
+    end = history_store.check_bound(end or None, 'to')
+    # Coalesced appends reach the totals only once written
+    history_writer.flush()
+    _ensure_built(user)
+    sql = "SELECT category, day, count, emissions_kg, quantity, cost FROM daily"
+    where, params = [], []
+    if start:
+        where.append("day >= ?")
+        params.append(start[:10])
+    if end:
+        where.append("day <= ?")
+        params.append(end[:10])
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    rows = _conn(user).execute(sql + " ORDER BY day", params).fetchall()
+
+    result = {}
+    for period in ('daily', 'weekly', 'monthly'):
+        buckets = {}
+        for category, day, count, emissions, quantity, cost in rows:
+            try:
+                key = _period_key(day, period)
+            except ValueError:
+                continue
+            bucket = buckets.setdefault(key, {category: [0, 0.0, 0.0, 0.0] for category in CATEGORIES})
+            totals = bucket[category]
+            totals[0] += count
+            totals[1] += emissions
+            totals[2] += quantity
+            totals[3] += cost
+        result[period] = [_format_bucket(key, buckets[key]) for key in sorted(buckets)]
+    return result
+
+
+def _format_bucket(key, bucket):
+    formatted = {'period': key, 'total_kg': round(sum(totals[1] for totals in bucket.values()), 3)}
+    for category, (count, emissions, quantity, cost) in bucket.items():
+        fields = _FIELDS[category]
+        formatted[category] = {'count': count, 'emissions_kg': round(emissions, 3), fields['quantity']: round(quantity, 3)}
+        if fields['cost']:
+            formatted[category][fields['cost']] = round(cost, 2)
+    return formatted
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if not args or args[0] != 'rebuild':
+        print("Usage: python rollups.py rebuild [--all-users | USER ...]")
+        sys.exit(1)
+    if '--all-users' in args:
+        users = [None] + history_store.list_users()
+    else:
+        users = args[1:] or [None]
+    for user in users:
+        rebuild(user)
+    print(json.dumps({user or '': {period: len(rows) for period, rows in summary(user=user).items()}
+                      for user in users}))
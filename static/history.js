@@ -0,0 +1,11 @@
+// Shared by the pages that chart history. History endpoints answer one bounded page,
+// so pages ask for the most recent entries instead of walking the whole history.
+const HISTORY_CHART_LIMIT = 1000;   // the server's largest page (HISTORY_MAX_PAGE_SIZE)
+
+// Latest `limit` entries of a history endpoint, returned oldest first
+async function fetchLatestHistory(url, limit = HISTORY_CHART_LIMIT) {
+    const resp = await fetch(`${url}?order=desc&limit=${limit}`);
+    if (!resp.ok) throw new Error(`HTTP ${resp.status}`);
+    const page = await resp.json();
+    return Array.isArray(page) ? page.reverse() : [];
+}
@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import logging
+import argparse
+import datetime
+
+import numpy as np
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Tariff applied when a bill names none
+DEFAULT_TARIFF = os.environ.get('ELECTRICITY_TARIFF', 'delhi')
+# Optional JSON file of extra or replacement tariffs: {"name": {"fixed": 20, "slabs": [[200, 3.0], [null, 8.0]]}}
+TARIFFS_FILE = os.environ.get('ELECTRICITY_TARIFFS_FILE', '')
+
+# Slabs are (units in the slab, rate per unit), charged in order; None means unlimited
+TARIFF_SPECS = {
+    'delhi': {'fixed': 20, 'slabs': [(200, 3.0), (200, 4.5), (400, 6.5), (400, 7.0), (None, 8.0)]},
+}
+
+
+class Tariff:
+    """
+    Slab tariff with the cumulative slab bounds and charges precomputed, so a
+    reading is priced with one searchsorted instead of walking the slabs.
+    """
+
+    def __init__(self, name, fixed, slabs):
+        if not slabs:
+            raise ValueError(f"Tariff {name} has no slabs")
+        sizes = []
+        for i, (size, rate) in enumerate(slabs):
+            if size is None and i != len(slabs) - 1:
+                raise ValueError(f"Tariff {name}: only the last slab can be unlimited")
+            if (size is not None and float(size) <= 0) or float(rate) < 0:
+                raise ValueError(f"Tariff {name}: slab sizes must be positive and rates non-negative")
+            sizes.append(np.inf if size is None else float(size))
+        self.name = name
+        self.fixed = float(fixed)
+        self.slabs = [(None if np.isinf(size) else size, float(rate)) for size, (_, rate) in zip(sizes, slabs)]
+        self.rates = np.array([rate for _, rate in slabs], dtype=np.float64)
+        sizes = np.array(sizes[:-1], dtype=np.float64)
+        # Slab k covers (lower[k], upper[k]]; readings beyond a bounded last slab continue at its rate
+        self.upper = np.append(np.cumsum(sizes), np.inf)
+        self.lower = np.concatenate(([0.0], self.upper[:-1]))
+        # Charge for all slabs below slab k
+        self.base = np.concatenate(([0.0], np.cumsum(sizes * self.rates[:-1])))
+
+    def charges(self, units):
+        """Unrounded charges for an array of unit readings (readings <= 0 pay the fixed charge)"""
+        units = np.maximum(np.asarray(units, dtype=np.float64), 0.0)
+        slab = np.searchsorted(self.upper, units, side='left')
+        return self.fixed + self.base[slab] + (units - self.lower[slab]) * self.rates[slab]
+
+    def price_many(self, units):
+        """Bill amounts for an array of unit readings, in whole cents"""
+        # Half a cent rounds up; the small offset absorbs float error on exact ties (e.g. 2695.525)
+        return np.floor(self.charges(units) * 100 + 0.5 + 1e-6) / 100
+
+    def price(self, units):
+        """Bill amount for one reading"""
+        return float(self.price_many(units))
+
+    def describe(self):
+        return {'name': self.name, 'fixed': self.fixed, 'slabs': [list(slab) for slab in self.slabs]}
+
+
+def _load_tariffs():
+    specs = dict(TARIFF_SPECS)
+    if TARIFFS_FILE:
+        try:
+            with open(TARIFFS_FILE, encoding='utf-8') as f:
+                specs.update(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load tariffs from {TARIFFS_FILE}: {e}")
+    tariffs = {}
+    for name, spec in specs.items():
+        try:
+            tariffs[name.lower()] = Tariff(name.lower(), spec.get('fixed', 0), spec['slabs'])
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error(f"Skipping tariff {name}: {e}")
+    return tariffs
+
+
+_tariffs = _load_tariffs()
+
+
+def get_tariff(name=None):
+    """
+    Return a configured tariff.
+    Args:
+        name (str): Tariff name (default ELECTRICITY_TARIFF)
+    Raises:
+        ValueError: If there is no such tariff
+    """
+    tariff = _tariffs.get((name or DEFAULT_TARIFF).lower())
+    if tariff is None:
+        raise ValueError(f"Unknown tariff: {name or DEFAULT_TARIFF}. Choose from: {', '.join(sorted(_tariffs))}")
+    return tariff
+
+
+def list_tariffs():
+    return {'default': DEFAULT_TARIFF, 'tariffs': [tariff.describe() for _, tariff in sorted(_tariffs.items())]}
+
+
+def price(units, name=None):
+    """Bill amount for one reading under the named tariff"""
+    return get_tariff(name).price(units)
+
+
+def _priced_by(amount, charge):
+    """Whether a stored bill amount is the charge rounded to cents either way on a half-cent tie"""
+    try:
+        return abs(float(amount) - charge) <= 0.005 + 1e-6
+    except (TypeError, ValueError):
+        return False
+
+
+def reprice(store, name=None, start=None, end=None, dry_run=False):
+    """
+    Recompute bill_amount across an electricity history, e.g. after a tariff change.
+    Entries are priced with the tariff they record, or the default tariff if they
+    record none; all matching entries are priced in one vectorized pass and the
+    history is rewritten atomically only if an amount changed. A stored amount
+    that is already a correct rounding of the tariff's charge is left alone, so
+    bills saved before half cents rounded up are not rewritten by a cent.
+    Args:
+        store (HistoryStore): Electricity history store
+        name (str): Only reprice entries on this tariff (default: all entries)
+        start (str): First bill date to include (YYYY-MM-DD)
+        end (str): Last bill date to include (YYYY-MM-DD)
+        dry_run (bool): Report what would change without rewriting anything
+    Returns:
+        dict: Counts of records scanned, repriced and changed, the total
+              difference in bill_amount, and whether history was rewritten
+    """
+    selected = get_tariff(name).name if name else None
+    for label, value in (('from', start), ('to', end)):
+        if value:
+            try:
+                datetime.date.fromisoformat(value[:10])
+            except ValueError:
+                raise ValueError(f"Invalid '{label}' value, expected an ISO date")
+    report = {'records': 0, 'repriced': 0, 'changed': 0, 'difference': 0.0, 'rewritten': False}
+
+    def plan(records):
+        """Per tariff: indices of the entries to price and their new amounts"""
+        entries = list(records)
+        groups = {}
+        for index, entry in enumerate(entries):
+            tariff_name = str(entry.get('tariff') or DEFAULT_TARIFF).lower()
+            day = str(entry.get('date') or '')[:10]
+            if selected and tariff_name != selected:
+                continue
+            if (start and day < start[:10]) or (end and day > end[:10]):
+                continue
+            try:
+                units = float(entry.get('units'))
+            except (TypeError, ValueError):
+                continue
+            groups.setdefault(tariff_name, ([], []))
+            groups[tariff_name][0].append(index)
+            groups[tariff_name][1].append(units)
+
+        changes = {}
+        for tariff_name, (indices, units) in groups.items():
+            try:
+                tariff = get_tariff(tariff_name)
+            except ValueError:
+                logger.warning(f"Not repricing {len(indices)} entries on unknown tariff {tariff_name}")
+                continue
+            charges = tariff.charges(units)
+            amounts = (np.floor(charges * 100 + 0.5 + 1e-6) / 100).tolist()
+            report['repriced'] += len(indices)
+            for index, charge, amount in zip(indices, charges.tolist(), amounts):
+                old = entries[index].get('bill_amount')
+                if _priced_by(old, charge):
+                    continue
+                if old != amount:
+                    changes[index] = amount
+                    try:
+                        report['difference'] += amount - float(old)
+                    except (TypeError, ValueError):
+                        report['difference'] += amount
+        report['records'] = len(entries)
+        report['changed'] = len(changes)
+        return entries, changes
+
+    def transform(records):
+        entries, changes = plan(records())
+        if not changes or dry_run:
+            return None
+        for index, amount in changes.items():
+            entries[index] = dict(entries[index], bill_amount=amount)
+        return entries
+
+    report['rewritten'] = store.rewrite(transform)
+    report['difference'] = round(report['difference'], 2)
+    logger.info(f"Repriced electricity history{f' on tariff {selected}' if selected else ''}: {report}")
+    return report
+
+
+if __name__ == '__main__':
+    import history_store
+    import rollups
+
+    parser = argparse.ArgumentParser(description="Re-price CarbonTracker electricity history after a tariff change")
+    parser.add_argument('--tariff', help="only entries on this tariff (default: all)")
+    parser.add_argument('--from', dest='start', help="first bill date (YYYY-MM-DD)")
+    parser.add_argument('--to', dest='end', help="last bill date (YYYY-MM-DD)")
+    parser.add_argument('--user', help="a user's partition instead of the shared history")
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+    try:
+        result = reprice(history_store.get_store('electricity', user=args.user),
+                         args.tariff, args.start, args.end, args.dry_run)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    if result['rewritten']:
+        rollups.rebuild(args.user)
+    print(json.dumps(result))
@@ -0,0 +1,34 @@
+import os
+import sys
+import uuid
+import tempfile
+
+import pytest
+
+# Every store must point at scratch space before the app modules read their settings
+_WORKDIR = tempfile.mkdtemp(prefix='carbontracker-tests-')
+for _name, _path in {
+    'HISTORY_DIR': 'history',
+    'HISTORY_DB': 'history.db',
+    'HISTORY_USERS_DIR': 'users',
+    'ROLLUPS_DB': 'rollups.db',
+    'OCR_JOBS_DB': 'jobs.db',
+    'METRICS_DIR': 'metrics',
+    'GRID_INTENSITY_DIR': 'grid_intensity',
+}.items():
+    os.environ[_name] = os.path.join(_WORKDIR, _path)
+os.environ['HISTORY_COMPACT_INTERVAL_HOURS'] = '0'
+os.makedirs(os.environ['HISTORY_DIR'], exist_ok=True)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def user():
+    """A fresh user partition, so each test starts with empty history"""
+    return f"test-{uuid.uuid4().hex[:12]}"
+
+
+@pytest.fixture
+def workdir():
+    return _WORKDIR
@@ -0,0 +1,23 @@
+import app as app_module
+import history_store
+
+
+def test_failed_request_discards_buffered_history(user, monkeypatch):
+    append = app_module._append_device_history
+
+    def append_then_fail(entries, user=None):
+        append(entries, user)
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(app_module, '_append_device_history', append_then_fail)
+    client = app_module.app.test_client()
+    response = client.post('/device/calculate', headers={'X-User-Id': user},
+                           json={'devices': [{'name': 'Laptop', 'wattage': 65, 'hours': 4}]})
+    assert response.status_code == 500
+    assert history_store.get_store('device', user=user).count() == 0
+
+    monkeypatch.setattr(app_module, '_append_device_history', append)
+    response = client.post('/device/calculate', headers={'X-User-Id': user},
+                           json={'devices': [{'name': 'Laptop', 'wattage': 65, 'hours': 4}]})
+    assert response.status_code == 200
+    assert history_store.get_store('device', user=user).count() == 2
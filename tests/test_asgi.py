@@ -0,0 +1,157 @@
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip('a2wsgi')
+
+import app as app_module
+import asgi
+import history_store
+import jobs
+import metrics
+
+
+async def _request(path, query=b'', headers=()):
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'root_path': '', 'query_string': query,
+             'headers': list(headers), 'http_version': '1.1', 'scheme': 'http',
+             'server': ('test', 80), 'client': ('127.0.0.1', 1)}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await asgi.app(scope, receive, send)
+    body = b''.join(message.get('body', b'') for message in messages[1:])
+    return messages[0]['status'], dict(messages[0]['headers']), body
+
+
+def _call(path, query=b'', headers=()):
+    status, _, body = asyncio.run(_request(path, query, headers))
+    return status, body
+
+
+def _trips(count):
+    return [{'transport_mode': 'bus', 'distance_km': float(i + 1), 'carbon_emissions_kg': 0.1,
+             'timestamp': f"2025-02-01T{i % 24:02d}:00:00Z"} for i in range(count)]
+
+
+@pytest.fixture
+def no_wsgi(monkeypatch):
+    """Fail any request that falls through to the Flask thread pools"""
+    async def refuse(scope, receive, send):
+        raise AssertionError(f"{scope['path']} went through WSGI")
+    monkeypatch.setattr(asgi, '_io_app', refuse)
+    monkeypatch.setattr(asgi, '_ocr_app', refuse)
+
+
+def test_repeated_cookie_headers_are_joined_with_semicolons():
+    scope = asgi._merge_cookies({'headers': [(b'cookie', b'a=1'), (b'accept', b'*/*'), (b'cookie', b'b=2')]})
+    assert (b'cookie', b'a=1; b=2') in scope['headers']
+
+
+def test_streamed_export_runs_on_the_request_thread(user, monkeypatch):
+    history_store.get_store('transport', user=user).append_many(
+        [{'transport_mode': 'bus', 'distance_km': 1.0, 'carbon_emissions_kg': 0.1,
+          'timestamp': f"2025-02-01T{i % 24:02d}:00:00Z"} for i in range(5000)])
+    export_chunks = app_module._export_chunks
+    threads = []
+
+    def recording_chunks(records, fmt):
+        threads.append(threading.current_thread().name)
+        for chunk in export_chunks(records, fmt):
+            threads.append(threading.current_thread().name)
+            yield chunk
+
+    monkeypatch.setattr(app_module, '_export_chunks', recording_chunks)
+    status, body = _call('/transport/history', b'export=ndjson', [(b'x-user-id', user.encode())])
+    assert status == 200
+    assert body.count(b'\n') == 5000
+    assert len(threads) > 2 and len(set(threads)) == 1
+
+
+def test_ocr_uploads_use_the_ocr_pool():
+    upload = {'type': 'http', 'method': 'POST', 'path': '/upload', 'query_string': b''}
+    assert asgi._pool_for('upload_receipt', upload) is asgi._ocr_app
+    assert asgi._pool_for('upload_receipt', dict(upload, query_string=b'async=1')) is asgi._io_app
+    assert asgi._pool_for('calculate_device_emissions', upload) is asgi._io_app
+
+
+def test_native_history_matches_flask(user, no_wsgi):
+    history_store.get_store('transport', user=user).append_many(_trips(20))
+    query = 'order=desc&limit=5'
+    expected = app_module.app.test_client().get(f'/transport/history?{query}',
+                                                 headers={'X-User-Id': user, 'Origin': 'http://a.test'})
+
+    status, headers, body = asyncio.run(_request(
+        '/transport/history', query.encode(), [(b'x-user-id', user.encode()), (b'origin', b'http://a.test')]))
+    assert status == 200
+    assert json.loads(body) == expected.get_json()
+    for name in ('ETag', 'X-Next-Cursor', 'Vary', 'Access-Control-Allow-Origin', 'Access-Control-Expose-Headers'):
+        assert headers[name.lower().encode()].decode() == expected.headers[name]
+
+    status, _, _ = asyncio.run(_request('/transport/history', query.encode(),
+                                        [(b'x-user-id', user.encode()), (b'if-none-match', headers[b'etag'])]))
+    assert status == 304
+
+
+def _observations(name, **labels):
+    histograms, _, _ = metrics.collect()
+    hist = histograms.get(metrics._key(name, labels))
+    return hist[2] if hist else 0
+
+
+def test_native_requests_record_their_stages(user, no_wsgi):
+    # The store read runs on an executor thread but still counts towards this request
+    def counts():
+        metrics.flush()
+        return (_observations('carbontracker_stage_seconds', stage='history_query', endpoint='device_history'),
+                _observations('carbontracker_request_seconds', endpoint='device_history', method='GET', status=200))
+
+    before = counts()
+    assert _call('/device/history', headers=[(b'x-user-id', user.encode())])[0] == 200
+    assert counts() == (before[0] + 1, before[1] + 1)
+
+
+def test_native_routes_validate_like_flask(user, no_wsgi):
+    assert _call('/device/history', headers=[(b'x-user-id', b'../etc')])[0] == 400
+    assert _call('/device/history', b'limit=0', [(b'x-user-id', user.encode())])[0] == 400
+    status, body = _call('/dashboard/summary', b'from=soon', [(b'x-user-id', user.encode())])
+    assert status == 400 and 'error' in json.loads(body)
+
+
+def test_long_polls_wait_on_the_loop_not_a_thread(monkeypatch, no_wsgi):
+    # One I/O thread: if each poll held a thread while waiting, 20 of them would take 20 x wait
+    monkeypatch.setattr(asgi, '_io_executor', ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(jobs, 'POLL_INTERVAL', 0.05)
+    monkeypatch.setattr(jobs, 'get_job', lambda job_id: {'job_id': job_id, 'status': 'running'})
+
+    async def poll_all():
+        return await asyncio.gather(*(_request(f'/jobs/{i}', b'wait=0.3') for i in range(20)))
+
+    start = time.perf_counter()
+    responses = asyncio.run(poll_all())
+    assert time.perf_counter() - start < 3
+    assert [status for status, _, _ in responses] == [200] * 20
+    assert json.loads(responses[0][2])['status'] == 'running'
+
+
+def test_websocket_and_unknown_scopes_are_rejected():
+    sent = []
+
+    async def receive():
+        return {'type': 'websocket.connect'}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi.app({'type': 'websocket', 'path': '/transport/history'}, receive, send))
+    assert [message['type'] for message in sent] == ['websocket.close']
+    with pytest.raises(ValueError):
+        asyncio.run(asgi.app({'type': 'telepathy'}, receive, send))
@@ -0,0 +1,72 @@
+import os
+import datetime
+
+import compaction
+import history_store
+import rollups
+
+NOW = datetime.datetime(2025, 6, 1, tzinfo=datetime.timezone.utc)
+
+
+def _device_request(day, cost):
+    timestamp = f"{day}T10:00:00Z"
+    return [
+        {"timestamp": timestamp, "device": "Laptop", "emissions_kg": 0.1, "energy_kwh": 0.2, "wattage": 65.0, "hours": 3.0},
+        {"timestamp": timestamp, "device": "TV", "emissions_kg": 0.2, "energy_kwh": 0.4, "wattage": 120.0, "hours": 3.0},
+        {"timestamp": timestamp, "device": "All Devices", "emissions_kg": 0.3, "energy_kwh": 0.6, "daily_cost": cost},
+    ]
+
+
+def test_compaction_keeps_all_devices_totals_and_cost(user):
+    store = history_store.get_store('device', user=user)
+    store.append_many(_device_request('2025-01-10', 6.0) + _device_request('2025-01-10', 4.5))
+
+    report = compaction.compact(['device'], older_than_days=30, retention_days=0, now=NOW, users=[user])
+    assert report['users'][user]['device']['rewritten']
+
+    records = {record['device']: record for record in store.iter_records()}
+    assert set(records) == {'Laptop', 'TV', 'All Devices'}
+    totals = records['All Devices']
+    assert totals['daily_cost'] == 10.5
+    assert totals['entries'] == 2
+    assert totals['energy_kwh'] == 1.2
+    assert records['Laptop']['wattage'] == 65.0
+    assert records['Laptop']['hours'] == 6.0
+    assert 'daily_cost' not in records['Laptop']
+
+
+def test_compaction_is_idempotent(user):
+    store = history_store.get_store('device', user=user)
+    store.append_many(_device_request('2025-01-10', 6.0))
+    compaction.compact(['device'], older_than_days=30, retention_days=0, now=NOW, users=[user])
+    before = list(store.iter_records())
+
+    report = compaction.compact(['device'], older_than_days=30, retention_days=0, now=NOW, users=[user])
+    assert not report['users'][user]['device']['rewritten']
+    assert list(store.iter_records()) == before
+
+
+def test_retention_removes_expired_days_from_rollups(user):
+    rollups.install()
+    store = history_store.get_store('device', user=user)
+    store.append_many(_device_request('2024-01-10', 6.0) + _device_request('2025-05-20', 4.0))
+    days = [bucket['period'] for bucket in rollups.summary(user=user)['daily']]
+    assert days == ['2024-01-10', '2025-05-20']
+
+    compaction.compact(['device'], older_than_days=30, retention_days=365, now=NOW, users=[user])
+    days = [bucket['period'] for bucket in rollups.summary(user=user)['daily']]
+    assert days == ['2025-05-20']
+
+
+def test_only_one_process_leads_the_scheduler(monkeypatch, workdir):
+    monkeypatch.setattr(compaction, 'SCHEDULER_LOCK_PATH', os.path.join(workdir, 'leader.lock'))
+    leader = compaction._try_lead()
+    assert leader is not None
+    try:
+        # A second worker (another open of the lock file) stays a follower
+        assert compaction._try_lead() is None
+    finally:
+        os.close(leader)
+    follower = compaction._try_lead()
+    assert follower is not None
+    os.close(follower)
@@ -0,0 +1,23 @@
+import pytest
+
+import device
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("Gaming PC", "desktop"),
+    ("Dell Workstation", "desktop"),
+    ("Nintendo Switch", "gaming_console"),
+    ("Switchboard light", "other"),
+    ("Network switch", "other"),
+    ("Headphone amp", "other"),
+    ("iPhone 15", "smartphone"),
+    ("Smartphone charger", "smartphone"),
+    ("Bananas dehydrator", "other"),
+    ("Synology NAS", "external_hdd"),
+    ("Two monitors", "monitor"),
+    ("Tower fan", "other"),
+    ("gaming_console", "gaming_console"),
+    ("external_hdd", "external_hdd"),
+])
+def test_classify_device_matches_whole_words(name, expected):
+    assert device.classify_device(name) == expected
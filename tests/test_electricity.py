@@ -0,0 +1,32 @@
+import pytest
+
+import electricity
+import grid_intensity
+from app import app
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def test_save_manual_rejects_invalid_date_without_grid_series(client, user):
+    assert grid_intensity.get_series('nowhere') is None
+    response = client.post('/electricity/save_manual', headers={'X-User-Id': user},
+                           json={'units': 120, 'date': 'notadate', 'region': 'nowhere'})
+    assert response.status_code == 400
+    assert client.get('/electricity/history', headers={'X-User-Id': user}).get_json() == []
+
+
+def test_save_manual_stores_bill_day(client, user):
+    response = client.post('/electricity/save_manual', headers={'X-User-Id': user},
+                           json={'units': 250, 'date': '2025-03-31T18:30:00Z', 'region': 'nowhere'})
+    assert response.status_code == 200
+    assert response.get_json()['co2_emissions'] == round(250 * electricity.FALLBACK_INTENSITY, 2)
+    history = client.get('/electricity/history', headers={'X-User-Id': user}).get_json()
+    assert [entry['date'] for entry in history] == ['2025-03-31']
+
+
+def test_bill_intensity_rejects_invalid_date_without_grid_series():
+    with pytest.raises(ValueError):
+        electricity.bill_intensity('notadate', 'nowhere')
@@ -0,0 +1,50 @@
+import random
+
+from emission_matcher import FactorTable, FactorMatcher, get_matcher
+
+
+def _reference(keys, text):
+    """Longest key contained in text; ties go to the earlier key"""
+    found = [(len(key), -order, key) for order, key in enumerate(keys) if key in text]
+    return max(found)[2] if found else None
+
+
+def test_longest_key_wins():
+    table = FactorTable({'milk': 1.0, 'chocolate': 2.0, 'chocolate milk': 3.0})
+    assert get_matcher(table).longest_match('dark chocolate milk bar') == 'chocolate milk'
+    assert get_matcher(table).longest_match('milk chocolate') == 'chocolate'
+    assert get_matcher(table).longest_match('bread') is None
+
+
+def test_longer_key_found_through_a_failed_prefix():
+    # 'ushers' walks u-s-h-e before falling back, and 'hers' is only reachable via fail links
+    assert FactorMatcher(['he', 'she', 'hers']).longest_match('ushers') == 'hers'
+
+
+def test_ties_keep_table_order():
+    assert get_matcher(FactorTable({'rice': 1.0, 'bean': 2.0})).longest_match('rice and bean') == 'rice'
+    assert get_matcher(FactorTable({'bean': 2.0, 'rice': 1.0})).longest_match('rice and bean') == 'bean'
+
+
+def test_matches_a_brute_force_scan():
+    rng = random.Random(7)
+    keys = list(dict.fromkeys(''.join(rng.choice('abc') for _ in range(rng.randint(1, 4))) for _ in range(30)))
+    matcher = FactorMatcher(keys)
+    for _ in range(500):
+        text = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 12)))
+        assert matcher.longest_match(text) == _reference(keys, text), text
+
+
+def test_matcher_is_rebuilt_only_when_the_table_changes():
+    table = FactorTable({'rice': 1.0})
+    matcher = get_matcher(table)
+    assert get_matcher(table) is matcher
+
+    table['brown rice'] = 2.0
+    assert get_matcher(table) is not matcher
+    assert get_matcher(table).longest_match('organic brown rice') == 'brown rice'
+
+    plain = {'rice': 1.0}
+    get_matcher(plain)
+    plain['brown rice'] = 2.0
+    assert get_matcher(plain).longest_match('organic brown rice') == 'brown rice'
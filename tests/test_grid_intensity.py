@@ -0,0 +1,66 @@
+import os
+import uuid
+
+import numpy as np
+import pytest
+
+import grid_intensity
+
+HOUR = 3600
+START = grid_intensity.to_epoch('2025-01-01T00:00:00Z')
+
+
+@pytest.fixture
+def series():
+    # 100, 200, 300, 400 g/kWh for the hours starting 00:00 to 03:00; the grid ends at 04:00
+    return grid_intensity._Series('test', START + np.arange(4) * HOUR, np.array([100.0, 200.0, 300.0, 400.0]))
+
+
+def _mean(series, start_hour, end_hour):
+    return float(series.mean(START + start_hour * HOUR, START + end_hour * HOUR))
+
+
+def test_window_means_inside_the_series(series):
+    assert _mean(series, 0, 2) == pytest.approx(150)
+    assert _mean(series, 0.5, 1.5) == pytest.approx(150)
+    assert _mean(series, 0, 4) == pytest.approx(250)
+    # A zero-width window is the value of the hour it falls in
+    assert _mean(series, 1.5, 1.5) == pytest.approx(200)
+
+
+def test_windows_past_the_edges_carry_the_edge_hours_on(series):
+    assert _mean(series, 3, 5) == pytest.approx(400)
+    assert _mean(series, 2, 6) == pytest.approx((300 + 400 * 3) / 4)
+    assert _mean(series, -1, 1) == pytest.approx(100)
+    assert _mean(series, -2, 2) == pytest.approx((100 * 3 + 200) / 4)
+    assert _mean(series, -10, 14) == pytest.approx((100 * 10 + 1000 + 400 * 10) / 24)
+
+
+def test_windows_entirely_outside_the_series(series):
+    assert _mean(series, 10, 12) == pytest.approx(400)
+    assert _mean(series, -12, -10) == pytest.approx(100)
+    assert _mean(series, 4, 4) == pytest.approx(400)
+
+
+def test_means_agree_with_hourly_lookups(series):
+    rng = np.random.default_rng(3)
+    starts = rng.integers(-6, 10, 200)
+    ends = starts + rng.integers(1, 8, 200)
+    means = series.mean(START + starts * HOUR, START + ends * HOUR)
+    for start, end, mean in zip(starts, ends, means):
+        hourly = series.at(START + np.arange(start, end) * HOUR)
+        assert mean == pytest.approx(hourly.mean())
+
+
+def test_mean_intensity_reads_region_files(workdir, monkeypatch):
+    directory = os.path.join(workdir, f'grid-{uuid.uuid4().hex[:8]}')
+    os.makedirs(directory)
+    with open(os.path.join(directory, 'north.csv'), 'w') as f:
+        f.write("timestamp,intensity\n2025-01-01T00:00:00Z,100\n2025-01-01T01:00:00Z,200\n")
+    monkeypatch.setattr(grid_intensity, '_series', None)
+    assert grid_intensity.reload(directory) == ['north']
+
+    mean = grid_intensity.mean_intensity('NORTH', '2025-01-01T00:00:00Z', '2025-01-01T04:00:00Z')
+    assert mean == pytest.approx((100 + 200 * 3) / 4)
+    assert grid_intensity.mean_intensity('south', '2025-01-01', '2025-01-02', default=233.0) == 233.0
+    assert np.isnan(grid_intensity.mean_intensity('south', '2025-01-01', '2025-01-02'))
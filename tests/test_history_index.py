@@ -0,0 +1,51 @@
+import os
+import json
+
+import history_writer
+from history_index import MmapHistoryIndex
+
+
+def _write(path, days):
+    with open(path, 'w') as f:
+        for day in days:
+            f.write(json.dumps({"date": day, "units": int(day[-2:])}) + '\n')
+
+
+def test_query_reindexes_a_file_replaced_after_refresh(workdir):
+    path = os.path.join(workdir, 'replaced.jsonl')
+    _write(path, [f"2025-01-{d:02d}" for d in range(1, 11)])
+    index = MmapHistoryIndex(path, 'date')
+    index.refresh()
+
+    # Compaction swaps in a shorter file right after the first refresh of the query
+    refresh = index.refresh
+    state = {'swapped': False}
+
+    def refresh_then_replace():
+        refresh()
+        if not state['swapped']:
+            state['swapped'] = True
+            tmp = path + '.tmp'
+            _write(tmp, ["2025-02-01", "2025-02-02"])
+            os.replace(tmp, path)
+
+    index.refresh = refresh_then_replace
+    rows, more = index.query()
+    assert [record['date'] for _, _, record in rows] == ["2025-02-01", "2025-02-02"]
+    assert not more
+
+
+def test_index_rebuilds_after_rewrite_with_same_inode_and_size(workdir):
+    path = os.path.join(workdir, 'same-inode.jsonl')
+    _write(path, ["2025-01-01", "2025-01-02"])
+    index = MmapHistoryIndex(path, 'date')
+    assert [r['date'] for _, _, r in index.query()[0]] == ["2025-01-01", "2025-01-02"]
+
+    st = os.stat(path)
+    with history_writer.file_lock(path):
+        with open(path, 'r+b') as f:
+            f.write(json.dumps({"date": "2025-01-09", "units": 1}).encode() + b'\n')
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        history_writer.bump_generation(path)
+
+    assert [r['date'] for _, _, r in index.query()[0]] == ["2025-01-02", "2025-01-09"]
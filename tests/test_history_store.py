@@ -0,0 +1,87 @@
+import os
+
+import history_store
+import history_writer
+
+
+def _trips(count, day='2025-02-01'):
+    return [{"transport_mode": "bus", "distance_km": float(i + 1), "carbon_emissions_kg": 0.1,
+             "timestamp": f"{day}T{i % 24:02d}:00:00Z"} for i in range(count)]
+
+
+def test_range_iteration_streams_from_file_not_cache(user):
+    store = history_store.get_store('transport', 'jsonl', user=user)
+    store.append_many(_trips(50))
+
+    exported = list(store.iter_range('2025-02-01', '2025-02-01'))
+    assert len(exported) == 50
+    # Export never parses the whole history into the per-worker cache
+    assert store._records == []
+
+    # Paged reads use the cache; later appends still reach the export stream
+    page, _ = store.query(limit=10)
+    assert len(page) == 10 and len(store._records) == 50
+    store.append_many(_trips(5, day='2025-02-02'))
+    assert len(list(store.iter_range('2025-02-02'))) == 5
+
+
+def test_forced_migration_twice_does_not_duplicate():
+    source = history_store.get_store('electricity', 'jsonl')
+    target = history_store.get_store('electricity', 'sqlite')
+    source.append_many([{"date": f"2025-01-{day:02d}", "units": 100.0 + day, "bill_amount": 320.0,
+                         "co2_emissions": 82.0} for day in range(1, 21)])
+
+    assert history_store.migrate(['electricity']) == {'electricity': 20}
+    assert history_store.migrate(['electricity']) == {'electricity': 0}
+    assert history_store.migrate(['electricity'], force=True) == {'electricity': 20}
+    assert history_store.migrate(['electricity'], force=True) == {'electricity': 20}
+    assert target.count() == 20
+    assert [r['units'] for r in target.load()] == [r['units'] for r in source.load()]
+
+
+def test_history_endpoint_pages_by_default(user, monkeypatch):
+    from app import app
+    monkeypatch.setattr(history_store, 'DEFAULT_PAGE_SIZE', 20)
+    history_store.get_store('transport', user=user).append_many(_trips(30))
+    client = app.test_client()
+
+    first = client.get('/transport/history', headers={'X-User-Id': user})
+    assert len(first.get_json()) == 20
+    cursor = first.headers['X-Next-Cursor']
+    rest = client.get(f'/transport/history?cursor={cursor}', headers={'X-User-Id': user})
+    assert len(rest.get_json()) == 10
+    assert 'X-Next-Cursor' not in rest.headers
+
+
+
+def test_cache_sees_rewrite_that_reuses_inode_size_and_mtime(user):
+    store = history_store.get_store('transport', 'jsonl', user=user)
+    store.append_many(_trips(3))
+    assert [r['distance_km'] for r in store.load()] == [1.0, 2.0, 3.0]
+    tag = store.version_tag()
+
+    # A rewrite whose file lands on the same inode with the same size and mtime
+    st = os.stat(store.path)
+    with open(store.path, 'rb') as f:
+        data = f.read()
+    with history_writer.file_lock(store.path):
+        with open(store.path, 'r+b') as f:
+            f.write(data.replace(b'"distance_km": 1.0', b'"distance_km": 7.0'))
+        os.utime(store.path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        history_writer.bump_generation(store.path)
+
+    assert [r['distance_km'] for r in store.load()] == [7.0, 2.0, 3.0]
+    assert store.version_tag() != tag
+
+
+def test_history_endpoint_returns_latest_page_in_descending_order(user):
+    from app import app
+    history_store.get_store('transport', user=user).append_many(_trips(20))
+    client = app.test_client()
+
+    latest = client.get('/transport/history?order=desc&limit=5', headers={'X-User-Id': user})
+    distances = [r['distance_km'] for r in latest.get_json()]
+    assert distances == [20, 19, 18, 17, 16]
+
+    bad = client.get('/transport/history?order=sideways', headers={'X-User-Id': user})
+    assert bad.status_code == 400
@@ -0,0 +1,107 @@
+import os
+import gzip
+import uuid
+
+import pytest
+
+import history_store
+import ingest
+import tariff
+
+
+def _csv(workdir, text, suffix='.csv'):
+    path = os.path.join(workdir, f'ingest-{uuid.uuid4().hex[:12]}{suffix}')
+    data = text.encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(gzip.compress(data) if suffix.endswith('.gz') else data)
+    return path
+
+
+TRIPS = """transport_mode,distance,timestamp
+bus,10,2025-02-01T08:00:00Z
+hovercraft,5,2025-02-01T09:00:00Z
+train,-3,2025-02-01T10:00:00Z
+car_petrol,far,2025-02-01T11:00:00Z
+plane,100,yesterday-ish
+train
+Train , 20 ,2025-02-02
+"""
+
+
+def test_invalid_transport_rows_are_skipped_and_reported(workdir, user):
+    report = ingest.ingest('transport', _csv(workdir, TRIPS), user=user)
+
+    assert (report['rows'], report['written'], report['invalid']) == (7, 2, 5)
+    # Data rows are numbered from 1, after the header
+    assert report['invalid_rows'] == [2, 3, 4, 5, 6]
+    rows, _ = history_store.get_store('transport', user=user).query()
+    assert rows == [
+        {'transport_mode': 'bus', 'distance_km': 10.0, 'carbon_emissions_kg': 0.82,
+         'timestamp': '2025-02-01T08:00:00Z'},
+        {'transport_mode': 'train', 'distance_km': 20.0, 'carbon_emissions_kg': 0.82,
+         'timestamp': '2025-02-02T00:00:00Z'},
+    ]
+
+
+def test_rejected_row_numbers_span_chunks_and_are_capped(workdir, user, monkeypatch):
+    monkeypatch.setattr(ingest, 'MAX_REPORTED_ERRORS', 3)
+    lines = ['transport_mode,distance'] + [f"bus,{'x' if i % 2 else 1}" for i in range(10)]
+    chunks = []
+    report = ingest.ingest('transport', _csv(workdir, '\n'.join(lines) + '\n'), user=user, chunk_size=3,
+                           progress=lambda r: chunks.append(r['rows']))
+
+    assert report['invalid'] == 5 and report['written'] == 5
+    assert report['invalid_rows'] == [2, 4, 6]
+    assert chunks == [3, 6, 9, 10] and report['chunks'] == 4
+
+
+def test_dry_run_validates_without_writing(workdir, user):
+    report = ingest.ingest('transport', _csv(workdir, TRIPS, '.csv.gz'), user=user, dry_run=True)
+    assert (report['rows'], report['written'], report['invalid']) == (7, 0, 5)
+    assert history_store.get_store('transport', user=user).count() == 0
+
+
+def test_device_rows_need_positive_usage_and_parseable_times(workdir, user):
+    text = ("device,wattage,hours,start\n"
+            "Laptop,60,2,2025-03-01T08:00:00Z\n"
+            "Fridge,0,24,\n"
+            "Heater,2000,,\n"
+            "Router,10,24,next tuesday\n"
+            ",100,1,\n")
+    report = ingest.ingest('device', _csv(workdir, text), user=user, options={'carbon_intensity': 500})
+
+    assert report['invalid_rows'] == [2, 3, 4]
+    rows, _ = history_store.get_store('device', user=user).query()
+    laptop = next(row for row in rows if row['device'] == 'Laptop')
+    assert laptop['energy_kwh'] == 0.12 and laptop['emissions_kg'] == 0.06
+    assert laptop['timestamp'] == '2025-03-01T08:00:00Z'
+    assert {row['device'] for row in rows} == {'Laptop', 'Unknown Device'}
+
+
+def test_electricity_rows_with_unknown_tariffs_or_bad_dates_are_skipped(workdir, user):
+    text = ("date,units,tariff\n"
+            "2025-01-31,250,\n"
+            "2025-02-28,300,nowhere\n"
+            "not a date,100,\n"
+            "2025-03-31,-5,\n")
+    report = ingest.ingest('electricity', _csv(workdir, text), user=user)
+
+    assert report['invalid_rows'] == [2, 3, 4]
+    rows, _ = history_store.get_store('electricity', user=user).query()
+    assert len(rows) == 1
+    assert rows[0]['date'] == '2025-01-31' and rows[0]['tariff'] == tariff.DEFAULT_TARIFF
+    assert rows[0]['bill_amount'] == tariff.get_tariff(None).price(250)
+
+
+def test_bad_files_and_arguments_fail_before_writing(workdir, user):
+    with pytest.raises(ValueError, match='missing required columns distance'):
+        ingest.ingest('transport', _csv(workdir, "transport_mode\nbus\n"), user=user)
+    with pytest.raises(ValueError, match='Unknown history store'):
+        ingest.ingest('fuel', _csv(workdir, TRIPS), user=user)
+    with pytest.raises(ValueError, match='expected a .csv'):
+        ingest.ingest('transport', _csv(workdir, TRIPS, '.txt'), user=user)
+    with pytest.raises(ValueError):
+        ingest.ingest('electricity', _csv(workdir, "date,units\n"), user=user, options={'tariff': 'nowhere'})
+    with pytest.raises(ValueError):
+        ingest.ingest('transport', _csv(workdir, TRIPS), user='../etc')
+    assert history_store.get_store('transport', user=user).count() == 0
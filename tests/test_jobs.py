@@ -0,0 +1,98 @@
+import io
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import jobs
+
+
+@pytest.fixture
+def runner(monkeypatch):
+    """Run jobs on a thread with a stub receipt runner instead of the OCR process pool"""
+    release = threading.Event()
+    calls = []
+
+    def run_receipt(image_bytes, params):
+        calls.append((image_bytes, params))
+        release.wait(5)
+        if image_bytes == b'bad':
+            raise RuntimeError("No items detected in receipt")
+        return {'items': len(image_bytes)}
+
+    monkeypatch.setattr(jobs, '_executor', ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setitem(jobs._RUNNERS, 'receipt', run_receipt)
+    run_receipt.release = release
+    run_receipt.calls = calls
+    return run_receipt
+
+
+def _wait_until(job_id, status):
+    deadline = time.monotonic() + 5
+    while jobs.get_job(job_id)['status'] != status:
+        assert time.monotonic() < deadline, f"job never reached {status}"
+        time.sleep(0.01)
+
+
+def test_job_moves_from_queued_to_done(runner):
+    results = []
+    job_id = jobs.submit('receipt', b'four', on_result=results.append, shopping_list=['rice'])
+    assert jobs.get_job(job_id)['status'] in ('queued', 'running')
+    _wait_until(job_id, 'running')
+
+    runner.release.set()
+    _wait_until(job_id, 'done')
+    job = jobs.get_job(job_id)
+    assert job['result'] == {'items': 4} and job['error'] is None
+    assert results == [{'items': 4}]
+    assert runner.calls == [(b'four', {'shopping_list': ['rice']})]
+
+
+def test_failed_job_keeps_the_error(runner):
+    runner.release.set()
+    job_id = jobs.submit('receipt', b'bad')
+    _wait_until(job_id, 'failed')
+    job = jobs.get_job(job_id)
+    assert job['error'] == "No items detected in receipt" and job['result'] is None
+
+
+def test_unknown_jobs_and_kinds():
+    assert jobs.get_job('missing') is None
+    assert jobs.wait_for_job('missing', 5) is None
+    with pytest.raises(ValueError):
+        jobs.submit('invoice', b'')
+
+
+def test_long_poll_returns_when_the_job_finishes(runner):
+    job_id = jobs.submit('receipt', b'four')
+    threading.Timer(0.2, runner.release.set).start()
+    start = time.monotonic()
+    assert jobs.wait_for_job(job_id, 5, interval=0.02)['status'] == 'done'
+    assert time.monotonic() - start < 2
+
+
+def test_long_poll_gives_up_at_its_timeout(runner):
+    job_id = jobs.submit('receipt', b'four')
+    start = time.monotonic()
+    job = jobs.wait_for_job(job_id, 0.2, interval=0.05)
+    elapsed = time.monotonic() - start
+    runner.release.set()
+    assert job['status'] in ('queued', 'running')
+    assert 0.2 <= elapsed < 1
+    assert jobs.wait_seconds(600) == jobs.MAX_WAIT_SECONDS and jobs.wait_seconds(-1) == 0
+
+
+def test_async_upload_returns_a_pollable_job(runner):
+    from app import app
+    client = app.test_client()
+    runner.release.set()
+    response = client.post('/upload?async=1', data={'image': (io.BytesIO(b'receipt'), 'r.png')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 202
+    accepted = response.get_json()
+    assert accepted['status'] == 'queued' and accepted['status_url'] == f"/jobs/{accepted['job_id']}"
+
+    polled = client.get(f"{accepted['status_url']}?wait=5").get_json()
+    assert polled['status'] == 'done' and polled['result'] == {'items': 7}
+    assert client.get('/jobs/missing').status_code == 404
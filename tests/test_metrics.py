@@ -0,0 +1,51 @@
+import os
+import json
+import subprocess
+import sys
+
+import metrics
+
+
+def _dead_pid():
+    child = subprocess.Popen([sys.executable, '-c', 'pass'])
+    child.wait()
+    return child.pid
+
+
+def _snapshot(pid, value):
+    return {'pid': pid, 'histograms': [], 'counters': [['carbontracker_ocr_cache_total', {'kind': 'test'}, value]],
+            'slow': []}
+
+
+def _ocr_count():
+    _, counters, _ = metrics.collect()
+    return counters.get(metrics._key('carbontracker_ocr_cache_total', {'kind': 'test'}), 0)
+
+
+def test_exited_worker_snapshots_are_folded_in_once():
+    os.makedirs(metrics.METRICS_DIR, exist_ok=True)
+    before = _ocr_count()
+    pid = _dead_pid()
+    with open(metrics._snapshot_path(pid), 'w') as f:
+        json.dump(_snapshot(pid, 5), f)
+
+    assert _ocr_count() == before + 5
+    assert not os.path.exists(metrics._snapshot_path(pid))
+    # Retiring again, or a later collect, does not count the dead worker twice
+    metrics.mark_process_dead(pid)
+    assert _ocr_count() == before + 5
+
+
+def test_reused_pid_does_not_inherit_a_stale_snapshot(monkeypatch):
+    own = os.getpid()
+    metrics.flush()
+    before = _ocr_count()
+    stale = _snapshot(own, 7)
+    with open(metrics._snapshot_path(own), 'w') as f:
+        json.dump(stale, f)
+    # Pretend this process has not written its snapshot yet, as after a PID reuse
+    monkeypatch.setattr(metrics, '_owned_pid', None)
+    metrics.inc('carbontracker_ocr_cache_total', kind='test')
+
+    assert _ocr_count() == before + 7 + 1
+    assert _ocr_count() == before + 7 + 1
@@ -0,0 +1,142 @@
+import io
+import json
+import tarfile
+import zipfile
+
+import numpy as np
+import pytest
+
+import app as app_module
+import ocr
+import ocr_cache
+import ocr_readers
+import preprocess
+
+
+class FakeReader:
+    """Reads 'milk <n>' where n is the image's marker pixel; fails on images whose first pixel is 0"""
+
+    def __init__(self):
+        self.batches = []
+
+    def _read(self, img):
+        if img[0, 0] == 0:
+            raise RuntimeError("unreadable image")
+        return [f"milk {img[1, 1]}"]
+
+    def readtext(self, img, detail=0):
+        return self._read(img)
+
+    def readtext_batched(self, images, detail=0, batch_size=1):
+        self.batches.append([img.shape for img in images])
+        return [self._read(img) for img in images]
+
+
+@pytest.fixture
+def reader(monkeypatch):
+    fake = FakeReader()
+    monkeypatch.setattr(preprocess, 'PREPROCESS_ENABLED', False)
+    ocr_readers.set_reader_factory(lambda: fake)
+    ocr_cache.clear()
+    yield fake
+    ocr_readers.set_reader_factory(None)
+
+
+def _image(height, width, marker=1, first=255):
+    img = np.full((height, width), 255, dtype=np.uint8)
+    img[0, 0] = first
+    img[1, 1] = marker
+    return img
+
+
+def test_images_are_batched_with_others_of_similar_size(reader):
+    images = [_image(100, 80, 1), _image(3000, 4000, 2), _image(110, 90, 3), _image(105, 80, 4)]
+    texts = ocr.extract_text_batch(images, batch_size=8)
+
+    assert texts == ["milk 1", "milk 2", "milk 3", "milk 4"]
+    # The large photo gets its own batch instead of padding the small receipts to 12 MP
+    assert sorted(len(batch) for batch in reader.batches) == [1, 3]
+    small = next(batch for batch in reader.batches if len(batch) == 3)
+    assert all(shape == (110, 90) for shape in small)
+
+
+def test_a_failing_image_only_loses_its_own_result(reader):
+    images = [_image(100, 80, 1), _image(100, 80, 2, first=0), _image(100, 80, 3)]
+    assert ocr.extract_text_batch(images, batch_size=8) == ["milk 1", "", "milk 3"]
+
+
+def test_buckets_respect_batch_size():
+    prepared = [(i, _image(100, 100)) for i in range(5)]
+    assert [len(bucket) for bucket in ocr._size_buckets(prepared, 2)] == [2, 2, 1]
+
+
+def _png(marker, first=255):
+    import cv2
+    return cv2.imencode('.png', _image(100, 80, marker, first))[1].tobytes()
+
+
+def _zip(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('scans/', '')
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def _tar_gz(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def _post_batch(data, **form):
+    from app import app
+    return app.test_client().post('/upload/batch', data=dict(form, **data), content_type='multipart/form-data')
+
+
+def _lines(response):
+    return {entry['name']: entry for entry in map(json.loads, response.get_data(as_text=True).splitlines())}
+
+
+def test_batch_upload_expands_zip_and_tar_archives(reader):
+    response = _post_batch({
+        'archive': [(io.BytesIO(_zip({'scans/a.png': _png(1), 'notes.txt': b'not an image'})), 'week.zip'),
+                    (io.BytesIO(_tar_gz({'b.PNG': _png(2), 'c.jpg.bak': b'x'})), 'month.tar.gz')],
+        'images': [(io.BytesIO(_png(3)), 'c.png')],
+    })
+    assert response.status_code == 200
+    entries = _lines(response)
+    assert set(entries) == {'scans/a.png', 'b.PNG', 'c.png'}
+    assert all('results' in entry for entry in entries.values())
+
+
+def test_batch_upload_rejects_bad_archives_and_oversized_batches(reader, monkeypatch):
+    assert _post_batch({'archive': [(io.BytesIO(b'not a zip'), 'broken.zip')]}).status_code == 400
+    assert _post_batch({'archive': [(io.BytesIO(_zip({'notes.txt': b'x'})), 'empty.zip')]}).status_code == 400
+    monkeypatch.setattr(app_module, 'MAX_BATCH_IMAGES', 2)
+    archive = _zip({f'{i}.png': _png(i) for i in range(3)})
+    assert _post_batch({'archive': [(io.BytesIO(archive), 'many.zip')]}).status_code == 400
+
+
+def test_failure_partway_through_a_batch_keeps_the_other_results(reader, monkeypatch):
+    extract = ocr.extract_text_batch
+
+    def fail_second_chunk(images, batch_size=None):
+        if any(image == _png(3) for image in images):
+            raise RuntimeError("worker crashed")
+        return extract(images, batch_size)
+
+    monkeypatch.setattr(ocr, 'extract_text_batch', fail_second_chunk)
+    files = {f'{i}.png': _png(i, first=0 if i == 1 else 255) for i in range(1, 6)}
+    response = _post_batch({'archive': [(io.BytesIO(_zip(files)), 'receipts.zip')]}, batch_size='2')
+    entries = _lines(response)
+
+    assert set(entries) == set(files)
+    # 1.png is unreadable, 3.png and 4.png share the chunk whose worker crashed
+    assert {name for name, entry in entries.items() if 'error' in entry} == {'1.png', '3.png', '4.png'}
+    assert all('results' in entries[name] for name in ('2.png', '5.png'))
@@ -0,0 +1,112 @@
+import os
+import uuid
+import sqlite3
+import threading
+
+import numpy as np
+import pytest
+
+import ocr_cache
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """Empty in-memory tier with room for three entries and no disk tier"""
+    monkeypatch.setattr(ocr_cache, 'CACHE_SIZE', 3)
+    monkeypatch.setattr(ocr_cache, 'CACHE_DB_PATH', '')
+    monkeypatch.setattr(ocr_cache, '_local', threading.local())
+    ocr_cache.clear()
+    yield ocr_cache
+    ocr_cache.clear()
+
+
+@pytest.fixture
+def disk(cache, workdir, monkeypatch):
+    path = os.path.join(workdir, f'ocr-cache-{uuid.uuid4().hex[:12]}.db')
+    monkeypatch.setattr(ocr_cache, 'CACHE_DB_PATH', path)
+    return path
+
+
+def _receipt(lines, noise=0, seed=0):
+    import cv2
+    img = np.full((400, 300), 255, dtype=np.uint8)
+    for i, line in enumerate(lines):
+        cv2.putText(img, line, (20, 40 + 40 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.8, 0, 2)
+    if noise:
+        rng = np.random.default_rng(seed)
+        img = np.clip(img.astype(int) + rng.integers(-noise, noise + 1, img.shape), 0, 255).astype(np.uint8)
+    return img
+
+
+def test_memory_tier_evicts_the_least_recently_used(cache):
+    keys = [cache.content_key(data) for data in (b'a', b'b', b'c', b'd')]
+    for key, text in zip(keys[:3], 'abc'):
+        cache.put('receipt', key, text)
+    assert cache.get('receipt', keys[0]) == 'a'
+    cache.put('receipt', keys[3], 'd')
+
+    assert cache.get('receipt', keys[1]) is None
+    assert [cache.get('receipt', key) for key in (keys[0], keys[2], keys[3])] == ['a', 'c', 'd']
+    # Kinds never share entries
+    assert cache.get('electricity', keys[0]) is None
+
+
+def test_zero_size_disables_the_cache(cache, monkeypatch):
+    monkeypatch.setattr(ocr_cache, 'CACHE_SIZE', 0)
+    assert cache.content_key(b'a') is None
+    assert cache.get_similar('receipt', _receipt(['milk'])) == (None, None)
+
+
+def test_disk_tier_survives_a_cleared_memory_tier(disk, cache):
+    key = cache.content_key(b'receipt')
+    cache.put('electricity', key, 412.5)
+    cache.clear()
+
+    before = cache.stats()['hits_disk']
+    assert cache.get('electricity', key) == 412.5
+    assert cache.stats()['hits_disk'] == before + 1
+    # Promoted to memory: the next hit does not touch disk
+    assert cache.get('electricity', key) == 412.5
+    assert cache.stats()['hits_disk'] == before + 1
+
+
+def test_disk_entries_from_an_older_pipeline_are_ignored(disk, cache, monkeypatch):
+    key = cache.content_key(b'receipt')
+    cache.put('receipt', key, 'old text')
+    cache.clear()
+    monkeypatch.setattr(ocr_cache, 'CACHE_VERSION', ocr_cache.CACHE_VERSION + 1)
+    assert cache.get('receipt', key) is None
+
+
+def test_disk_tier_is_pruned_to_the_most_recently_used_rows(disk, cache, monkeypatch):
+    monkeypatch.setattr(ocr_cache, 'CACHE_DB_MAX_ROWS', 2)
+    monkeypatch.setattr(ocr_cache, 'PRUNE_EVERY', 4)
+    monkeypatch.setattr(ocr_cache, '_puts_since_prune', 0)
+    for i in range(4):
+        cache.put('receipt', cache.content_key(bytes([i])), f'text {i}')
+    with sqlite3.connect(disk) as conn:
+        rows = sorted(value for (value,) in conn.execute("SELECT value FROM ocr_cache"))
+    assert rows == ['"text 2"', '"text 3"']
+
+
+def test_near_duplicates_match_only_within_the_dhash_distance(cache, monkeypatch):
+    original = _receipt(['2 kg rice', '1 l milk', '6 egg'])
+    rescanned = _receipt(['2 kg rice', '1 l milk', '6 egg'], noise=40, seed=1)
+    other = _receipt(['500 g cheese', '3 banana'])
+    distance = bin(cache.dhash(original) ^ cache.dhash(rescanned)).count('1')
+    assert 0 < distance < bin(cache.dhash(original) ^ cache.dhash(other)).count('1')
+
+    monkeypatch.setattr(ocr_cache, 'DHASH_DISTANCE', distance)
+    _, image_hash = cache.get_similar('receipt', original)
+    cache.put('receipt', cache.content_key(b'original'), 'rice milk egg', image_hash)
+    assert cache.get_similar('receipt', rescanned)[0] == 'rice milk egg'
+    assert cache.get_similar('receipt', other)[0] is None
+
+    monkeypatch.setattr(ocr_cache, 'DHASH_DISTANCE', distance - 1)
+    assert cache.get_similar('receipt', rescanned)[0] is None
+    monkeypatch.setattr(ocr_cache, 'DHASH_DISTANCE', 0)
+    assert cache.get_similar('receipt', rescanned) == (None, None)
+
+
+def test_blank_pages_have_no_dhash(cache):
+    assert cache.dhash(np.full((100, 100), 255, dtype=np.uint8)) is None
@@ -0,0 +1,72 @@
+import os
+import uuid
+
+import pytest
+
+import history_store
+import rollups
+
+
+def _trip(distance, kg):
+    return {'transport_mode': 'bus', 'distance_km': distance, 'carbon_emissions_kg': kg,
+            'timestamp': '2025-02-01T08:00:00Z'}
+
+
+@pytest.mark.parametrize('user', ['alice', 'a', 'user_01', 'bob-smith', 'bob.smith@example.org', 'x' * 64])
+def test_valid_user_ids_stay_inside_the_users_dir(user):
+    assert history_store.check_user(user) == user
+    root = os.path.realpath(history_store.USERS_DIR)
+    assert os.path.dirname(os.path.realpath(history_store.user_dir(user))) == root
+
+
+@pytest.mark.parametrize('user', ['..', '.', '.hidden', '../etc', '../../root', 'a/b', 'a\\b', '/abs',
+                                  'a\x00b', 'alice\n', 'a b', 'x' * 65, 123])
+def test_path_traversal_and_malformed_ids_are_rejected(user):
+    with pytest.raises(ValueError):
+        history_store.check_user(user)
+    with pytest.raises(ValueError):
+        history_store.get_store('transport', user=user)
+
+
+def test_missing_user_means_the_shared_partition():
+    assert history_store.check_user(None) is None
+    assert history_store.check_user('') is None
+
+
+@pytest.mark.parametrize('backend', ['jsonl', 'sqlite'])
+def test_users_never_see_each_others_history(backend):
+    alice, bob = (f"{name}-{uuid.uuid4().hex[:8]}" for name in ('alice', 'bob'))
+    shared_before = history_store.get_store('transport', backend=backend).count()
+    history_store.get_store('transport', backend=backend, user=alice).append_many([_trip(1.0, 0.1), _trip(2.0, 0.2)])
+    history_store.get_store('transport', backend=backend, user=bob).append(_trip(30.0, 3.0))
+
+    alice_rows, _ = history_store.get_store('transport', backend=backend, user=alice).query()
+    bob_rows, _ = history_store.get_store('transport', backend=backend, user=bob).query()
+    assert [r['distance_km'] for r in alice_rows] == [1.0, 2.0]
+    assert [r['distance_km'] for r in bob_rows] == [30.0]
+    assert history_store.get_store('transport', backend=backend).count() == shared_before
+    assert history_store.user_dir(alice) != history_store.user_dir(bob)
+
+
+def test_summaries_and_endpoints_only_read_the_callers_partition(user):
+    from app import app
+    other = f"other-{uuid.uuid4().hex[:8]}"
+    history_store.get_store('transport', user=user).append(_trip(5.0, 1.5))
+    history_store.get_store('transport', user=other).append(_trip(50.0, 15.0))
+
+    assert rollups.summary(user=user)['daily'][0]['transport']['emissions_kg'] == 1.5
+    assert rollups.summary(user=other)['daily'][0]['transport']['emissions_kg'] == 15.0
+
+    client = app.test_client()
+    mine = client.get('/transport/history', headers={'X-User-Id': user})
+    theirs = client.get(f'/transport/history?user={other}')
+    assert [r['distance_km'] for r in mine.get_json()] == [5.0]
+    assert [r['distance_km'] for r in theirs.get_json()] == [50.0]
+    assert mine.headers['ETag'] != theirs.headers['ETag']
+    assert 'X-User-Id' in mine.headers['Vary']
+    # Another user's ETag never validates this user's cached copy
+    assert client.get('/transport/history', headers={'X-User-Id': user,
+                                                     'If-None-Match': theirs.headers['ETag']}).status_code == 200
+
+    assert client.get('/transport/history?user=..%2Fetc').status_code == 400
+    assert client.get('/dashboard/summary', headers={'X-User-Id': '../' + user}).status_code == 400
@@ -0,0 +1,30 @@
+import cv2
+import numpy as np
+
+import preprocess
+
+
+def _photo_with_receipt_text(width=4000, height=3000, glyph_scale=1.4):
+    """A receipt on a white table: no outline to detect, text in the left third of the frame"""
+    photo = np.full((height, width), 245, dtype=np.uint8)
+    for row in range(30):
+        cv2.putText(photo, f"ITEM {row:02d} MILK 2L   4.{row:02d}", (150, 200 + row * 80),
+                    cv2.FONT_HERSHEY_SIMPLEX, glyph_scale, 20, 3, cv2.LINE_AA)
+    return photo
+
+
+def test_undetected_receipt_keeps_legible_glyphs():
+    photo = _photo_with_receipt_text()
+    assert preprocess.find_document(photo) is None
+    assert preprocess.text_height(photo) > preprocess.MIN_GLYPH_PX
+
+    prepared = preprocess.prepare(photo, 'receipt')
+    # Shrunk, but not as if the whole 4000 px frame were an 80 mm receipt (~630 px)
+    assert prepared.shape[1] > 1000
+    assert preprocess.text_height(prepared) >= preprocess.MIN_GLYPH_PX * 0.9
+
+
+def test_small_text_is_never_downscaled():
+    photo = _photo_with_receipt_text(width=2400, height=2800, glyph_scale=0.6)
+    assert preprocess.text_height(photo) < preprocess.MIN_GLYPH_PX
+    assert preprocess.prepare(photo, 'receipt').shape[1] == 2400
@@ -0,0 +1,53 @@
+import history_store
+import history_writer
+import rollups
+
+
+def _trips(count, day='2025-03-01'):
+    return [{"transport_mode": "bus", "distance_km": 1.0, "carbon_emissions_kg": 0.1,
+             "timestamp": f"{day}T{i:02d}:00:00Z"} for i in range(count)]
+
+
+def _transport_count(user):
+    rows = rollups._conn(user).execute("SELECT count FROM daily WHERE category = 'transport'")
+    return sum(count for (count,) in rows)
+
+
+def test_rollups_only_count_written_history(user, monkeypatch):
+    rollups.install()
+    rollups.rebuild(user)
+    store = history_store.get_store('transport', 'jsonl', user=user)
+
+    with history_writer.batch():
+        store.append_many(_trips(3))
+        assert _transport_count(user) == 0
+    assert _transport_count(user) == 3
+
+    def fail(path):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(history_writer, '_should_fsync', fail)
+    with history_writer.batch():
+        store.append_many(_trips(2, day='2025-03-02'))
+    assert _transport_count(user) == 3
+
+
+def test_rebuild_does_not_double_count_pending_appends(user, monkeypatch):
+    rollups.install()
+    rollups.rebuild(user)
+    store = history_store.get_store('transport', 'jsonl', user=user)
+
+    monkeypatch.setattr(history_writer, 'FLUSH_WINDOW', 3600)
+    store.append_many(_trips(4))
+    assert _transport_count(user) == 0
+    rollups.rebuild(user)
+    assert _transport_count(user) == 4 == store.count()
+
+
+def test_summary_rejects_malformed_dates(user):
+    from app import app
+    client = app.test_client()
+    assert client.get('/dashboard/summary?from=2025-13-40', headers={'X-User-Id': user}).status_code == 400
+    assert client.get('/dashboard/summary?to=yesterday', headers={'X-User-Id': user}).status_code == 400
+    assert client.get('/dashboard/summary?from=2025-03-01&to=2025-03-31',
+                      headers={'X-User-Id': user}).status_code == 200
@@ -0,0 +1,80 @@
+import pytest
+
+import history_store
+import tariff
+
+
+@pytest.fixture
+def delhi():
+    return tariff.get_tariff('delhi')
+
+
+@pytest.mark.parametrize("units, amount", [
+    (0, 20.0),
+    (-5, 20.0),
+    (200, 620.0),
+    (200.01, 620.05),
+    (400, 1520.0),
+    (800, 4120.0),
+    (1200, 6920.0),
+    (1201, 6928.0),
+])
+def test_slab_boundaries(delhi, units, amount):
+    assert delhi.price(units) == amount
+
+
+@pytest.mark.parametrize("units, amount", [
+    (538.03, 2417.20),   # 2417.195
+    (242.79, 812.56),    # 812.555
+    (873.15, 4632.05),   # 4632.05 exactly: no tie
+])
+def test_half_cent_ties_round_up(delhi, units, amount):
+    assert delhi.price(units) == amount
+    assert delhi.price_many([units]).tolist() == [amount]
+
+
+def test_custom_slabs_match_a_walk_over_the_slabs():
+    custom = tariff.Tariff('custom', 10, [(100, 2.0), (None, 5.0)])
+    assert custom.price_many([50, 100, 150]).tolist() == [110.0, 210.0, 460.0]
+    with pytest.raises(ValueError):
+        tariff.Tariff('bad', 0, [(None, 1.0), (100, 2.0)])
+
+
+def _bills(store, rows):
+    store.append_many([{"date": day, "units": units, "bill_amount": amount, "co2_emissions": 1.0, "tariff": "delhi"}
+                       for day, units, amount in rows])
+
+
+def test_reprice_leaves_bills_of_an_unchanged_tariff_alone(user):
+    store = history_store.get_store('electricity', user=user)
+    # Saved before half cents rounded up, and after
+    _bills(store, [("2025-01-01", 538.03, 2417.19), ("2025-02-01", 242.79, 812.56), ("2025-03-01", 200, 620.0)])
+
+    report = tariff.reprice(store)
+    assert report['repriced'] == 3
+    assert report['changed'] == 0
+    assert not report['rewritten']
+    assert [r['bill_amount'] for r in store.iter_records()] == [2417.19, 812.56, 620.0]
+
+
+def test_reprice_rewrites_bills_after_a_tariff_change(user, monkeypatch):
+    store = history_store.get_store('electricity', user=user)
+    _bills(store, [("2025-01-01", 538.03, 2417.19), ("2025-02-01", 100, 320.0), ("2025-03-01", 150, 470.0)])
+    changed = tariff.Tariff('delhi', 25, [(200, 3.0), (200, 4.5), (400, 6.5), (400, 7.0), (None, 8.0)])
+    monkeypatch.setitem(tariff._tariffs, 'delhi', changed)
+
+    report = tariff.reprice(store, start='2025-02-01')
+    assert report['repriced'] == 2
+    assert report['changed'] == 2
+    assert report['difference'] == 10.0
+    assert report['rewritten']
+    assert [r['bill_amount'] for r in store.iter_records()] == [2417.19, 325.0, 475.0]
+
+
+def test_reprice_endpoint_reports_no_changes_for_an_unchanged_tariff(user):
+    from app import app
+    _bills(history_store.get_store('electricity', user=user), [("2025-01-01", 242.79, 812.55)])
+    response = app.test_client().post('/electricity/reprice', headers={'X-User-Id': user}, json={})
+    assert response.status_code == 200
+    assert response.get_json()['changed'] == 0
+    assert not response.get_json()['rewritten']
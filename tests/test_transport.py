@@ -0,0 +1,37 @@
+import pytest
+
+import transport
+from app import app
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def test_batch_normalizes_timestamps():
+    results = transport.calculate_transport_emissions_batch(
+        [{'transport_mode': 'bus', 'distance': 10, 'timestamp': '2025-01-01'},
+         {'transport_mode': 'bus', 'distance': 10, 'timestamp': '2025-01-01T10:00:00+05:30'}],
+        save=False)
+    assert [r['timestamp'] for r in results] == ['2025-01-01T00:00:00Z', '2025-01-01T04:30:00Z']
+
+
+@pytest.mark.parametrize('trip', [
+    {'transport_mode': 'bus', 'distance': 10, 'timestamp': 'yesterday'},
+    {'transport_mode': 'bus', 'distance': 10, 'timestamp': 12345},
+    {'transport_mode': 'bus', 'distance': float('inf')},
+    {'transport_mode': 'bus', 'distance': '1e400'},
+    'bus,10',
+])
+def test_batch_rejects_invalid_trip(trip):
+    with pytest.raises(ValueError, match='rows 2'):
+        transport.calculate_transport_emissions_batch([{'transport_mode': 'bus', 'distance': 1}, trip], save=False)
+
+
+def test_batch_endpoint_rejects_invalid_items_with_400(client, user):
+    for trips in ([{'transport_mode': 'bus', 'distance': 3, 'timestamp': 'yesterday'}], ['not a trip'], [None]):
+        response = client.post('/transport/calculate_batch', json=trips, headers={'X-User-Id': user})
+        assert response.status_code == 400
+    history = client.get('/transport/history', headers={'X-User-Id': user}).get_json()
+    assert history == []
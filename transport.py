@@ -1,8 +1,10 @@
-import json
+import csv
 import logging
-import os
 import datetime
+import numpy as np
 from datetime import timezone
+import history_store
+import metrics
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -17,12 +19,14 @@ TRANSPORT_EMISSION_FACTORS = {
     'plane': 0.255
 }
 
-def calculate_transport_emissions(transport_mode, distance):
+@metrics.timed('transport_calculate')
+def calculate_transport_emissions(transport_mode, distance, user=None):
     """
     Calculate carbon emissions based on transport mode and distance.
     Args:
         transport_mode (str): Mode of transport (car, bus, train, plane)
         distance (float): Distance traveled in kilometers
+        user (str): History partition to save to (default: the shared history)
     Returns:
         dict: Result containing transport mode, distance, and emissions
     Raises:
@@ -42,19 +46,112 @@ def calculate_transport_emissions(transport_mode, distance):
         'timestamp': datetime.datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
     }
 
-    # Save to JSON
+    # Save to history
     try:
-        json_file = 'static/transport_emissions.json'
-        os.makedirs('static', exist_ok=True)
-        
-        # Use 'a+' to allow reading if needed, but mainly for safety
-        with open(json_file, 'a', encoding='utf-8') as f:
-            json.dump([result], f)
-            f.write('\n')  # ← This must always happen
-            f.flush()      # ← Force write to disk
-        logger.debug(f"Saved transport emissions to {json_file}")
+        history_store.get_store('transport', user=user).append(result)
+        logger.debug("Saved transport emissions to history")
     except Exception as e:
         logger.error(f"CRITICAL: Failed to save transport emissions: {str(e)}")
-        # Optional: fallback to in-memory or retry
 
-    return result
\ No newline at end of file
+    return result
+
+# Factor lookup table for vectorized batches: mode -> index into _FACTOR_ARRAY
+_MODE_INDEX = {mode: i for i, mode in enumerate(TRANSPORT_EMISSION_FACTORS)}
+_FACTOR_ARRAY = np.array(list(TRANSPORT_EMISSION_FACTORS.values()), dtype=np.float64)
+MAX_REPORTED_ERRORS = 10
+
+def parse_trips_csv(stream):
+    """
+    Read trips from CSV text with transport_mode, distance and optional timestamp columns.
+    Args:
+        stream: Iterable of CSV lines (file object or list of strings)
+    Returns:
+        list: Trip dicts suitable for calculate_transport_emissions_batch
+    """
+    reader = csv.DictReader(stream)
+    if not reader.fieldnames or 'transport_mode' not in reader.fieldnames or 'distance' not in reader.fieldnames:
+        raise ValueError("CSV must have 'transport_mode' and 'distance' columns")
+    return [row for row in reader]
+
+def _normalize_timestamp(value):
+    """
+    A trip's timestamp as UTC ISO with a trailing Z, like the single-trip path saves;
+    naive values are read as UTC. None if no timestamp was given.
+    Raises:
+        ValueError: If the value is not an ISO date or timestamp
+    """
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    if not isinstance(value, str):
+        raise ValueError("Invalid timestamp")
+    parsed = datetime.datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+@metrics.timed('transport_calculate_batch')
+def calculate_transport_emissions_batch(trips, save=True, user=None):
+    """
+    Calculate emissions for many trips in one vectorized pass.
+    Args:
+        trips (list): Dicts with transport_mode, distance and optional timestamp
+        save (bool): Append all results to history in a single grouped write
+        user (str): History partition to save to (default: the shared history)
+    Returns:
+        list: One result per trip, in the same shape as calculate_transport_emissions
+    Raises:
+        ValueError: If any trip has an invalid mode or non-positive distance (nothing is saved)
+    """
+    if not trips:
+        raise ValueError("No trips provided")
+
+    now = datetime.datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+    is_trip = np.array([isinstance(trip, dict) for trip in trips], dtype=bool)
+    trips = [trip if isinstance(trip, dict) else {} for trip in trips]
+    modes = [str(trip.get('transport_mode', '')).strip().lower() for trip in trips]
+    codes = np.array([_MODE_INDEX.get(mode, -1) for mode in modes], dtype=np.int64)
+    distances = np.empty(len(trips), dtype=np.float64)
+    timestamps = []
+    invalid_timestamp = np.zeros(len(trips), dtype=bool)
+    for i, trip in enumerate(trips):
+        try:
+            distances[i] = float(trip.get('distance'))
+        except (TypeError, ValueError):
+            distances[i] = np.nan
+        try:
+            timestamps.append(_normalize_timestamp(trip.get('timestamp')) or now)
+        except ValueError:
+            timestamps.append(None)
+            invalid_timestamp[i] = True
+
+    invalid_mode = codes < 0
+    invalid_distance = ~(np.isfinite(distances) & (distances > 0))
+    invalid = np.flatnonzero(~is_trip | invalid_mode | invalid_distance | invalid_timestamp)
+    if invalid.size:
+        rows = ", ".join(str(i + 1) for i in invalid[:MAX_REPORTED_ERRORS])
+        more = f" (+{invalid.size - MAX_REPORTED_ERRORS} more)" if invalid.size > MAX_REPORTED_ERRORS else ""
+        raise ValueError(
+            f"Invalid trips at rows {rows}{more}. Each trip must be an object; modes must be one of: "
+            f"{', '.join(TRANSPORT_EMISSION_FACTORS.keys())}; distance must be a finite number greater than 0; "
+            f"timestamp, if given, must be an ISO date or timestamp"
+        )
+
+    emissions = distances * _FACTOR_ARRAY[codes]
+    results = [
+        {
+            'transport_mode': mode,
+            'distance_km': distance,
+            'carbon_emissions_kg': round(emission, 2),
+            'timestamp': timestamp
+        }
+        for mode, distance, emission, timestamp in zip(modes, distances.tolist(), emissions.tolist(), timestamps)
+    ]
+
+    if save:
+        try:
+            history_store.get_store('transport', user=user).append_many(results)
+            logger.debug(f"Saved {len(results)} transport emissions to history")
+        except Exception as e:
+            logger.error(f"CRITICAL: Failed to save transport emissions batch: {str(e)}")
+
+    return results